@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""Stand-in for the LUMPREM executable, used by the benchmarks.
+
+Follows the command line protocol of LUMPREM: the input file name and the output file name are read from standard
+input. The timing block of the input file is read and a synthetic output file is written with one row per output
+day, so process start-up and file I/O are close to those of a real run. No recharge is simulated.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic
+
+
+def read_timing(infile):
+    """Returns the output days listed in the timing information block of a LUMPREM input file, with day 0 first."""
+    with open(infile) as f:
+        lines = f.read().splitlines()
+    i = [k for k, line in enumerate(lines) if line.startswith('* timing')][0]
+    numdays, noutdays = [int(x) for x in lines[i+1].split()[:2]]
+    days = []
+    k = i+2
+    while len(days) < noutdays:
+        days += [int(x) for x in lines[k].split()]
+        k += 1
+    return [0]+days
+
+
+def main():
+    names = sys.stdin.read().split()
+    if len(names) < 2:
+        print(' Error: enter the names of the LUMPREM input and output files.')
+        return 1
+    print(' Program LUMPREM (benchmark stand-in)')
+    try:
+        days = read_timing(names[0])
+    except (OSError, IndexError, ValueError) as e:
+        print(' Error reading file '+names[0]+': '+str(e))
+        return 1
+    synthetic.write_out(names[1], days)
+    print(' - file '+names[1]+' written ok.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""Benchmarks of lumpyrem on synthetic workloads.
+
+Each case is timed on workspaces of 1, 100, 1,000 and 10,000 models with daily and monthly outputs. Workspaces are
+generated with synthetic.py, and LUMPREM is replaced by lumprem_standin.py, so no PEST suite executables are needed.
+Cases use the API of the first release of lumpyrem, with newer functions (write_models, read_results, run_models)
+used where they exist, so the suite runs at every commit and its timings can be compared. A case whose API does
+not exist at a commit is recorded as skipped, and a case that raises is recorded as failed.
+Results are saved as JSON together with the git commit and package versions, and two result files can be compared:
+
+    python benchmarks/run_benchmarks.py --output bench_new.json
+    python benchmarks/run_benchmarks.py --sizes 1 100 --freq monthly --cases write_models read_results
+    python benchmarks/run_benchmarks.py --compare bench_old.json bench_new.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import inspect
+import tempfile
+import subprocess
+import contextlib
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import synthetic
+from lumpyrem import lumprem, lumprep, lr2series, pest
+
+
+class Unsupported(Exception):
+    """Raised by a case whose API does not exist in the lumpyrem version benchmarked."""
+
+
+def supports(func, argument):
+    """Returns True if func takes a keyword argument named argument."""
+    return argument in inspect.signature(func).parameters
+
+
+def case_write_model(models, workspace, settings, args):
+    for m in models:
+        m.write_model(print_output=False, **settings)
+
+
+def case_write_models(models, workspace, settings, args):
+    if hasattr(lumprem, 'write_models'):
+        lumprem.write_models(models, tpl=False, print_output=False, **settings)
+    else:
+        case_write_model(models, workspace, settings, args)
+
+
+def case_model_get_results(models, workspace, settings, args):
+    for m in models:
+        m.get_results()
+
+
+def case_model_get_frames(models, workspace, settings, args):
+    if not supports(lumprem.Model.get_results, 'merge'):
+        raise Unsupported('Model.get_results(merge=False)')
+    for m in models:
+        m.get_results(merge=False)
+
+
+def case_read_results(models, workspace, settings, args):
+    if hasattr(lumprem, 'read_results'):
+        lumprem.read_results(models, columns=['total_rech', 'elevation'])
+    else:
+        for m in models:
+            m.get_results()[['total_rech', 'elevation']]
+
+
+def case_simulation_get_results(models, workspace, settings, args):
+    sim = lumprep.Simulation(models, ('silofile.txt', 'evap'), settings['start_date'], settings['end_date'],
+                             workspace=workspace)
+    sim.get_results()
+
+
+def case_read_ts(models, workspace, settings, args):
+    lr2series.read_ts(os.path.join(workspace, 'bench.ts'))
+
+
+def case_write_ts(models, workspace, settings, args):
+    if not supports(lr2series.TimeSeries.write_ts, 'backend'):
+        raise Unsupported('TimeSeries.write_ts(backend=\'python\')')
+    ts = lr2series.TimeSeries('out.ts', models, ['rch'], ['total_rech'], ['linearend'], workspace=workspace)
+    ts.write_ts(backend='python')
+
+
+def case_write_pst(models, workspace, settings, args):
+    pest.write_pst(os.path.join(workspace, 'bench.pst'), models)
+
+
+def case_run_models(models, workspace, settings, args):
+    if hasattr(lumprem, 'run_models'):
+        status = lumprem.run_models(models, workers=args.workers)
+        if status['success'].all() == False:
+            raise RuntimeError(str((~status['success']).sum())+' stand-in runs failed, see the .log files in '+workspace)
+    else:
+        for m in models:
+            m.run_model(print_output=False)
+
+
+CASES = {'write_model':case_write_model, 'write_models':case_write_models,
+         'model_get_results':case_model_get_results, 'model_get_frames':case_model_get_frames,
+         'read_results':case_read_results, 'simulation_get_results':case_simulation_get_results,
+         'read_ts':case_read_ts, 'write_ts':case_write_ts, 'write_pst':case_write_pst, 'run_models':case_run_models}
+
+# cases that read output files, and so scale with the number of output rows
+READERS = ['model_get_results', 'model_get_frames', 'read_results', 'simulation_get_results', 'read_ts', 'write_ts']
+
+
+def standin_path(folder):
+    """Writes a 'lumprem' launcher for lumprem_standin.py in folder and returns folder, to be put first on PATH."""
+    exe = os.path.join(folder, 'lumprem')
+    with open(exe, 'w') as f:
+        f.write('#!/bin/sh\nexec "'+sys.executable+'" "'+os.path.join(HERE, 'lumprem_standin.py')+'" "$@"\n')
+    os.chmod(exe, 0o755)
+    return folder
+
+
+def environment():
+    """Returns the git commit, versions and machine of the benchmark run."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, encoding='ascii').stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit':commit, 'date':time.strftime('%Y-%m-%d %H:%M:%S'), 'python':platform.python_version(),
+            'numpy':np.__version__, 'pandas':pd.__version__, 'platform':platform.platform(),
+            'cpus':os.cpu_count()}
+
+
+def time_case(func, models, workspace, settings, args):
+    """Runs a case args.repeat times with printing suppressed and returns the wall times in seconds."""
+    times = []
+    for i in range(args.repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            func(models, workspace, settings, args)
+            times.append(time.perf_counter()-t0)
+    return times
+
+
+def run_benchmarks(args):
+    """Runs the selected cases for each size and output frequency. Returns a list of result records."""
+    records = []
+    with tempfile.TemporaryDirectory(dir=args.tmpdir) as tmp:
+        os.environ['PATH'] = standin_path(tmp)+os.pathsep+os.environ.get('PATH', '')
+        for freq in args.freq:
+            for n in args.sizes:
+                numdays, days = synthetic.output_days(freq, args.years)
+                rows = n*len(days)
+                workspace = os.path.join(tmp, freq+'_'+str(n))
+                models = None
+                for case in args.cases:
+                    record = {'case':case, 'nmodels':n, 'freq':freq, 'rows':rows, 'times':[], 'min':None,
+                              'median':None, 'skipped':''}
+                    if case in READERS and rows > args.max_rows:
+                        record['skipped'] = 'more than --max-rows output rows'
+                    elif case == 'run_models' and n > args.max_runs:
+                        record['skipped'] = 'more than --max-runs models'
+                    else:
+                        if models == None:
+                            models, settings = synthetic.make_workspace(workspace, n, freq, args.years)
+                            synthetic.write_ts_file(os.path.join(workspace, 'bench.ts'), n, len(days))
+                            if 'run_models' in args.cases:
+                                with contextlib.redirect_stdout(io.StringIO()):
+                                    case_write_models(models, workspace, settings, args)
+                        try:
+                            record['times'] = time_case(CASES[case], models, workspace, settings, args)
+                            record['min'] = min(record['times'])
+                            record['median'] = float(np.median(record['times']))
+                        except Unsupported as e:
+                            record['skipped'] = 'not available: '+str(e)
+                        except Exception as e:
+                            record['skipped'] = 'failed: '+type(e).__name__+': '+str(e)
+                    records.append(record)
+                    print_record(record)
+                if models != None:
+                    shutil.rmtree(workspace, ignore_errors=True)
+    return records
+
+
+def print_record(record):
+    if record['skipped'] != '':
+        print("{0:<24}{1:>7} {2:<8} skipped: {3}".format(record['case'], record['nmodels'], record['freq'], record['skipped']))
+    else:
+        print("{0:<24}{1:>7} {2:<8}{3:>12.4f} s".format(record['case'], record['nmodels'], record['freq'], record['min']))
+    sys.stdout.flush()
+
+
+def compare(base_file, new_file):
+    """Prints the best times of two result files side by side, with the ratio new/base.
+
+    Parameters
+    ----------
+    base_file : str
+        JSON results of the reference commit.
+    new_file : str
+        JSON results to compare with it.
+
+    Returns
+    -------
+    table : DataFrame
+        one row per case, size and output frequency found in both files.
+    """
+    frames = []
+    for file in [base_file, new_file]:
+        with open(file) as f:
+            data = json.load(f)
+        print(os.path.basename(file)+': commit '+data['environment']['commit']+', '+data['environment']['date'])
+        frames.append(pd.DataFrame(data['results']).set_index(['case', 'nmodels', 'freq'])['min'])
+    table = pd.concat(frames, axis=1, keys=['base', 'new'], join='inner').dropna()
+    table['ratio'] = table['new']/table['base']
+    with pd.option_context('display.max_rows', None, 'display.float_format', '{0:.4f}'.format):
+        print(table)
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of lumpyrem on synthetic LUMPREM workloads.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 1000, 10000], help='numbers of models')
+    parser.add_argument('--freq', nargs='+', default=['daily', 'monthly'], choices=['daily', 'monthly'], help='output frequencies')
+    parser.add_argument('--cases', nargs='+', default=list(CASES), choices=list(CASES), help='cases to run')
+    parser.add_argument('--years', type=float, default=10, help='simulation length in years')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timings of each case; the best is reported')
+    parser.add_argument('--workers', type=int, default=None, help='workers of run_models (default number of CPUs)')
+    parser.add_argument('--max-rows', type=float, default=4e6, help='skip readers above this number of output rows')
+    parser.add_argument('--max-runs', type=int, default=1000, help='skip run_models above this number of models')
+    parser.add_argument('--tmpdir', default=None, help='folder for the synthetic workspaces (default system temp)')
+    parser.add_argument('--output', default='bench_results.json', help='JSON file to save the results to')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), default=None, help='compare two result files and exit')
+    args = parser.parse_args(argv)
+
+    if args.compare != None:
+        compare(*args.compare)
+        return 0
+
+    env = environment()
+    print('lumpyrem benchmarks, commit '+env['commit']+', python '+env['python']+', '+str(env['cpus'])+' cpus')
+    records = run_benchmarks(args)
+    with open(args.output, 'w') as f:
+        json.dump({'environment':env, 'settings':{'years':args.years, 'repeat':args.repeat, 'workers':args.workers},
+                   'results':records}, f, indent=1)
+    print('Benchmark results written to: \n'+args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
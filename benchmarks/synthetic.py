@@ -0,0 +1,159 @@
+"""Synthetic LUMPREM workloads for the lumpyrem benchmarks.
+
+Output (.out) and timeseries (.ts) files are generated with the layout written by LUMPREM and LR2SERIES, so the
+readers and writers of lumpyrem can be timed without the LUMPREM executables. Only numpy is imported at module
+level, so the LUMPREM stand-in (lumprem_standin.py) starts quickly.
+
+Workloads are built without lumpyrem (except the Model objects), so they are the same at every commit and timings
+can be compared across commits.
+"""
+import os
+import shutil
+import datetime as dt
+import numpy as np
+
+COLUMNS = ['days', 'volume', 'vol_drain', 'vol_macro', 'delta_vol', 'del_vol_drain', 'del_vol_macro',
+           'rainfall', 'irrigation', 'recharge', 'macro_rech', 'total_rech', 'gw_withdrawal', 'net_recharge',
+           'runoff', 'pot_evap', 'evaporation', 'gw_pot_evap', 'balance', 'elevation', 'depth-to-water']
+
+
+def model_names(n):
+    """Returns n distinct model names of three characters or less ('000', '001', ... in base 36)."""
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    if n > 36**3:
+        raise ValueError('At most '+str(36**3)+' three character model names.')
+    return [digits[i//1296]+digits[i//36 % 36]+digits[i % 36] for i in range(n)]
+
+
+def output_days(freq='daily', years=10, start_date='01/01/2000'):
+    """Returns the simulation length and the output days of a run, day 0 included as in LUMPREM output files.
+    Monthly outputs are on the first day of each month.
+
+    Parameters
+    ----------
+    freq : str, optional
+        'daily' (default) or 'monthly'.
+    years : float, optional
+        length of the simulation in years (default 10).
+    start_date : str, optional
+        date on which the simulation starts in 'dd/mm/yyyy' format (default '01/01/2000').
+
+    Returns
+    -------
+    numdays : int
+        number of days of the run.
+    days : numpy array
+        output days, starting with 0.
+    """
+    numdays = int(round(365.25*years))
+    if freq != 'monthly':
+        return numdays, np.arange(numdays+1)
+    start = dt.datetime.strptime(start_date, '%d/%m/%Y')
+    days = [d for d in range(1, numdays+1) if (start+dt.timedelta(days=d)).day == 1]
+    return numdays, np.array([0]+days)
+
+
+def timing(freq='daily', years=10, start_date='01/01/2000'):
+    """Returns the timing settings of Model.write_model for a run: numdays, noutdays, start_date and end_date.
+    These arguments are accepted by every version of lumpyrem."""
+    numdays = int(round(365.25*years))
+    end_date = dt.datetime.strptime(start_date, '%d/%m/%Y')+dt.timedelta(days=numdays)
+    return {'numdays':numdays, 'noutdays':'monthly' if freq == 'monthly' else None, 'start_date':start_date,
+            'end_date':end_date.strftime('%d/%m/%Y')}
+
+
+def output_table(days, seed=0):
+    """Returns plausible LUMPREM outputs for the given output days, shape (ndays, len(COLUMNS)).
+    Values are random but repeatable for a seed."""
+    rng = np.random.default_rng(seed)
+    n = len(days)
+    data = np.abs(rng.normal(0.0, 0.01, size=(n, len(COLUMNS))))
+    data[:, 0] = days
+    data[:, 1] = 0.25+0.1*np.sin(np.asarray(days)*2*np.pi/365.25)
+    data[:, COLUMNS.index('elevation')] = 2.0+data[:, 1]
+    data[:, COLUMNS.index('depth-to-water')] = -data[:, COLUMNS.index('elevation')]
+    data[0, 2:-2] = 0.0
+    return data
+
+
+def write_out(filename, days, seed=0):
+    """Writes a synthetic LUMPREM output file, with the column header and totals footer of LUMPREM.
+
+    Parameters
+    ----------
+    filename : str
+        name of the .out file to write.
+    days : array-like
+        output days, starting with 0.
+    seed : int, optional
+        seed of the random values (default 0).
+    """
+    data = output_table(days, seed)
+    first = COLUMNS.index('rainfall')
+    last = COLUMNS.index('balance')
+    header = "{0:>6}".format(COLUMNS[0])+''.join("{0:>15}".format(c) for c in COLUMNS[1:])
+    footer = ' \n total'+15*(first-1)*' '+''.join("{0:>15.7G}".format(x) for x in data[:, first:last+1].sum(axis=0))
+    np.savetxt(filename, data, fmt=['%6d']+(len(COLUMNS)-1)*['%15.7G'], header=header, footer=footer, comments='')
+
+
+def make_workspace(path, nmodels, freq='daily', years=10, start_date='01/01/2000'):
+    """Creates nmodels LUMPREM models in path, each with a synthetic output file.
+    One output file is generated and copied for every model, so setting up large workspaces is cheap.
+
+    Parameters
+    ----------
+    path : path
+        folder to create the models in.
+    nmodels : int
+        number of models.
+    freq : str, optional
+        'daily' (default) or 'monthly' outputs.
+    years : float, optional
+        length of the simulation in years (default 10).
+    start_date : str, optional
+        date on which the simulation starts in 'dd/mm/yyyy' format (default '01/01/2000').
+
+    Returns
+    -------
+    models : list
+        lumprem Model objects.
+    settings : dict
+        timing settings of the models, see timing.
+    """
+    from lumpyrem import lumprem
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+    numdays, days = output_days(freq, years, start_date)
+    template = os.path.join(path, 'template.out')
+    write_out(template, days)
+    models = []
+    for name in model_names(nmodels):
+        models.append(lumprem.Model(name, workspace=path))
+        shutil.copyfile(template, os.path.join(path, 'lr_'+name+'.out'))
+    os.remove(template)
+    return models, timing(freq, years, start_date)
+
+
+def write_ts_file(filename, nseries, ntimes, seed=0):
+    """Writes a synthetic MODFLOW 6 timeseries file with nseries timeseries and ntimes times, in the G15.7 layout of
+    LR2SERIES.
+
+    Parameters
+    ----------
+    filename : str
+        name of the .ts file to write.
+    nseries : int
+        number of timeseries.
+    ntimes : int
+        number of times.
+    seed : int, optional
+        seed of the random values (default 0).
+    """
+    rng = np.random.default_rng(seed)
+    data = np.column_stack([np.arange(ntimes, dtype=np.float64),
+                            np.abs(rng.normal(0.0, 1e-3, size=(ntimes, nseries)))])
+    tsnames = ['ts'+str(i) for i in range(nseries)]
+    header = ('BEGIN ATTRIBUTES\n   NAMES '+' '.join(tsnames)+'\n   METHODS '+' '.join(nseries*['LINEAREND'])+
+              '\nEND ATTRIBUTES\n \n \nBEGIN TIMESERIES')
+    np.savetxt(filename, data, fmt='%15.7G', delimiter='', header=header, footer='END TIMESERIES', comments='')
@@ -4,6 +4,15 @@ from . import run
 from . import lumprep
 from . import lr2series
 from . import pest
+from . import engine
+from . import cache
+from . import climate
+from . import timeaxis
+from . import profiling
+from . import mf6
+from . import ensemble
+from . import resultstore
+from . import warmstart
 
 from os.path import dirname, basename, isfile
 import glob
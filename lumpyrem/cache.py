@@ -0,0 +1,273 @@
+"""Content-addressed cache of LUMPREM outputs.
+
+A model run is identified by a hash of its input file and of the data files it references (rain, evaporation,
+vegetation and irrigation files). If a model is run again with the same inputs, its output files are copied
+from the cache instead of calling LUMPREM.
+"""
+import os
+import time
+import shutil
+import hashlib
+import threading
+from lumpyrem import run
+
+
+def referenced_files(infile):
+    """Returns the data files referenced in the '* data filenames' section of a LUMPREM input file.
+    Only names of files that exist next to the input file are returned; numbers (crop factors, irrigation codes) are skipped.
+
+    Parameters
+    ----------
+    infile : str
+        path to the LUMPREM input file.
+
+    Returns
+    -------
+    files : list of str
+        paths of the referenced files.
+    """
+    path = os.path.dirname(infile)
+    files = []
+    section = False
+    with open(infile) as f:
+        for line in f:
+            if line.startswith('*'):
+                section = 'data filenames' in line
+            elif section:
+                for token in line.split():
+                    if os.path.isfile(os.path.join(path, token)):
+                        files.append(os.path.join(path, token))
+    return files
+
+
+class RunCache():
+    """
+    A cache of LUMPREM output files keyed by the hash of the model inputs, with least-recently-used eviction.
+
+    Attributes
+    ----------
+    cache_dir : path
+        folder in which cached outputs are stored, one sub-folder per key.
+    max_size : int
+        maximum total size of the cache in bytes. The least recently used entries are removed beyond it.
+    hits : int
+        number of runs restored from the cache.
+    misses : int
+        number of runs not found in the cache.
+    """
+
+    def __init__(self, cache_dir='lr_cache', max_size=2**30):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # sizes of existing entries, so the cap holds across sessions
+        self.sizes = {}
+        self.scan()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def scan(self):
+        """Reads the sizes of the entries on disk, including those stored by other processes sharing cache_dir.
+        Temporary folders of stores in progress are skipped."""
+        sizes = {}
+        for key in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, key)
+            if '.' in key or not os.path.isdir(entry):
+                continue
+            try:
+                sizes[key] = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            except OSError:
+                # removed by another process while being read
+                continue
+        self.sizes = sizes
+
+    def key(self, infile, process='lumprem'):
+        """Returns the cache key of a model run.
+
+        Parameters
+        ----------
+        infile : str
+            path to the LUMPREM input file.
+        process : str, optional
+            executable that runs the model (default 'lumprem'). Runs by LUMPREM and LUMPREM2 are cached separately.
+
+        Returns
+        -------
+        key : str
+            hex digest of the executable name, the input file and the files it references.
+        """
+        h = hashlib.sha1(process.encode())
+        for file in [infile]+referenced_files(infile):
+            h.update(os.path.basename(file).encode())
+            with open(file, 'rb') as f:
+                h.update(f.read())
+        return h.hexdigest()
+
+    def restore(self, key, outputs, path):
+        """Copies cached outputs into path. Returns True on a hit, False on a miss.
+
+        Parameters
+        ----------
+        key : str
+            cache key, see key.
+        outputs : list of str
+            names of the output files, e.g. ['lr_abc.out', 'lr_abc.csv'].
+        path : path
+            folder to copy the outputs to.
+        """
+        entry = os.path.join(self.cache_dir, key)
+        # the disk is checked rather than self.sizes, so entries stored by other processes are found
+        found = os.path.isdir(entry)
+        if found:
+            try:
+                os.utime(entry)
+                for i, out in enumerate(outputs):
+                    cached = os.path.join(entry, str(i))
+                    if os.path.exists(cached):
+                        shutil.copyfile(cached, os.path.join(path, out))
+            except OSError:
+                # evicted by another process meanwhile
+                found = False
+        with self.lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return found
+
+    def store(self, key, outputs, path):
+        """Adds the outputs of a run to the cache and evicts least recently used entries beyond max_size.
+
+        Parameters
+        ----------
+        key : str
+            cache key, see key.
+        outputs : list of str
+            names of the output files. Files that were not written are skipped.
+        path : path
+            folder holding the outputs.
+        """
+        entry = os.path.join(self.cache_dir, key)
+        tmp = entry+'.'+str(os.getpid())+'.'+str(threading.get_ident())
+        os.makedirs(tmp, exist_ok=True)
+        size = 0
+        for i, out in enumerate(outputs):
+            file = os.path.join(path, out)
+            if os.path.exists(file):
+                shutil.copyfile(file, os.path.join(tmp, str(i)))
+                size += os.path.getsize(file)
+
+        with self.lock:
+            try:
+                os.replace(tmp, entry)
+            except OSError:
+                # already stored, by this or another process
+                shutil.rmtree(tmp, ignore_errors=True)
+                if not os.path.isdir(entry):
+                    raise
+            self.sizes[key] = size
+            self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the cache is within max_size.
+        Sizes are read from disk first, so entries stored by other processes count towards the cap."""
+        self.scan()
+        total = sum(self.sizes.values())
+        if total <= self.max_size:
+            return
+        used = {}
+        for key in self.sizes:
+            try:
+                used[key] = os.path.getmtime(os.path.join(self.cache_dir, key))
+            except OSError:
+                used[key] = 0.0
+        for key in sorted(used, key=used.get):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total -= self.sizes.pop(key)
+
+    def clear(self):
+        """Removes all entries and resets the counters."""
+        with self.lock:
+            self.scan()
+            for key in list(self.sizes):
+                shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            self.sizes = {}
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Returns a dict with the number of hits, misses, entries and the cache size in bytes."""
+        with self.lock:
+            self.scan()
+        return {'hits':self.hits, 'misses':self.misses, 'entries':len(self.sizes), 'size':sum(self.sizes.values())}
+
+    def run_jobs(self, jobs, workers=1, timeout=None, print_output=False):
+        """Runs LUMPREM jobs like run.run_jobs, restoring outputs from the cache where the inputs are unchanged.
+        The first command of each job is the input file and the remaining commands are its output files.
+
+        Parameters
+        ----------
+        jobs : list of dict
+            keyword arguments for run.run_job ('process', 'path', 'commands', 'name', ...).
+        workers : int, optional
+            maximum number of processes running at the same time (default 1).
+        timeout : float, optional
+            per-job timeout in seconds (default None, no limit).
+        print_output : bool, optional
+            True, failed jobs are reported as they finish (default False).
+
+        Returns
+        -------
+        status : DataFrame
+            as returned by run.run_jobs, with an extra 'cached' column.
+        """
+        import pandas as pd
+
+        keys = []
+        todo = []
+        records = []
+        positions = []
+        for i, job in enumerate(jobs):
+            path = job.get('path', False)
+            if path == False:
+                path = os.getcwd()
+            commands = job['commands']
+            t0 = time.perf_counter()
+            key = self.key(os.path.join(path, commands[0]), job['process'])
+            if self.restore(key, commands[1:], path):
+                status = run.new_status(job.get('name', job['process']))
+                status.update({'returncode':0, 'success':True, 'wall_time':time.perf_counter()-t0})
+                records.append(status)
+                positions.append(i)
+            else:
+                keys.append((key, commands[1:], path))
+                todo.append(job)
+
+        ran = run.run_jobs(todo, workers=workers, timeout=timeout, print_output=print_output)
+        for (key, outputs, path), success in zip(keys, ran['success']):
+            if success and os.path.exists(os.path.join(path, outputs[0])):
+                self.store(key, outputs, path)
+
+        cached = run.job_table(records)
+        cached['cached'] = True
+        ran['cached'] = False
+        # job positions, not names: the same model name can appear in many jobs (e.g. ensemble realizations)
+        cached['job'] = positions
+        hit = set(positions)
+        ran['job'] = [i for i in range(len(jobs)) if i not in hit]
+        status = pd.concat([cached, ran], ignore_index=True)
+        status = status.sort_values('job', kind='stable').drop(columns='job')
+        return status.reset_index(drop=True)
@@ -0,0 +1,271 @@
+"""Multi-site daily climate store.
+
+Rain and potential evaporation of many sites (e.g. the grid cells paired with LUMPREM zones) are held in two
+memory-mapped arrays of shape (site, day) in one folder. Arrays are opened on first use and only the sites and
+date windows that are asked for are read. LUMPREM rain and evaporation files are written from the store on demand.
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+from lumpyrem import lumprep
+
+VARIABLES = ['rain', 'epot']
+
+
+class ClimateStore():
+    """
+    A folder holding daily rain and potential evaporation for many sites as memory-mapped arrays.
+    Values are stored in m/day in single precision, as in LUMPREM data files.
+
+    Attributes
+    ----------
+    path : path
+        folder of the store.
+    sites : list of str
+        site names, in row order.
+    start_date : Timestamp
+        date of the first column (day 1 of a LUMPREM file written from the first day).
+    numdays : int
+        number of days held for each site.
+    """
+
+    def __init__(self, path, mode='r'):
+        """Opens an existing store. Arrays are not read until they are used.
+
+        Parameters
+        ----------
+        path : path
+            folder of the store, as created with ClimateStore.create.
+        mode : str, optional
+            'r' (default) read only, 'r+' read and write.
+        """
+        self.path = path
+        self.mode = mode
+        with open(os.path.join(path, 'climate.json')) as f:
+            meta = json.load(f)
+        self.sites = meta['sites']
+        self.start_date = pd.Timestamp(meta['start_date'])
+        self.numdays = meta['numdays']
+        self.index = {s:i for i, s in enumerate(self.sites)}
+        self.arrays = {}
+
+    @classmethod
+    def create(cls, path, sites, start_date, end_date):
+        """Creates an empty store (filled with zeros) and returns it opened for writing.
+
+        Parameters
+        ----------
+        path : path
+            folder of the store. Created if it does not exist.
+        sites : list of str
+            site names.
+        start_date : str
+            first day held, in 'dd/mm/yyyy' format.
+        end_date : str
+            last day held, in 'dd/mm/yyyy' format.
+
+        Returns
+        -------
+        store : ClimateStore
+        """
+        start = pd.to_datetime(start_date, format='%d/%m/%Y')
+        numdays = (pd.to_datetime(end_date, format='%d/%m/%Y')-start).days+1
+        sites = [str(s) for s in sites]
+        if not os.path.exists(path):
+            os.makedirs(path)
+        for v in VARIABLES:
+            a = np.lib.format.open_memmap(os.path.join(path, v+'.npy'), mode='w+', dtype=np.float32,
+                                          shape=(len(sites), numdays))
+            a.flush()
+            del a
+        with open(os.path.join(path, 'climate.json'), 'w') as f:
+            json.dump({'sites':sites, 'start_date':start.strftime('%Y-%m-%d'), 'numdays':numdays}, f)
+        return cls(path, mode='r+')
+
+    def array(self, variable):
+        """Returns the memory-mapped (site, day) array of 'rain' or 'epot', opening it on first use."""
+        if variable not in self.arrays:
+            self.arrays[variable] = np.load(os.path.join(self.path, variable+'.npy'), mmap_mode=self.mode)
+        return self.arrays[variable]
+
+    def window(self, start_date=None, end_date=None):
+        """Returns the column slice of a date window. Dates are 'dd/mm/yyyy' strings; None means the first or last day held."""
+        first = 0
+        last = self.numdays
+        if start_date != None:
+            first = (pd.to_datetime(start_date, format='%d/%m/%Y')-self.start_date).days
+        if end_date != None:
+            last = (pd.to_datetime(end_date, format='%d/%m/%Y')-self.start_date).days+1
+        if first < 0 or last > self.numdays or first >= last:
+            raise ValueError('Date window outside of the climate store: '+str(start_date)+' - '+str(end_date))
+        return slice(first, last)
+
+    def get(self, sites, variable='rain', start_date=None, end_date=None):
+        """Reads the series of some sites over a date window.
+
+        Parameters
+        ----------
+        sites : str or list of str
+            site name or names.
+        variable : str, optional
+            'rain' (default) or 'epot'.
+        start_date : str, optional
+            first day in 'dd/mm/yyyy' format (default first day held).
+        end_date : str, optional
+            last day in 'dd/mm/yyyy' format (default last day held).
+
+        Returns
+        -------
+        values : numpy array
+            shape (ndays,) for a single site, (nsites, ndays) for a list of sites.
+        """
+        cols = self.window(start_date, end_date)
+        if type(sites) == str:
+            return np.array(self.array(variable)[self.index[sites], cols])
+        rows = [self.index[s] for s in sites]
+        return self.array(variable)[rows, cols]
+
+    def set(self, site, rain=None, epot=None, start_date=None):
+        """Writes the series of a site. The store must be open in 'r+' mode.
+
+        Parameters
+        ----------
+        site : str
+            site name.
+        rain : array-like, optional
+            daily rain in m.
+        epot : array-like, optional
+            daily potential evaporation in m.
+        start_date : str, optional
+            date of the first value in 'dd/mm/yyyy' format (default first day held).
+        """
+        first = self.window(start_date, None).start
+        row = self.index[site]
+        for variable, values in [('rain', rain), ('epot', epot)]:
+            if values is None:
+                continue
+            values = np.asarray(values, dtype=np.float32)
+            self.array(variable)[row, first:first+len(values)] = values
+
+    def add_silo(self, site, silofile, evap='evap', nodata=0.0):
+        """Copies the rain and evaporation of a SILO file into a site, converting mm to m.
+
+        Parameters
+        ----------
+        site : str
+            site name.
+        silofile : str
+            SILO file to read.
+        evap : str, optional
+            SILO column used for evaporation, e.g. 'evap' (default) or 'fao56'.
+        nodata : float, optional
+            value used for NULL and missing days, in mm (default 0.0).
+        """
+        df = lumprep.read_silo(silofile, columns=['rain', evap])
+        dates = pd.date_range(self.start_date, periods=self.numdays, freq='D')
+        df = df.reindex(dates).fillna(nodata)
+        values = df.values.astype(np.float32)/np.float32(1000.0)
+        self.set(site, rain=values[:, 0], epot=values[:, 1])
+
+    def flush(self):
+        """Writes changes of memory-mapped arrays to disk."""
+        for a in self.arrays.values():
+            if hasattr(a, 'flush'):
+                a.flush()
+
+    def iter_sites(self, sites=None, start_date=None, end_date=None, chunksize=256):
+        """Streams the series of many sites, reading chunksize sites at a time.
+
+        Parameters
+        ----------
+        sites : list of str, optional
+            site names (default all sites).
+        start_date : str, optional
+            first day in 'dd/mm/yyyy' format (default first day held).
+        end_date : str, optional
+            last day in 'dd/mm/yyyy' format (default last day held).
+        chunksize : int, optional
+            number of sites read at once (default 256).
+
+        Yields
+        ------
+        site : str
+            site name.
+        rain : numpy array
+            daily rain over the window.
+        epot : numpy array
+            daily potential evaporation over the window.
+        """
+        if sites == None:
+            sites = self.sites
+        for i in range(0, len(sites), chunksize):
+            chunk = sites[i:i+chunksize]
+            rain = self.get(chunk, 'rain', start_date, end_date)
+            epot = self.get(chunk, 'epot', start_date, end_date)
+            for j, site in enumerate(chunk):
+                yield site, rain[j], epot[j]
+
+    def write_files(self, site, start_date=None, end_date=None, rainfile=None, epotfile=None, workspace=False):
+        """Writes the LUMPREM rain and evaporation files of a site over a date window.
+
+        Parameters
+        ----------
+        site : str
+            site name.
+        start_date : str, optional
+            first day of the simulation in 'dd/mm/yyyy' format, written as day 1 (default first day held).
+        end_date : str, optional
+            last day of the simulation in 'dd/mm/yyyy' format (default last day held).
+        rainfile : str, optional
+            name of the rain file (default 'rain_<site>.dat').
+        epotfile : str, optional
+            name of the evaporation file (default 'epot_<site>.dat').
+        workspace : path
+            Path to workspace folder. Default is current working directory.
+
+        Returns
+        -------
+        files : tuple of str
+            names of the rain and evaporation files.
+        """
+        if workspace==False:
+            workspace = os.getcwd()
+        if rainfile == None:
+            rainfile = 'rain_'+site+'.dat'
+        if epotfile == None:
+            epotfile = 'epot_'+site+'.dat'
+        lumprep.write_daily(os.path.join(workspace, rainfile), self.get(site, 'rain', start_date, end_date))
+        lumprep.write_daily(os.path.join(workspace, epotfile), self.get(site, 'epot', start_date, end_date))
+        return rainfile, epotfile
+
+    def assign(self, models, sites, start_date=None, end_date=None, workspace=None):
+        """Writes the climate files for a list of models and points their rainfile and epotfile attributes at them.
+        Files are written once per site, so models that share a site share the files.
+
+        Parameters
+        ----------
+        models : list
+            list of lumprem Model objects.
+        sites : list of str
+            site of each model.
+        start_date : str, optional
+            first day of the simulation in 'dd/mm/yyyy' format (default first day held).
+        end_date : str, optional
+            last day of the simulation in 'dd/mm/yyyy' format (default last day held).
+        workspace : path, optional
+            folder for the files (default each model's own workspace).
+
+        Returns
+        -------
+        files : dict
+            (workspace, site) to (rain file, evaporation file).
+        """
+        files = {}
+        for model, site in zip(models, sites):
+            path = model.workspace if workspace == None else workspace
+            key = (path, str(site))
+            if key not in files:
+                files[key] = self.write_files(str(site), start_date, end_date, workspace=path)
+            model.rainfile, model.epotfile = files[key]
+        return files
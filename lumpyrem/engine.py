@@ -0,0 +1,571 @@
+"""In-process NumPy implementation of the LUMPREM soil moisture model.
+
+Rather than writing an input file and calling the LUMPREM executable once per model, a list of lumprem
+Model objects is converted into parameter arrays and advanced together, one day at a time. Results are
+returned with the same columns as the LUMPREM output file.
+
+The evaporation curve was derived from the outputs shipped in examples/, which all use a vegetation gamma of 1
+and no LUMPREM2 second bucket. Against those outputs volumes agree to about 2e-6 and elevations to about 1e-5
+relative (tests/test_engine.py). Models with gamma other than 1, or with an active second bucket, are not yet
+validated against LUMPREM and are rejected; run them with engine='lumprem'.
+"""
+import os
+import numpy as np
+import pandas as pd
+from lumpyrem import lumprem
+
+COLUMNS = ['days', 'volume', 'vol_drain', 'vol_macro', 'delta_vol', 'del_vol_drain', 'del_vol_macro',
+           'rainfall', 'irrigation', 'recharge', 'macro_rech', 'total_rech', 'gw_withdrawal', 'net_recharge',
+           'runoff', 'pot_evap', 'evaporation', 'gw_pot_evap', 'balance', 'elevation', 'depth-to-water']
+
+COLUMNS_BR = ['days', 'vol_upper', 'vol_lower', 'vol_drain', 'vol_macro', 'del_vol_upper', 'del_vol_lower',
+              'del_vol_drain', 'del_vol_macro', 'rainfall', 'irrigation', 'drain_upper', 'macro_upper',
+              'drain_lower', 'overflow_lower', 'total_rech', 'gw_withdrawal', 'net_recharge', 'runoff',
+              'pot_evap_upper', 'evap_upper', 'pot_evap_lower', 'evap_lower', 'gw_pot_evap', 'balance',
+              'elevation', 'depth-to-water']
+
+
+def run_models(models, numdays=100, noutdays=None, outdays=[], nstep=1, mxiter=100, tol=1.0e-5,
+               rbuf=[0.0], mbuf=[0.0], start_date=None, end_date=None, version=1):
+    """Runs a list of LUMPREM models in-process as a single NumPy batch.
+    Timing arguments follow the same conventions as Model.write_model and are shared by all models.
+
+    Parameters
+    ----------
+    models : list
+        list of lumprem Model objects. Rain, evaporation, vegetation and irrigation files are read from each model's workspace.
+    numdays : int, optional
+        number of days of the model run (default 100)
+    noutdays : int or str, optional
+        number of days for which output is desired, 'monthly' or 'annual' (default None, results in all days being recoreded)
+    outdays : list, optional
+        list of days on which outputs are to be recorded
+    nstep : int, optional
+        number of steps into which each day is divided for iterative soil moisture computation (default 1)
+    mxiter : int, optional
+        max iterations per step (default 100)
+    tol : float, optional
+        convergence tolerance, relative to maxvol (default 1.0e-5)
+    rbuf : list, optional
+        the recharge delay buffer for intial conditions. First element left soil moisture on previous day.
+    mbuf : list, optional
+        the macropore delay buffer for intial conditions. Same setup as rbuf.
+    start_date : str, optional
+        date on which simualtion starts in 'dd/mm/yyyy' format.
+    end_date : str, optional
+        date str in 'dd/mm/yyyy' format. If provided, numdays is calculated as difference between start_date and end_date.
+    version : int, optional
+        1 (default) returns LUMPREM output columns. 2 returns LUMPREM2 output columns. Models with second_bucket=True
+        are rejected with version 2, see the module docstring.
+
+    Returns
+    -------
+    results : dict
+        dictionary of Pandas dataframes with LUMPREM output columns, keyed by model name.
+    """
+    numdays, noutdays, outdays = lumprem.get_outdays(numdays=numdays, noutdays=noutdays, outdays=outdays,
+                                                     start_date=start_date, end_date=end_date)
+    return simulate(models, numdays, outdays, nstep=nstep, mxiter=mxiter, tol=tol,
+                    rbuf=len(models)*[rbuf], mbuf=len(models)*[mbuf], version=version)
+
+
+def run_files(files, workspace=False, version=1, write=True):
+    """Runs LUMPREM input files in-process. Files which share timing and solution settings are run as one batch.
+
+    Parameters
+    ----------
+    files : list of str
+        LUMPREM input file names, for example ['lr_abc.in', 'lr_def.in'].
+    workspace : path, optional
+        folder containing the input files. Default is current working directory.
+    version : int, optional
+        1 (default) for LUMPREM output columns, 2 for LUMPREM2 output columns.
+    write : bool, optional
+        True (default) writes each model's output file next to its input file, replacing the extension with '.out'.
+
+    Returns
+    -------
+    results : dict
+        dictionary of Pandas dataframes with LUMPREM output columns, keyed by model name.
+    """
+    if workspace == False:
+        workspace = os.getcwd()
+
+    groups = {}
+    outfiles = {}
+    for file in files:
+        file = os.path.join(workspace, file)
+        model, settings = read_input(file)
+        outfiles[model.lumprem_model_name] = os.path.splitext(file)[0]+'.out'
+        key = (settings['numdays'], tuple(settings['outdays']), settings['nstep'],
+               settings['mxiter'], settings['tol'])
+        groups.setdefault(key, []).append((model, settings))
+
+    results = {}
+    for key, members in groups.items():
+        numdays, outdays, nstep, mxiter, tol = key
+        models = [m for m, s in members]
+        results.update(simulate(models, numdays, list(outdays), nstep=nstep, mxiter=mxiter, tol=tol,
+                                rbuf=[s['rbuf'] for m, s in members], mbuf=[s['mbuf'] for m, s in members],
+                                version=version))
+    if write == True:
+        for name, df in results.items():
+            write_output(df, outfiles[name])
+    return results
+
+
+def read_input(filename):
+    """Reads a LUMPREM input file.
+
+    Parameters
+    ----------
+    filename : str
+        name of the LUMPREM input file, for example 'lr_abc.in'. The model name is taken from the file name.
+
+    Returns
+    -------
+    model : lumprem Model
+        Model object with the parameters in the input file. The workspace is the folder containing the file.
+    settings : dict
+        timing, solution and initial buffer settings (numdays, outdays, nstep, mxiter, tol, rbuf, mbuf).
+    """
+    sections = {}
+    with open(filename) as f:
+        for line in f:
+            if line.startswith('*'):
+                key = line[1:].strip()
+                sections[key] = []
+            elif len(line.split()) > 0:
+                sections[key].append(line.split())
+
+    def number(x):
+        x = float(x)
+        if x.is_integer():
+            return int(x)
+        return x
+
+    def pair(tokens):
+        if len(tokens) == 2:
+            try:
+                return (number(tokens[0]), number(tokens[1]))
+            except ValueError:
+                pass
+        return tokens[0]
+
+    params = {}
+    earth = sections['earth properties']
+    params['maxvol'], params['irrigvolfrac'] = [float(i) for i in earth[0][:2]]
+    params['rdelay'], params['mdelay'] = [number(i) for i in earth[1][:2]]
+    params['ks'], params['M'], params['L'], params['mflowmax'] = [float(i) for i in earth[2][:4]]
+    if len(earth[0]) > 2:
+        params['second_bucket'] = True
+        params['maxvol_br'], params['extravol_br'], params['gamma_br'] = [float(i) for i in earth[0][2:5]]
+        params['ks_br'], params['m_br'], params['l_br'] = [float(i) for i in earth[2][4:7]]
+
+    elev = [float(i) for i in sections['volume to elevation'][0]]
+    params['offset'], params['factor1'], params['factor2'], params['power'] = elev[:4]
+    if len(elev) > 4:
+        params['elevmin'], params['elevmax'] = elev[4:6]
+    params['surface'] = float(sections['topographic surface'][0][0])
+
+    initial = sections['initial conditions']
+    vol = float(initial[0][0])
+    if len(initial[0]) > 1:
+        params['vol_br'] = float(initial[0][1])
+    nrbuf, nmbuf = [int(i) for i in initial[1][:2]]
+    buffers = [float(i) for row in initial[2:] for i in row]
+
+    solution = sections['solution parameters'][0]
+    timing = [int(float(i)) for row in sections['timing information'] for i in row]
+
+    data = sections['data filenames']
+    params['vegfile'] = pair(data[0])
+    params['rainfile'] = data[1][0]
+    params['epotfile'] = data[2][0]
+    params['irrigfile'] = pair(data[3])
+    if len(data) > 4:
+        try:
+            params['epot_br_all'] = int(data[4][0])
+        except ValueError:
+            params['epotfile_br'] = data[4][0]
+
+    name = os.path.splitext(os.path.basename(filename))[0]
+    if name.startswith('lr_'):
+        name = name[3:]
+    workspace = os.path.dirname(os.path.abspath(filename))
+    model = lumprem.Model(name, workspace=workspace, **params)
+    model.vol = vol
+
+    settings = {'numdays': timing[0],
+                'outdays': timing[2:2+timing[1]],
+                'nstep': int(float(solution[0])),
+                'mxiter': int(float(solution[1])),
+                'tol': float(solution[2]),
+                'rbuf': buffers[:nrbuf],
+                'mbuf': buffers[nrbuf:nrbuf+nmbuf]}
+    return model, settings
+
+
+def read_daily(filename, numdays):
+    """Reads a LUMPREM daily data file (day number and value on each line) into an array indexed by day.
+    """
+    data = np.loadtxt(filename, ndmin=2)
+    days = data[:, 0].astype(int)
+    if days.max() < numdays:
+        raise ValueError('File '+filename+' ends before day '+str(numdays)+'.')
+    values = np.zeros(numdays+1)
+    keep = (days >= 1) & (days <= numdays)
+    values[days[keep]] = data[keep, 1]
+    return values
+
+
+def read_schedule(filename, numdays, ncol):
+    """Reads a LUMPREM schedule file (a day number followed by ncol values on each line). Values apply from
+    the listed day until the next listed day. Returns an array of shape (ncol, numdays+1) indexed by day.
+    """
+    data = np.loadtxt(filename, ndmin=2)
+    days = data[:, 0].astype(int)
+    idx = np.searchsorted(days, np.arange(numdays+1), side='right')-1
+    values = data[np.maximum(idx, 0), 1:ncol+1].T
+    values[:, idx < 0] = 0.0
+    return values
+
+
+def load_inputs(models, numdays, attr, reader):
+    """Loads each distinct input referenced by models[i].attr once. Returns the stacked inputs and
+    the index of each model's input.
+    """
+    keys = {}
+    arrays = []
+    index = np.zeros(len(models), dtype=int)
+    for i, m in enumerate(models):
+        value = getattr(m, attr)
+        if type(value) == tuple:
+            key = value
+        else:
+            key = os.path.join(m.workspace, value)
+        if key not in keys:
+            keys[key] = len(arrays)
+            arrays.append(reader(key, numdays))
+        index[i] = keys[key]
+    return np.array(arrays), index
+
+
+def simulate(models, numdays, outdays, nstep=1, mxiter=100, tol=1.0e-5, rbuf=None, mbuf=None, version=1):
+    """Advances a list of LUMPREM models together. rbuf and mbuf are lists with one buffer per model.
+    See run_models for a description of the arguments and the returned results.
+    """
+    n = len(models)
+    rows = np.arange(n)
+    if rbuf is None:
+        rbuf = n*[[0.0]]
+    if mbuf is None:
+        mbuf = n*[[0.0]]
+
+    def attr(name, default=None):
+        values = []
+        for m in models:
+            value = getattr(m, name, default)
+            if value is None or value == '':
+                value = default
+            values.append(value)
+        return np.array(values, dtype=float)
+
+    maxvol = attr('maxvol')
+    irrigvolfrac = attr('irrigvolfrac')
+    rdelay = attr('rdelay')
+    mdelay = attr('mdelay')
+    ks = attr('ks')
+    M = attr('M')
+    L = attr('L')
+    mflowmax = attr('mflowmax')
+    offset = attr('offset')
+    factor1 = attr('factor1')
+    factor2 = attr('factor2')
+    power = attr('power')
+    elevmin = attr('elevmin', -1.0e30)
+    elevmax = attr('elevmax', 1.0e30)
+    surface = attr('surface')
+
+    # second bucket, only simulated by LUMPREM2
+    lower = np.array([version == 2 and m.second_bucket == True for m in models])
+    maxvol_br = np.where(lower, attr('maxvol_br', 1.0), 1.0)
+    extravol_br = np.where(lower, attr('extravol_br', 0.0), 0.0)
+    gamma_br = attr('gamma_br', 2.0)
+    ks_br = np.where(lower, attr('ks_br', 0.0), 0.0)
+    m_br = attr('m_br', 0.5)
+    l_br = attr('l_br', 0.5)
+    epot_br_all = np.where(lower, attr('epot_br_all', 0), 0)
+
+    # climate, vegetation and irrigation inputs are read once per distinct file
+    rain, rain_idx = load_inputs(models, numdays, 'rainfile', read_daily)
+    epot, epot_idx = load_inputs(models, numdays, 'epotfile', read_daily)
+
+    def vegetation(key, numdays):
+        if type(key) == tuple:
+            return np.array([np.full(numdays+1, float(key[0])), np.full(numdays+1, float(key[1]))])
+        return read_schedule(key, numdays, 2)
+
+    def irrigation(key, numdays):
+        if type(key) == tuple:
+            return np.array([np.full(numdays+1, float(key[0])), np.full(numdays+1, float(key[1]))])
+        return read_schedule(key, numdays, 2)
+
+    veg, veg_idx = load_inputs(models, numdays, 'vegfile', vegetation)
+    irr, irr_idx = load_inputs(models, numdays, 'irrigfile', irrigation)
+
+    # only the settings of the shipped LUMPREM outputs are validated, see the module docstring
+    names = [m.lumprem_model_name for m in models]
+    gamma_not_1 = [n for n, k in zip(names, veg_idx) if not np.allclose(veg[k, 1], 1.0)]
+    if len(gamma_not_1) > 0:
+        raise ValueError('The numpy engine is only validated for a vegetation gamma of 1; run these models with '
+                         "engine='lumprem': "+', '.join(gamma_not_1))
+    if lower.any():
+        raise ValueError("The numpy engine does not simulate the LUMPREM2 second bucket yet; run these models with "
+                         "engine='lumprem': "+', '.join(n for n, l in zip(names, lower) if l))
+
+    epot_br = np.zeros((1, numdays+1))
+    epot_br_idx = np.zeros(n, dtype=int)
+    has_epotfile_br = np.array([l and m.epotfile_br not in [None, ''] for l, m in zip(lower, models)])
+    if has_epotfile_br.any():
+        sel = [m for m, h in zip(models, has_epotfile_br) if h]
+        arrays, index = load_inputs(sel, numdays, 'epotfile_br', read_daily)
+        epot_br = np.vstack([epot_br, arrays])
+        epot_br_idx[has_epotfile_br] = index+1
+
+    def drainage(v, vmax, ks, M, L):
+        s = np.clip(v/vmax, 0.0, 1.0)
+        return ks*s**L*(1.0-(1.0-s**(1.0/M))**M)**2
+
+    def evaporation(v, vmax, rate, gamma):
+        # rate*phi/(2-phi), phi = (1-exp(-gamma*s))/(1-exp(-gamma)), as in the compiled LUMPREM
+        s = np.clip(v/vmax, 0.0, 1.0)
+        gamma = np.maximum(gamma, 1.0e-6)
+        phi = np.expm1(-gamma*s)/np.expm1(-gamma)
+        return rate*phi/(2.0-phi)
+
+    def solve(v0, inflow, dt, flux, vmax):
+        """Solves v1 = v0 + inflow - dt*flux((v0+v1)/2) for v1 using bracketed Newton iterations."""
+        lo = np.zeros(n)
+        hi = np.maximum(v0+inflow, 0.0)
+        v = np.clip(v0, lo, hi)
+        h = 1.0e-8*vmax
+        for it in range(mxiter):
+            q = flux(0.5*(v0+v))
+            res = v-v0-inflow+dt*q
+            lo = np.where(res < 0, v, lo)
+            hi = np.where(res > 0, v, hi)
+            dq = (flux(0.5*(v0+v+h))-q)/h
+            vnew = v-res/(1.0+dt*dq)
+            outside = (vnew <= lo) | (vnew >= hi)
+            vnew = np.where(outside, 0.5*(lo+hi), vnew)
+            done = np.abs(vnew-v) <= tol*vmax
+            v = vnew
+            if done.all():
+                break
+        return v
+
+    # delay buffers hold volumes by the day on which they reach the water table
+    width = int(np.floor(max(rdelay.max(), mdelay.max())))+2
+    rb = np.zeros((n, width))
+    mb = np.zeros((n, width))
+
+    def delay(buf, volume, d, t):
+        di = np.floor(d).astype(int)
+        frac = d-di
+        buf[rows, (t+di) % width] += volume*(1.0-frac)
+        buf[rows, (t+di+1) % width] += volume*frac
+
+    def initial_buffer(buf, values, d):
+        for i in range(n):
+            for k, volume in enumerate(values[i]):
+                di = int(np.floor(d[i]))
+                frac = d[i]-di
+                for day, w in ((-k+di, 1.0-frac), (-k+di+1, frac)):
+                    if day >= 1:
+                        buf[i, day % width] += float(volume)*w
+
+    initial_buffer(rb, rbuf, rdelay)
+    initial_buffer(mb, mbuf, mdelay)
+
+    outdays = np.asarray(outdays, dtype=int)
+    outdays = outdays[(outdays >= 1) & (outdays <= numdays)]
+    is_out = np.zeros(numdays+1, dtype=bool)
+    is_out[outdays] = True
+    columns = COLUMNS_BR if version == 2 else COLUMNS
+    out = np.zeros((n, len(outdays)+1, len(columns)))
+    col = {c: j for j, c in enumerate(columns)}
+
+    fluxes = ['rainfall', 'irrigation', 'drain', 'recharge', 'macro_in', 'macro_rech', 'gw_withdrawal',
+              'runoff', 'pot_evap', 'evaporation', 'drain_lower', 'overflow_lower', 'pot_evap_lower',
+              'evap_lower']
+    acc = {k: np.zeros(n) for k in fluxes}
+
+    v = attr('vol')
+    vb = np.where(lower, attr('vol_br', 0.0), 0.0)
+
+    def record(row, day, prev):
+        vol_drain = rb.sum(axis=1)
+        vol_macro = mb.sum(axis=1)
+        elevation = np.clip(offset+factor1*v+factor2*v**power, elevmin, elevmax)
+        total_rech = acc['recharge']+acc['macro_rech']
+        values = {'days': day,
+                  'volume': v, 'vol_upper': v, 'vol_lower': vb,
+                  'vol_drain': vol_drain, 'vol_macro': vol_macro,
+                  'delta_vol': v-prev[0], 'del_vol_upper': v-prev[0], 'del_vol_lower': vb-prev[1],
+                  'del_vol_drain': vol_drain-prev[2], 'del_vol_macro': vol_macro-prev[3],
+                  'rainfall': acc['rainfall'], 'irrigation': acc['irrigation'],
+                  'recharge': acc['recharge'], 'drain_upper': acc['recharge'],
+                  'macro_rech': acc['macro_rech'], 'macro_upper': acc['macro_rech'],
+                  'drain_lower': acc['drain_lower'], 'overflow_lower': acc['overflow_lower'],
+                  'total_rech': total_rech, 'gw_withdrawal': acc['gw_withdrawal'],
+                  'net_recharge': total_rech-acc['gw_withdrawal'], 'runoff': acc['runoff'],
+                  'pot_evap': acc['pot_evap'], 'pot_evap_upper': acc['pot_evap'],
+                  'evaporation': acc['evaporation'], 'evap_upper': acc['evaporation'],
+                  'pot_evap_lower': acc['pot_evap_lower'], 'evap_lower': acc['evap_lower'],
+                  'gw_pot_evap': acc['pot_evap']-acc['evaporation']-acc['evap_lower'],
+                  'elevation': elevation, 'depth-to-water': surface-elevation}
+        stored = (v-prev[0])+(vb-prev[1])+(vol_drain-prev[2])+(vol_macro-prev[3])
+        values['balance'] = (acc['rainfall']+acc['irrigation']-acc['evaporation']-acc['evap_lower']
+                             -acc['runoff']-total_rech)-stored
+        for c in columns:
+            out[:, row, col[c]] = values[c]
+        for k in fluxes:
+            acc[k][:] = 0.0
+        return (v.copy(), vb.copy(), vol_drain, vol_macro)
+
+    prev = record(0, 0, (v, vb, rb.sum(axis=1), mb.sum(axis=1)))
+    row = 1
+    dt = 1.0/nstep
+    for t in range(1, numdays+1):
+        p = rain[rain_idx, t]*dt
+        ep = epot[epot_idx, t]
+        cf = veg[veg_idx, 0, t]
+        gamma = veg[veg_idx, 1, t]
+        irrigating = irr[irr_idx, 0, t] > 0
+        gwfrac = irr[irr_idx, 1, t]
+        target = irrigvolfrac*maxvol
+        ep_br = np.where(epot_br_all > 0, 0.0, epot_br[epot_br_idx, t])
+        drained = np.zeros(n)
+        macro = np.zeros(n)
+
+        def flux(x):
+            return drainage(x, maxvol, ks, M, L)+evaporation(x, maxvol, cf*ep, gamma)
+
+        for step in range(nstep):
+            v0 = v
+            v1 = solve(v0, p, dt, flux, maxvol)
+
+            # irrigation tops soil moisture up to irrigvolfrac
+            irrigate = irrigating & (v1 < target)
+            v1 = np.where(irrigate, target, v1)
+            # soil moisture in excess of maxvol leaves as macropore flow and runoff
+            full = v1 > maxvol
+            v1 = np.where(full, maxvol, v1)
+
+            # fluxes are evaluated at the step midpoint
+            d = dt*drainage(0.5*(v0+v1), maxvol, ks, M, L)
+            e = dt*evaporation(0.5*(v0+v1), maxvol, cf*ep, gamma)
+            residual = v0+p-d-e-v1
+            irrigation = np.where(irrigate, -residual, 0.0)
+            excess = np.where(full, residual, 0.0)
+            # outflows cannot exceed available water when v1 is zero
+            short = (~irrigate) & (~full) & (v1 <= 0.0)
+            scale = np.where(short, (v0+p)/np.where(d+e > 0, d+e, 1.0), 1.0)
+            d = d*scale
+            e = e*scale
+            m = np.minimum(excess, mflowmax*dt)
+            v = v1
+
+            # second bucket receives drainage from the first
+            if lower.any():
+                vb0 = vb
+                eb_rate = np.where(epot_br_all > 0, ep-e/dt, ep_br)
+
+                def flux_br(x):
+                    return (drainage(x, maxvol_br, ks_br, m_br, l_br)
+                            +evaporation(x, maxvol_br, eb_rate, gamma_br))
+
+                vb1 = solve(vb0, d, dt, flux_br, maxvol_br)
+                cap = maxvol_br+extravol_br
+                overflow = np.maximum(vb1-cap, 0.0)
+                vb1 = np.minimum(vb1, cap)
+                db = dt*drainage(0.5*(vb0+vb1), maxvol_br, ks_br, m_br, l_br)
+                eb = vb0+d-db-overflow-vb1
+                vb = np.where(lower, vb1, vb)
+                acc['drain_lower'] += np.where(lower, db, 0.0)
+                acc['overflow_lower'] += np.where(lower, overflow, 0.0)
+                acc['pot_evap_lower'] += np.where(lower, eb_rate*dt, 0.0)
+                acc['evap_lower'] += np.where(lower, eb, 0.0)
+                d = np.where(lower, db+overflow, d)
+
+            drained += d
+            macro += m
+            acc['rainfall'] += p
+            acc['irrigation'] += irrigation
+            acc['gw_withdrawal'] += irrigation*gwfrac
+            acc['runoff'] += excess-m
+            acc['pot_evap'] += ep*dt
+            acc['evaporation'] += e
+
+        # delayed recharge and macropore recharge reach the water table
+        delay(rb, drained, rdelay, t)
+        delay(mb, macro, mdelay, t)
+        slot = t % width
+        acc['recharge'] += rb[:, slot]
+        acc['macro_rech'] += mb[:, slot]
+        rb[:, slot] = 0.0
+        mb[:, slot] = 0.0
+
+        if is_out[t]:
+            prev = record(row, t, prev)
+            row += 1
+
+    results = {}
+    for i, m in enumerate(models):
+        df = pd.DataFrame(out[i], columns=columns)
+        df['days'] = df['days'].astype(int)
+        results[m.lumprem_model_name] = df
+    return results
+
+
+def write_output(df, filename):
+    """Writes LUMPREM results to a file with the layout of a LUMPREM output file, including the totals footer.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Pandas dataframe with LUMPREM output columns, as returned by run_models.
+    filename : str
+        name of the output file to write, for example 'lr_abc.out'.
+    """
+    columns = list(df.columns)
+    first = columns.index('rainfall')
+    last = columns.index('balance')
+    with open(filename, 'w') as f:
+        f.write("{0:>6}".format(columns[0])+''.join("{0:>15}".format(c) for c in columns[1:])+'\n')
+        for row in df.itertuples(index=False):
+            f.write("{0:>6d}".format(int(row[0]))+''.join("{0:>15.7G}".format(x) for x in row[1:])+'\n')
+        f.write(' \n')
+        totals = df[columns[first:last+1]].sum().values
+        f.write(' total'+15*(first-1)*' '+''.join("{0:>15.7G}".format(x) for x in totals)+'\n')
+
+
+def compare_output(results, filename):
+    """Compares results of the in-process engine with a LUMPREM output file.
+
+    Parameters
+    ----------
+    results : DataFrame
+        Pandas dataframe with LUMPREM output columns, as returned by run_models.
+    filename : str
+        LUMPREM output file to compare against, for example 'lr_abc.out'.
+
+    Returns
+    -------
+    diff : Series
+        maximum absolute difference for each column.
+    """
+    df = lumprem.read_out(filename)
+    cols = [c for c in df.columns if c in results.columns]
+    return (results[cols].reset_index(drop=True)-df[cols]).abs().max()
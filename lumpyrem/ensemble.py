@@ -0,0 +1,282 @@
+"""Parameter ensembles of LUMPREM models.
+
+Each realization of a parameter ensemble (e.g. a pyEMU ParameterEnsemble) is written to its own scratch folder,
+all runs are started concurrently, and the outputs are read straight into one preallocated array of shape
+(model, realization, time, column). No DataFrame is built per run.
+
+    cube = ensemble.run_ensemble(models, parameters, columns=['total_rech', 'elevation'], timeaxis=axis, workers=8)
+    rech = cube.sel(model='abc', column='total_rech')   # (realization, time)
+"""
+import os
+import copy
+import time
+import shutil
+import numpy as np
+import pandas as pd
+from lumpyrem import run
+from lumpyrem import lumprem
+from lumpyrem import profiling
+
+
+class ResultCube():
+    """
+    Outputs of a parameter ensemble, with labelled axes.
+
+    Attributes
+    ----------
+    values : numpy array
+        outputs, shape (nmodels, nrealizations, ndays, ncolumns). Runs that failed are NaN.
+    models : list of str
+        LUMPREM model names, first axis.
+    realizations : list
+        realization labels (the index of the parameter table), second axis.
+    days : numpy array
+        output days, third axis.
+    columns : list of str
+        LUMPREM output columns, fourth axis.
+    status : DataFrame
+        exit status and wall time of each run, with model_name and realization columns.
+    """
+
+    def __init__(self, values, models, realizations, days, columns, status=None):
+        self.values = values
+        self.models = list(models)
+        self.realizations = list(realizations)
+        self.days = days
+        self.columns = list(columns)
+        self.status = status
+
+    def sel(self, model=None, realization=None, column=None):
+        """Returns a view of the cube for one model, realization and/or column. Axes that are selected are dropped.
+
+        Parameters
+        ----------
+        model : str, optional
+            LUMPREM model name (default None, all models).
+        realization : optional
+            realization label (default None, all realizations).
+        column : str, optional
+            LUMPREM output column (default None, all columns).
+
+        Returns
+        -------
+        values : numpy array
+            selected outputs, in the axis order of values.
+        """
+        index = [slice(None)]*4
+        for axis, labels, label in [(0, self.models, model), (1, self.realizations, realization), (3, self.columns, column)]:
+            if label is not None:
+                index[axis] = labels.index(label)
+        return self.values[tuple(index)]
+
+    def to_dates(self, timeaxis):
+        """Returns the dates of the time axis for a timeaxis.TimeAxis."""
+        return timeaxis.to_dates(self.days)
+
+
+def parameter_map(models, names):
+    """Matches the columns of a parameter table to Model attributes.
+    A column named after a Model attribute (e.g. 'maxvol') applies to every model; a PEST parameter name as written by
+    lumprem.par_names (e.g. 'ma_abc' or 'cf_abc') applies to one model only.
+
+    Parameters
+    ----------
+    models : list
+        lumprem Model objects.
+    names : list of str
+        columns of the parameter table.
+
+    Returns
+    -------
+    targets : list of list
+        for each model, (column, attribute, position) triplets. position is the element of a tuple attribute such as
+        vegfile, or None.
+    """
+    pest_names = {}
+    ambiguous = set()
+    for i, m in enumerate(models):
+        for p, value in m.__dict__.items():
+            if type(value) not in [int, float, tuple] or p == 'second_bucket':
+                continue
+            for k, n in enumerate(lumprem.par_names(p, m.lumprem_model_name)):
+                position = None
+                if p == 'vegfile':
+                    position = k
+                elif p == 'irrigfile':
+                    position = 1
+                if n.lower() in pest_names and pest_names[n.lower()][:2] != (i, p):
+                    ambiguous.add(n.lower())
+                pest_names.setdefault(n.lower(), (i, p, position))
+
+    targets = [[] for m in models]
+    for name in names:
+        if all(name in m.__dict__ for m in models):
+            for t in targets:
+                t.append((name, name, None))
+        elif str(name).lower() in ambiguous:
+            raise ValueError('PEST parameter '+str(name)+' names more than one Model attribute; model names must differ '
+                             'in their first 6 characters.')
+        elif str(name).lower() in pest_names:
+            i, p, position = pest_names[str(name).lower()]
+            targets[i].append((name, p, position))
+        else:
+            raise ValueError('Parameter '+str(name)+' is neither a Model attribute nor a PEST parameter of the models.')
+    return targets
+
+
+def realize(model, row, targets, workspace):
+    """Returns a copy of a Model with the parameters of one realization, in workspace. model is not modified.
+    As in PEST template files, an irrigation fraction switches irrigation on (irrigfile (1, value))."""
+    new = copy.copy(model)
+    for name, p, position in targets:
+        value = row[name]
+        if p == 'irrigfile' and position != None:
+            value = (1, value)
+        elif position != None:
+            value = tuple(value if k == position else v for k, v in enumerate(getattr(model, p)))
+        setattr(new, p, value)
+    new.workspace = workspace
+    return new
+
+
+def input_files(model):
+    """Returns the names of the data files read by a LUMPREM model (rain, evaporation, vegetation, irrigation)."""
+    files = [model.rainfile, model.epotfile, model.vegfile, model.irrigfile, model.epotfile_br]
+    return [f for f in files if type(f) == str]
+
+
+def scratch_folder(model_list, workspace):
+    """Creates workspace and links (or copies) the data files of the models into it."""
+    if not os.path.exists(workspace):
+        os.makedirs(workspace)
+    for model in model_list:
+        for name in input_files(model):
+            src = os.path.join(model.workspace, name)
+            dst = os.path.join(workspace, name)
+            if os.path.exists(dst) or not os.path.exists(src):
+                continue
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copyfile(src, dst)
+
+
+def run_ensemble(model_list, parameters, columns=None, workspace=False, timeaxis=None, workers=None, version=1,
+                 engine='lumprem', chunksize=100, float32=False, keep=False, cache=None, timeout=None, **kwargs):
+    """Runs LUMPREM models for every realization of a parameter ensemble and gathers the outputs in a ResultCube.
+    Realizations are written to scratch folders real_<n> in workspace, run in chunks of chunksize realizations, read
+    into the cube and removed.
+
+    Parameters
+    ----------
+    model_list : list
+        lumprem Model objects, used as the base of every realization. Their data files (rain, epot, ...) must be in
+        their workspace.
+    parameters : DataFrame or dict
+        one row per realization, columns named after Model attributes or PEST parameters (see parameter_map). A pyEMU
+        ParameterEnsemble can be passed as its DataFrame (pe._df). The index labels the realizations.
+    columns : list of str, optional
+        LUMPREM output columns to keep (default None, all columns).
+    workspace : path
+        folder for the scratch folders. Default is current working directory.
+    timeaxis : timeaxis.TimeAxis, optional
+        simulation calendar passed to lumprem.write_models.
+    workers : int, optional
+        number of LUMPREM processes to run at the same time (default None, the number of CPUs).
+    version : int, optional
+        1 (default) runs LUMPREM, 2 runs LUMPREM2.
+    engine : str, optional
+        'lumprem' (default) calls the executable. 'numpy' runs each realization with the in-process engine instead.
+    chunksize : int, optional
+        number of realizations on disk at the same time (default 100).
+    float32 : bool, optional
+        True, the cube is float32 to halve memory (default False).
+    keep : bool, optional
+        True, scratch folders are not removed (default False).
+    cache : cache.RunCache, optional
+        if provided, runs whose inputs are unchanged are restored from the cache. Ignored by the numpy engine.
+    timeout : float, optional
+        seconds after which a LUMPREM run is killed and recorded as failed (default None, no limit).
+    **kwargs :
+        timing and solution settings passed to lumprem.write_models, e.g. numdays, start_date, end_date, noutdays.
+
+    Returns
+    -------
+    cube : ResultCube
+        outputs of all models and realizations.
+    """
+    if workspace==False:
+        workspace = os.getcwd()
+    parameters = pd.DataFrame(parameters)
+    targets = parameter_map(model_list, list(parameters.columns))
+    names = [m.lumprem_model_name for m in model_list]
+    nreal = len(parameters)
+
+    cube = None
+    statuses = []
+    for start in range(0, nreal, chunksize):
+        chunk = range(start, min(start+chunksize, nreal))
+        folders = [os.path.join(workspace, 'real_'+str(r)) for r in chunk]
+        members = []
+        for r, folder in zip(chunk, folders):
+            row = parameters.iloc[r]
+            members.append([realize(m, row, t, folder) for m, t in zip(model_list, targets)])
+            scratch_folder(model_list, folder)
+
+        flat = [m for real in members for m in real]
+        lumprem.write_models(flat, tpl=False, timeaxis=timeaxis, print_output=False, **kwargs)
+        with profiling.stage('run_ensemble', str(len(flat))+' runs'):
+            if engine=='numpy':
+                status = run_numpy(members, folders, version)
+            else:
+                status = lumprem.run_models(flat, workers=workers, version=version, timeout=timeout, cache=cache)
+        status['realization'] = np.repeat(list(parameters.index[start:chunk.stop]), len(model_list))
+        statuses.append(status)
+
+        success = status['success'].astype(bool).values.reshape(len(chunk), len(model_list))
+        for r, real, ok in zip(chunk, members, success):
+            for i, m in enumerate(real):
+                if ok[i] == False:
+                    continue
+                filename = os.path.join(m.workspace, 'lr_'+m.lumprem_model_name+'.out')
+                df = lumprem.read_out(filename, columns=columns, float32=float32)
+                if cube is None:
+                    days = df['days'].values
+                    cols = [c for c in df.columns if c != 'days']
+                    dtype = np.float32 if float32==True else np.float64
+                    cube = ResultCube(np.full((len(model_list), nreal, len(days), len(cols)), np.nan, dtype=dtype),
+                                      names, parameters.index, days, cols)
+                cube.values[i, r] = df[cube.columns].values
+        if keep==False:
+            for folder in folders:
+                shutil.rmtree(folder, ignore_errors=True)
+
+    if cube is None:
+        raise RuntimeError('No realization produced LUMPREM outputs, see the status of run_models.')
+    cube.status = pd.concat(statuses, ignore_index=True)
+    failed = (~cube.status['success'].astype(bool)).sum()
+    if failed > 0:
+        print(str(failed)+' of '+str(len(cube.status))+' ensemble runs failed; their outputs are NaN.')
+    return cube
+
+
+def run_numpy(members, folders, version=1):
+    """Runs the realizations with the in-process engine, all models of a realization as one batch.
+    Returns a status table like run_models."""
+    from lumpyrem import engine as lrengine
+    records = []
+    for real, folder in zip(members, folders):
+        t0 = time.perf_counter()
+        error = ''
+        try:
+            lrengine.run_files(['lr_'+m.lumprem_model_name+'.in' for m in real], workspace=folder, version=version)
+        except Exception as e:
+            error = str(e)
+        for m in real:
+            status = run.new_status(m.lumprem_model_name)
+            status['returncode'] = 0 if error == '' else 1
+            status['success'] = error == ''
+            status['error'] = error
+            status['wall_time'] = (time.perf_counter()-t0)/len(real)
+            records.append(status)
+    return run.job_table(records)
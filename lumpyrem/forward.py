@@ -0,0 +1,189 @@
+"""Forward run of a set of LUMPREM models, for use as the model command of PEST and PEST++.
+
+Replaces the run.bat written by LUMPREP. All lr_*.in files in the workspace are run concurrently,
+followed by the optional timeseries and observation post-processing. From the command line:
+
+    python -m lumpyrem.forward --workers 8 --setup forward.pkl
+"""
+import os
+import sys
+import glob
+import time
+import pickle
+import argparse
+import pandas as pd
+from lumpyrem import run
+
+
+def find_models(workspace):
+    """Returns the names of the LUMPREM models with an lr_<name>.in file in workspace, sorted."""
+    files = glob.glob(os.path.join(workspace, 'lr_*.in'))
+    return sorted(os.path.basename(f)[3:-3] for f in files)
+
+
+def forward_run(workspace=False, workers=None, version=1, engine='lumprem', timeseries=[], observations=None,
+                timeout=None, print_output=True, cache=None):
+    """Runs all LUMPREM models in a workspace and the post-processing that follows them.
+
+    Parameters
+    ----------
+    workspace : path, optional
+        folder holding the lr_*.in files. Default is current working directory.
+    workers : int, optional
+        number of LUMPREM processes to run at the same time (default None, the number of CPUs).
+    version : int, optional
+        1 (default) runs LUMPREM, 2 runs LUMPREM2.
+    engine : str, optional
+        'lumprem' (default) calls the executable. 'numpy' runs all models with the in-process engine instead.
+    timeseries : list, optional
+        lr2series TimeSeries objects; their timeseries files are written with the python backend after the runs.
+        Their workspace is set to the workspace of the run.
+    observations : pest.Observations, optional
+        observations extracted after the runs (default None). Its workspace is set to the workspace of the run.
+    timeout : float, optional
+        seconds after which a LUMPREM run is killed and recorded as failed (default None, no limit).
+    print_output : bool, optional
+        True (default), failed models and the stage timings are printed.
+    cache : cache.RunCache, optional
+        if provided, models whose inputs did not change since an earlier run are restored from the cache.
+        Ignored by the numpy engine.
+
+    Returns
+    -------
+    exit_status : int
+        0 if all stages succeeded, 1 if a model failed, 2 if post-processing failed.
+    status : DataFrame
+        exit status and wall time of each model run.
+    timings : dict
+        wall time in seconds of each stage ('clean', 'run', 'timeseries', 'observations', 'total').
+    """
+    if workspace==False:
+        workspace = os.getcwd()
+    t_start = time.perf_counter()
+    timings = {}
+
+    # old outputs are removed, so a failed run cannot be mistaken for a successful one
+    t0 = time.perf_counter()
+    names = find_models(workspace)
+    for name in names:
+        out = os.path.join(workspace, 'lr_'+name+'.out')
+        if os.path.exists(out):
+            os.remove(out)
+    timings['clean'] = time.perf_counter()-t0
+
+    t0 = time.perf_counter()
+    if engine == 'numpy':
+        status = run_numpy(names, workspace, version)
+    else:
+        exe = 'lumprem' if version == 1 else 'lumprem2'
+        jobs = [{'process':exe, 'commands':['lr_'+n+'.in','lr_'+n+'.out'], 'path':workspace, 'name':n,
+                 'log_file':'lr_'+n+'.log'} for n in names]
+        if cache != None:
+            status = cache.run_jobs(jobs, workers=workers, timeout=timeout, print_output=print_output)
+        else:
+            status = run.run_jobs(jobs, workers=workers, timeout=timeout, print_output=print_output)
+        # LUMPREM may report an error and still exit with 0
+        missing = status['model_name'].map(lambda n: not os.path.exists(os.path.join(workspace, 'lr_'+n+'.out'))).astype(bool)
+        status.loc[missing & status['success'], 'error'] = 'no output file written'
+        status.loc[missing, 'success'] = False
+    timings['run'] = time.perf_counter()-t0
+
+    exit_status = 0
+    if status['success'].all() == False:
+        exit_status = 1
+        if print_output==True:
+            print(str((~status['success']).sum())+' of '+str(len(status))+' LUMPREM models failed.')
+    else:
+        # objects loaded from a setup file keep the folder they were written in; PEST++ agents run in copies of it
+        for ts in timeseries:
+            ts.workspace = workspace
+        if observations != None:
+            observations.workspace = workspace
+        try:
+            t0 = time.perf_counter()
+            for ts in timeseries:
+                ts.write_ts(backend='python')
+            timings['timeseries'] = time.perf_counter()-t0
+
+            t0 = time.perf_counter()
+            if observations != None:
+                observations.extract()
+            timings['observations'] = time.perf_counter()-t0
+        except Exception as e:
+            exit_status = 2
+            if print_output==True:
+                print('Post-processing failed: '+str(e))
+
+    timings['total'] = time.perf_counter()-t_start
+    if print_output==True:
+        print(str(len(names))+' models. '+', '.join(k+': {0:.2f} s'.format(v) for k, v in timings.items()))
+        if cache != None:
+            print('Run cache: '+', '.join(k+' '+str(v) for k, v in cache.stats().items()))
+    return exit_status, status, timings
+
+
+def run_numpy(names, workspace, version=1):
+    """Runs models with the in-process engine and returns a status table like run.run_jobs."""
+    from lumpyrem import engine
+
+    t0 = time.perf_counter()
+    error = ''
+    try:
+        engine.run_files(['lr_'+n+'.in' for n in names], workspace=workspace, version=version)
+    except Exception as e:
+        error = str(e)
+    wall_time = time.perf_counter()-t0
+    return pd.DataFrame({'model_name':names, 'returncode':0 if error == '' else 1, 'wall_time':wall_time,
+                         'success':error == '', 'error':error, 'log_file':None})
+
+
+def write_setup(filename, timeseries=[], observations=None):
+    """Saves the post-processing objects of a forward run, to be loaded by the command line with --setup.
+
+    Parameters
+    ----------
+    filename : str
+        name of the file to write, e.g. 'forward.pkl'.
+    timeseries : list, optional
+        lr2series TimeSeries objects.
+    observations : pest.Observations, optional
+        observations to extract.
+    """
+    with open(filename, 'wb') as f:
+        pickle.dump({'timeseries':timeseries, 'observations':observations}, f)
+    print('Forward run setup written to: \n'+filename)
+
+
+def main(argv=None):
+    """Command line entry point. Returns the exit status of forward_run."""
+    parser = argparse.ArgumentParser(description='Forward run of all LUMPREM models in a folder.')
+    parser.add_argument('--workspace', default=False, help='folder holding the lr_*.in files (default current folder)')
+    parser.add_argument('--workers', type=int, default=None, help='number of models run at the same time (default number of CPUs)')
+    parser.add_argument('--version', type=int, default=1, choices=[1, 2], help='LUMPREM version')
+    parser.add_argument('--engine', default='lumprem', choices=['lumprem', 'numpy'], help='executable or in-process engine')
+    parser.add_argument('--timeout', type=float, default=None, help='seconds before a model run is killed')
+    parser.add_argument('--setup', default=None, help='post-processing setup written by write_setup')
+    parser.add_argument('--cache', default=None, help='folder of a run cache; unchanged models are not run again')
+    parser.add_argument('--cache-size', type=float, default=2**30, help='maximum size of the run cache in bytes')
+    parser.add_argument('--quiet', action='store_true', help='do not print a summary')
+    args = parser.parse_args(argv)
+
+    setup = {'timeseries':[], 'observations':None}
+    if args.setup != None:
+        with open(args.setup, 'rb') as f:
+            setup.update(pickle.load(f))
+
+    runcache = None
+    if args.cache != None:
+        from lumpyrem.cache import RunCache
+        runcache = RunCache(args.cache, max_size=args.cache_size)
+
+    exit_status, status, timings = forward_run(workspace=args.workspace, workers=args.workers, version=args.version,
+                                               engine=args.engine, timeseries=setup['timeseries'],
+                                               observations=setup['observations'], timeout=args.timeout,
+                                               print_output=not args.quiet, cache=runcache)
+    return exit_status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
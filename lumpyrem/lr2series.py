@@ -1,6 +1,9 @@
 import os
 from lumpyrem import run
+from lumpyrem import lumprem
+from lumpyrem import profiling
 import numpy as np
+import pandas as pd
 import itertools
 
 class TimeSeries():
@@ -21,12 +24,16 @@ class TimeSeries():
         True (Default) if LR2SERIES div_delta_t. False if LR2SERIES no_div_delta_t .
     workspace : path 
         Path to workspace folder. Default is current working directory.
+    timeaxis : timeaxis.TimeAxis
+        simulation calendar of the LUMPREM models, or None.
+    store : resultstore.ResultStore
+        store holding the LUMPREM outputs, or None to read the .out files.
     """
 
     def __init__(self,ts_file, lr_models, ts_names,
                       lumprem_output_cols,methods, 
                       div_delta_t=True, 
-                      workspace=False, scales=None, timeoffset=' ', time_offset_method='next', sep='_', tssufix='modelname'):
+                      workspace=False, scales=None, timeoffset=' ', time_offset_method='next', sep='_', tssufix='modelname', timeaxis=None, store=None):
         """Parameters
         ----------
         ts_file : str
@@ -47,6 +54,10 @@ class TimeSeries():
             list of floats to scale the lumprem outputs to. Must be in sequence and of same length as ts_names.
         tssufix: 'modelname', None or str
             adds sufix to the ts names. Use None to pass tsnames epxlicitly. 'modelname' appends the LUMPREM model name. TO DO: curently only works for a single model.
+        timeaxis : timeaxis.TimeAxis, optional
+            simulation calendar of the LUMPREM models. If provided, get_frame indexes the timeseries by date.
+        store : resultstore.ResultStore, optional
+            if provided, the python backend reads the LUMPREM outputs from the store instead of the .out files.
         """
         
         model_count = len(lr_models)
@@ -92,13 +103,27 @@ class TimeSeries():
             self.time_offset_method = col_count*['']
         
         self.sep = sep
+        self.timeaxis = timeaxis
+        self.store = store
 
-    def write_ts(self):
+    def write_ts(self, backend='lr2series'):
         """Writes the MODFLOW6 timeseries file.
 
         Parameters
         ----------
+        backend : str, optional
+            'lr2series' (default) writes an LR2SERIES input file and runs LR2SERIES. 
+            'python' reads the LUMPREM outputs and writes the timeseries file directly, without calling LR2SERIES.
         """
+        if backend=='python':
+            with profiling.stage('write_ts', self.ts_file) as stage:
+                times, values, tsnames, methods = self.get_ts()
+                ts_file = os.path.join(self.workspace, self.ts_file)
+                write_ts_array(ts_file, times, values, tsnames, methods)
+                stage.wrote(ts_file)
+            print('MF6 timeseries file written to:\n'+ts_file)
+            return
+
         #number of columns to include in the ts file
         count = len(self.lumprem_output_cols)
         ts_file = os.path.join(self.workspace, self.ts_file+'.in')
@@ -130,15 +155,251 @@ class TimeSeries():
         #write ts file
         filename = self.ts_file
         path = self.workspace
-        run.run_process('lr2series', commands=[filename+'.in'],path=path)
+        with profiling.stage('write_ts', self.ts_file) as stage:
+            stage.wrote(ts_file)
+            run.run_process('lr2series', commands=[filename+'.in'],path=path)
+            stage.wrote(os.path.join(path, filename))
+
+    def get_ts(self):
+        """Computes the timeseries from the LUMPREM output files, as LR2SERIES does.
+        Columns are read from all models at once and div_delta_t, scales, offsets and the time offset are applied to whole arrays.
+
+        If LUMPREM outputs start at day 0, a record is added at time 1 and the first rate is taken over the interval from day 1, as LR2SERIES does.
+        If a time offset is set, it is subtracted from LUMPREM days and earlier records are dropped. The value at time zero is then taken
+        from the next record ('next'), the previous record ('previous') or interpolated between them (any other time_offset_method).
+
+        Returns
+        -------
+        times : numpy array
+            timeseries times, shape (ntimes,).
+        values : numpy array
+            timeseries values, shape (ntimes, nseries), in the order of the returned names.
+        tsnames : list of str
+            timeseries names, grouped by model.
+        methods : list of str
+            MODFLOW6 method of each timeseries.
+        """
+        nmodel = len(self.lr_models)
+        cols = self.lumprem_output_cols
+        ncol = len(cols)
+
+        if self.store != None:
+            days = self.store.days
+            blocks = list(self.store.get([m.lumprem_model_name for m in self.lr_models], cols))
+        else:
+            days = None
+            blocks = []
+            for model in self.lr_models:
+                filename = os.path.join(self.workspace, 'lr_'+model.lumprem_model_name+'.out')
+                df = lumprem.read_out(filename, columns=list(dict.fromkeys(cols)))
+                if days is None:
+                    days = df['days'].values
+                elif not np.array_equal(days, df['days'].values):
+                    raise ValueError('All LUMPREM models in a TimeSeries must have the same output days: '+filename)
+                blocks.append(df[cols].values)
+        # series ordered model by model, columns within each model
+        values = np.stack(blocks, axis=1).reshape(len(days), nmodel*ncol)
+
+        times, values, delta = series_times(days, values)
+        div = np.tile([d == 'div_delta_t' for d in self.div_delta], nmodel)
+        scales = np.tile(np.asarray(self.scales, dtype=np.float64), nmodel)
+        offsets = np.tile(np.asarray(self.offsets, dtype=np.float64), nmodel)
+        values = np.where(div, values/delta[:, None], values)*scales+offsets
+
+        if str(self.timeoffset).strip() != '':
+            times = times-float(self.timeoffset)
+            first = np.searchsorted(times, 0.0)
+            if first == len(times):
+                raise ValueError('The time offset is later than the last LUMPREM output.')
+            if first > 0 and times[first] > 0:
+                w = -times[first-1]/(times[first]-times[first-1])
+                methods = np.tile(self.time_offset_method, nmodel)
+                v0 = np.where(methods == 'next', values[first],
+                     np.where(methods == 'previous', values[first-1], (1-w)*values[first-1]+w*values[first]))
+                times = np.concatenate([[0.0], times[first:]])
+                values = np.vstack([v0, values[first:]])
+            else:
+                times = times[first:]
+                values = values[first:]
+
+        tsnames = [self.ts_names[m::nmodel][c] for m in range(nmodel) for c in range(ncol)]
+        methods = [str(self.methods[c]).upper() for m in range(nmodel) for c in range(ncol)]
+        return times, values, tsnames, methods
+
+    def get_frame(self):
+        """Returns the timeseries computed by get_ts as a DataFrame with one column per timeseries.
+        Rows are indexed by date if the TimeSeries has a timeaxis (the time offset is added back), otherwise by time.
+
+        Returns
+        -------
+        df : DataFrame
+            timeseries values.
+        """
+        times, values, tsnames, methods = self.get_ts()
+        df = pd.DataFrame(values, columns=tsnames)
+        if self.timeaxis != None:
+            offset = 0.0
+            if str(self.timeoffset).strip() != '':
+                offset = float(self.timeoffset)
+            df.index = self.timeaxis.to_dates(times+offset)
+        else:
+            df.index = pd.Index(times, name='time')
+        return df
+
+
+class PowFile():
+    """
+    A class used to export LUMPREM model outputs to a FEFLOW time series (.pow) file.
+    Models are read and written one at a time, so memory use does not grow with the number of models or outputs.
+
+    Attributes
+    ----------
+    pow_file : str
+        filename of the .pow file to write.
+    lr_models : list
+        list of lumpyrem Model objects.
+    lumprem_output_cols : list of str
+        list of LUMPREM output columns exported for each model.
+    div_delta : list of bool
+        for each column, True if values are divided by the output interval.
+    scales : list of float
+        for each column, factor applied to the values.
+    offsets : list of float
+        for each column, value added after scaling.
+    workspace : path
+        Path to workspace folder. Default is current working directory.
+    """
 
-def read_ts(filename):
+    def __init__(self, pow_file, lr_models, lumprem_output_cols, div_delta_t=True, scales=None, offsets=None,
+                 conversion=1.0, first_id=1, timeoffset=0.0, workspace=False):
+        """Parameters
+        ----------
+        pow_file : str
+            filename of the .pow file to write.
+        lr_models : list
+            list of lumpyrem Model objects.
+        lumprem_output_cols : list of str
+            list of LUMPREM output columns exported for each model, e.g. ['total_rech', 'elevation'].
+        div_delta_t : bool or list of bool
+            True (default) to divide all columns by the output interval, as LR2SERIES div_delta_t. A list gives one value per column.
+        scales : list of float, optional
+            factor applied to each column (default 1.0).
+        offsets : list of float, optional
+            value added to each column after scaling (default 0.0).
+        conversion : float, optional
+            unit conversion factor applied to all values after scaling and offset, e.g. 1000.0 for m/d to mm/d (default 1.0).
+        first_id : int, optional
+            number of the first time series (default 1). Series are numbered model by model, columns within each model.
+        timeoffset : float, optional
+            days subtracted from LUMPREM days, e.g. to start FEFLOW time at a later date (default 0.0).
+        workspace : path
+            Path to workspace folder. Default is current working directory.
+        """
+        ncol = len(lumprem_output_cols)
+        self.pow_file = pow_file
+        self.lr_models = lr_models
+        self.lumprem_output_cols = lumprem_output_cols
+        if type(div_delta_t) == bool:
+            div_delta_t = ncol*[div_delta_t]
+        self.div_delta = div_delta_t
+        self.scales = ncol*[1.0] if scales == None else scales
+        self.offsets = ncol*[0.0] if offsets == None else offsets
+        self.conversion = conversion
+        self.first_id = first_id
+        self.timeoffset = timeoffset
+        if workspace==False:
+            self.workspace = os.getcwd()
+        else:
+            self.workspace = workspace
+
+    def get_index(self):
+        """Returns the time series numbers as a dict of (model name, column) to number."""
+        names = [(m.lumprem_model_name, c) for m in self.lr_models for c in self.lumprem_output_cols]
+        return {n:self.first_id+i for i, n in enumerate(names)}
+
+    def iter_series(self):
+        """Reads the LUMPREM output files one model at a time and yields its time series.
+
+        Yields
+        ------
+        model_name : str
+            LUMPREM model name.
+        times : numpy array
+            times in days, shape (ntimes,).
+        values : numpy array
+            values of the exported columns, shape (ntimes, ncols).
+        """
+        cols = self.lumprem_output_cols
+        div = np.asarray(self.div_delta, dtype=bool)
+        scales = np.asarray(self.scales, dtype=np.float64)
+        offsets = np.asarray(self.offsets, dtype=np.float64)
+        for model in self.lr_models:
+            filename = os.path.join(self.workspace, 'lr_'+model.lumprem_model_name+'.out')
+            df = lumprem.read_out(filename, columns=list(dict.fromkeys(cols)))
+            times, values, delta = series_times(df['days'].values, df[cols].values)
+            values = (np.where(div, values/delta[:, None], values)*scales+offsets)*self.conversion
+            yield model.lumprem_model_name, times-self.timeoffset, values
+
+    def write_pow(self):
+        """Writes the FEFLOW .pow file, one time series at a time.
+
+        Returns
+        -------
+        index : dict
+            (model name, column) to time series number, see get_index.
+        """
+        index = self.get_index()
+        pow_file = os.path.join(self.workspace, self.pow_file)
+        with profiling.stage('write_pow', self.pow_file) as stage:
+            with open(pow_file, 'w') as f:
+                for model_name, times, values in self.iter_series():
+                    for c, col in enumerate(self.lumprem_output_cols):
+                        f.write('# '+str(index[(model_name, col)])+'\n')
+                        f.write('! '+col+' '+model_name+'\n')
+                        f.write(''.join('   '+format_g(t)+'   '+format_g(v)+'\n' for t, v in zip(times.tolist(), values[:, c].tolist())))
+                        f.write('END\n')
+            stage.wrote(pow_file)
+        print('FEFLOW time series file written to:\n'+pow_file)
+        return index
+
+
+def series_times(days, values):
+    """Returns the times, values and output intervals of LUMPREM outputs as LR2SERIES uses them.
+    If outputs start at day 0, a record is added at time 1 and the first interval is taken from day 1.
+
+    Parameters
+    ----------
+    days : numpy array
+        LUMPREM output days.
+    values : numpy array
+        outputs, shape (ndays, nseries).
+
+    Returns
+    -------
+    times : numpy array
+        times, shape (ntimes,).
+    values : numpy array
+        values, shape (ntimes, nseries).
+    delta : numpy array
+        length of the interval ending at each time.
+    """
+    times = days.astype(np.float64)
+    if len(times) > 1 and times[0] == 0 and times[1] > 1:
+        times = np.insert(times, 1, 1.0)
+        values = np.insert(values, 1, values[0], axis=0)
+    delta = np.diff(times, prepend=times[0]-1.0)
+    return times, values, delta
+
+
+def read_ts(filename, timeaxis=None):
     """Reads a modflow6 timeseries file and returns the timeseries as a rec array.
 
     Parameters
     ----------
     filename : str
         filename of ts file to read
+    timeaxis : timeaxis.TimeAxis, optional
+        simulation calendar. If provided, a 'date' field holds the date of each time, counted from its start date.
 
     Returns
     -------
@@ -148,36 +409,199 @@ def read_ts(filename):
         list of timeseries names in the ts file
     """
 
-    start = 0
-    textlist = []
+    times, values, index, attributes = read_ts_array(filename)
+    tsnames = attributes['NAMES']
+    methods = ts_methods(attributes, len(tsnames))
+
+    names = ['time']+tsnames
+    formats = len(names)*['f8']
+    if timeaxis != None:
+        names = names+['date']
+        formats = formats+['datetime64[ns]']
+    a = np.empty(len(times), dtype={'names':names, 'formats':formats})
+    a['time'] = times
+    if timeaxis != None:
+        a['date'] = timeaxis.to_dates(times).values
+    for name, col in index.items():
+        a[name] = values[:, col]
+    return a, tsnames, methods
+
+
+def ts_methods(attributes, count):
+    """Returns the list of methods from the ATTRIBUTES block, one per timeseries."""
+    if 'METHODS' in attributes:
+        return attributes['METHODS']
+    if 'METHOD' in attributes:
+        return count*attributes['METHOD']
+    return []
+
+
+def read_ts_header(f):
+    """Reads the ATTRIBUTES block from an open ts file, leaving the file positioned after BEGIN TIMESERIES.
+
+    Returns
+    -------
+    attributes : dict
+        attribute keyword (upper case) to list of values, e.g. {'NAMES':[...], 'METHODS':[...]}.
+    """
+    attributes = {}
+    block = False
+    for line in f:
+        key = line.strip().upper()
+        if key.startswith('BEGIN TIMESERIES'):
+            return attributes
+        elif key.startswith('END ATTRIBUTES'):
+            block = False
+        elif block and key != '' and not key.startswith('#'):
+            items = line.split()
+            attributes[items[0].upper()] = items[1:]
+        elif key.startswith('BEGIN ATTRIBUTES'):
+            block = True
+    raise ValueError('No TIMESERIES block found in '+str(f.name))
+
+
+def read_ts_array(filename, float32=False):
+    """Reads a modflow6 timeseries file in a single pass.
+    The TIMESERIES block is parsed in bulk into one contiguous array.
+
+    Parameters
+    ----------
+    filename : str
+        filename of ts file to read
+    float32 : bool, optional
+        True, values are returned as float32 to halve memory (default False, float64). Times are always float64.
+
+    Returns
+    -------
+    times : numpy array
+        simulation times, shape (ntimes,).
+    values : numpy array
+        timeseries values, shape (ntimes, nseries), C-contiguous.
+    index : dict
+        timeseries name to column in values.
+    attributes : dict
+        contents of the ATTRIBUTES block, see read_ts_header.
+    """
+
     with open(filename) as f:
+        attributes = read_ts_header(f)
+        rows = []
         for line in f:
-            if 'END ATTRIBUTES' in line.upper():
-                start = 0
-            elif start:
-                textlist.append([i for i in line.split()] )
-            elif 'BEGIN ATTRIBUTES' in line.upper():
-                start = 1
-
-    tsnames = textlist[0][1:]
-    names = tsnames.copy()
-    names.insert(0, 'time')
-    methods = textlist[1][1:]
-    count = len(names)
-
-    start = 0
-    textlist = []
+            if line.strip().upper().startswith('END TIMESERIES'):
+                break
+            rows.append(line)
+
+    tsnames = attributes['NAMES']
+    ncol = len(tsnames)+1
+    data = np.array(''.join(rows).split(), dtype=np.float64).reshape(-1, ncol)
+
+    times = data[:, 0].copy()
+    dtype = np.float32 if float32==True else np.float64
+    values = np.ascontiguousarray(data[:, 1:], dtype=dtype)
+    index = {name:i for i, name in enumerate(tsnames)}
+    return times, values, index, attributes
+
+
+def iter_ts(filename, chunksize=10000, float32=False):
+    """Reads a modflow6 timeseries file in chunks of rows, for files too large to hold in memory.
+
+    Parameters
+    ----------
+    filename : str
+        filename of ts file to read
+    chunksize : int, optional
+        number of time steps per chunk (default 10000).
+    float32 : bool, optional
+        True, values are returned as float32 (default False, float64).
+
+    Yields
+    ------
+    times : numpy array
+        simulation times of the chunk, shape (n,).
+    values : numpy array
+        timeseries values of the chunk, shape (n, nseries). Columns follow the NAMES attribute.
+    """
+
+    dtype = np.float32 if float32==True else np.float64
     with open(filename) as f:
+        attributes = read_ts_header(f)
+        ncol = len(attributes['NAMES'])+1
+        rows = []
         for line in f:
-            if 'END TIMESERIES' in line.upper():
-                start = 0
-            elif start:
-                #textlist.append([float(i) for i in line.split()] )
-                textlist.append(tuple([float(i) for i in line.split()]))
-            elif 'BEGIN TIMESERIES' in line.upper():
-                start = 1
-
-
-    a = np.array(textlist, dtype={'names':names,
-                                'formats':count*['f8']})
-    return a, tsnames, methods
\ No newline at end of file
+            if line.strip().upper().startswith('END TIMESERIES'):
+                break
+            rows.append(line)
+            if len(rows) == chunksize:
+                data = np.array(''.join(rows).split(), dtype=np.float64).reshape(-1, ncol)
+                yield data[:, 0].copy(), np.ascontiguousarray(data[:, 1:], dtype=dtype)
+                rows = []
+        # rows left after END TIMESERIES, or at the end of a file without it
+        data = np.array(''.join(rows).split(), dtype=np.float64).reshape(-1, ncol)
+        if len(data) > 0:
+            yield data[:, 0].copy(), np.ascontiguousarray(data[:, 1:], dtype=dtype)
+
+
+def write_ts_array(filename, times, values, tsnames, methods, attributes={}, chunksize=10000):
+    """Writes a modflow6 timeseries file from arrays, the counterpart of read_ts_array.
+    Numbers are written in the same G15.7 layout as LR2SERIES, see format_g.
+
+    Parameters
+    ----------
+    filename : str
+        filename of ts file to write
+    times : array-like
+        simulation times, shape (ntimes,).
+    values : array-like
+        timeseries values, shape (ntimes, nseries), in the order of tsnames.
+    tsnames : list of str
+        timeseries names.
+    methods : list of str or str
+        interpolation method for each timeseries, or one method for all.
+    attributes : dict, optional
+        further ATTRIBUTES entries, e.g. {'SFACS':[...]}.
+    chunksize : int, optional
+        number of rows formatted per write (default 10000).
+    """
+
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values)
+    if values.ndim == 1:
+        values = values.reshape(-1, 1)
+    if type(methods) == str:
+        methods = len(tsnames)*[methods]
+
+    with open(filename, 'w') as f:
+        f.write('BEGIN ATTRIBUTES\n')
+        f.write('   NAMES '+' '.join(tsnames)+'\n')
+        f.write('   METHODS '+' '.join(m.upper() for m in methods)+'\n')
+        for key, items in attributes.items():
+            if key.upper() in ['NAMES', 'METHODS', 'METHOD']:
+                continue
+            f.write('   '+key.upper()+' '+' '.join(map(str, items))+'\n')
+        f.write('END ATTRIBUTES\n \n \n')
+        f.write('BEGIN TIMESERIES\n')
+        data = np.column_stack([times, values.astype(np.float64)])
+        for i in range(0, len(data), chunksize):
+            f.write(''.join(''.join(map(format_g, r))+'\n' for r in data[i:i+chunksize].tolist()))
+        f.write('END TIMESERIES\n')
+
+
+def format_g(x):
+    """Formats a number as Fortran G15.7, the layout used by LUMPREM and LR2SERIES output files.
+
+    Parameters
+    ----------
+    x : float
+        value to format
+
+    Returns
+    -------
+    s : str
+        15 character string, e.g. '   31.00000    ' or '  1.1472113E-03'.
+    """
+    if x == 0:
+        return '   0.000000    '
+    k = int(('%.6E' % abs(x))[-3:])+1
+    if 0 <= k <= 7:
+        return ('%.*f' % (7-k, x)).rjust(11)+'    '
+    return ('%.7E' % x).rjust(15)
@@ -2,8 +2,12 @@ import pandas as pd
 import numpy as np
 import os
 from lumpyrem import run
+from lumpyrem import profiling
+from lumpyrem.timeaxis import get_timeaxis
 import datetime as dt
-from datetime import date
+import io
+import re
+import copy
 
 class Model():
     """
@@ -142,7 +146,7 @@ class Model():
                           mxiter=100, tol=1.0e-5, rbuf =[0.0], mbuf=[0.0],
                           start_date=None, end_date=None,
                           print_output=True, tpl=False, params=[],
-                          ssf_outfile=None, ssf_start_date=None, ssf_start_time='00:00:00', ssf_var=[]):
+                          ssf_outfile=None, ssf_start_date=None, ssf_start_time='00:00:00', ssf_var=[], timeaxis=None, state=None):
         """ Writes the LUMPREM model input files. 
         Default values are provded for all parameters however the user is advised to update those pertinnent to their case.
 
@@ -179,52 +183,23 @@ class Model():
         ssf_var : list, optional
             list of variables provided to LUMPREM to output SSF file. Must be list of lists (or list of tuples) in the format:
             [lumprem output column name, output site name, scale, offset, lower bound, upper bound]
+        timeaxis : timeaxis.TimeAxis, optional
+            simulation calendar. If provided, it supersedes numdays, noutdays, outdays, start_date and end_date.
+        state : dict, optional
+            initial state from get_state or warmstart.spinup. If provided, it supersedes vol, vol_br, rbuf and mbuf.
         """
 
-        if noutdays == None:
-            noutdays = numdays
-        
+        model = self
+        if state != None:
+            model = with_state(self, state)
+            rbuf, mbuf = state['rbuf'], state['mbuf']
+        if timeaxis != None:
+            numdays, noutdays, outdays, start_date = timeaxis.numdays, timeaxis.noutdays, timeaxis.outdays, timeaxis.start_date
+            end_date = None
+        numdays, noutdays, outdays = get_outdays(numdays=numdays, noutdays=noutdays, outdays=outdays,
+                                                 start_date=start_date, end_date=end_date)
         if start_date != None:
             start_date = dt.datetime.strptime(start_date, '%d/%m/%Y')
-
-            if end_date == None:
-                end_date = start_date + dt.timedelta(days=numdays)
-            else:
-                end_date = dt.datetime.strptime(end_date, '%d/%m/%Y')
-                numdays = (end_date-start_date).days
-
-            if noutdays == 'monthly':
-                outdays=[]
-                date = start_date + dt.timedelta(days=1)
-                while date <= end_date:
-                    if date.day == 1:
-                        timestep = (date-start_date).days
-                        outdays.append(timestep)
-                    date += dt.timedelta(days=1)
-                noutdays = len(outdays)
-
-            if noutdays == 'annual':
-                outdays=[]
-                date = start_date + dt.timedelta(days=1)
-                while date <= end_date:
-                    if date.month==1:
-                        if date.day == 1:
-                            timestep = (date-start_date).days
-                            outdays.append(timestep)
-                    date += dt.timedelta(days=1)
-                noutdays = len(outdays)
-
-
-            elif len(outdays)==0:
-                outdays =  np.linspace(0,numdays,noutdays+1, dtype=int)[1:]
-            else:
-                outdays = outdays
-            
-        elif len(outdays)==0:
-            outdays =  np.linspace(0,numdays,noutdays+1, dtype=int)[1:]
-        else:
-            outdays = outdays
-
             
         if file == False:
             file = 'lr_'+self.lumprem_model_name+'.in'
@@ -241,122 +216,28 @@ class Model():
             ssf_var=[ssf_var]
             
         
-        def write_file(file, obj, template=False):
-            if obj.maxvol_br   ==None: 
-                obj.maxvol_br  =''
-            if obj.extravol_br ==None: 
-                obj.extravol_br=''
-            if obj.gamma_br    ==None: 
-                obj.gamma_br   =''
-            if obj.ks_br       ==None: 
-                obj.ks_br      =''
-            if obj.m_br        ==None: 
-                obj.m_br       =''
-            if obj.l_br        ==None: 
-                obj.l_br       =''
-            if obj.vol_br      ==None: 
-                obj.vol_br     =''
-            if obj.epotfile_br ==None: 
-                obj.epotfile_br=''
-            if obj.epot_br_all ==None: 
-                obj.epot_br_all=''
-            with open(file, 'w+') as f:
-                #f.write('# File written using lumpyrem \n')
-                if template==True:
-                    f.write('ptf $\n')
-                f.write('* earth properties \n')
-                f.write("{0: <4} {1:<4} {2:<4} {3:<4} {4:<4}{5:}".format(obj.maxvol,obj.irrigvolfrac,
-                                                    obj.maxvol_br,obj.extravol_br,
-                                                    obj.gamma_br,'\n'))
-                f.write("{0: <4} {1:<4}{2:}".format(obj.rdelay,obj.mdelay,'\n'))
-                f.write("{0: <4} {1:<4} {2:<4} {3:<4} {4:<4} {5:<4} {6:<4}{7:}".format(obj.ks,obj.M,
-                                                                  obj.L,obj.mflowmax,
-                                                                  obj.ks_br,obj.m_br,obj.l_br,'\n'))
-                
-                f.write('* volume to elevation\n')
-                f.write("{0: <4} {1:<4} {2:<4} {3:<4} {4} {5}\n".format(obj.offset,obj.factor1,
-                                                                        obj.factor2,obj.power,obj.elevmin,
-                                                                        obj.elevmax))
-                
-                f.write('* topographic surface\n')
-                f.write("{0:}{1:}".format(obj.surface,'\n'))
-
-                f.write('* initial conditions\n')
-                f.write("{0: <4} {1: <4} {2:}".format(obj.vol,obj.vol_br,'\n'))
-                f.write("{0: <4} {1:}{2:}".format(len(rbuf), len(mbuf),'\n'))
-                for i in rbuf:
-                    f.write("{0:}{1:}".format(i,' '))
-                f.write('\n')
-                for i in mbuf:
-                    f.write("{0:}{1:}".format(i,' '))
-                f.write('\n')
-                
-                f.write('* solution parameters\n')
-                f.write("{0: <4} {1:<4} {2:<4}{3:}".format(nstep,mxiter,tol,'\n'))
-                
-                f.write('* timing information\n')
-                f.write("{0: <4} {1:<4}{2:}".format(numdays,noutdays,'\n'))
-                nlines=0
-                for i in outdays:
-                    f.write("{0:}{1:}".format(i,' '))
-                    nlines+=1
-                    if (nlines==10) & (i!=outdays[-1]):
-                        f.write('\n')
-                        nlines=0
-                f.write('\n')
-                
-                f.write('* data filenames\n')
-                if type(self.vegfile) == tuple:
-                    f.write("{0: <4} {1:}{2:}".format(obj.vegfile[0],obj.vegfile[1],'\n'))
-                else:
-                    f.write("{0:}{1:}".format(obj.vegfile,'\n'))
-                f.write("{0:}{1:}".format(obj.rainfile,'\n'))
-                f.write("{0:}{1:}".format(obj.epotfile,'\n'))
-                
-                if type(obj.irrigfile) == tuple:
-                    f.write("{0: <4} {1:}{2:}".format(obj.irrigfile[0],obj.irrigfile[1],'\n'))
-                else:
-                    f.write("{0:}{1:}".format(obj.irrigfile,'\n'))
-                if obj.epotfile_br!='':
-                    f.write("{0:}{1:}".format(obj.epotfile_br,'\n'))
-                elif obj.epot_br_all!='':
-                    f.write("{0:}{1:}".format(obj.epot_br_all,'\n'))
-                
-                if ssf_outfile!=None:
-                    f.write('* ssf file\n')
-                    f.write(ssf_outfile+'\n')
-                    f.write(f'dd/mm/yyyy\t{ssf_start_date}\t{ssf_start_time}\n')
-                    f.write(f'{len(ssf_var)}\n')
-                    for i in ssf_var:
-                        for j in i:
-                            f.write(f'{j}\t')
-                        f.write('\n')
-        
-        # write the LUMPREM input file
-        write_file(file, self)
-        if print_output==True:
-            print('LUMPREM model input file written to: \n'+file)
+        shared = render_shared(numdays=numdays, noutdays=noutdays, outdays=outdays, nstep=nstep, mxiter=mxiter, tol=tol,
+                               rbuf=rbuf, mbuf=mbuf, ssf_outfile=ssf_outfile, ssf_start_date=ssf_start_date,
+                               ssf_start_time=ssf_start_time, ssf_var=ssf_var)
 
-        # write the corresponding .tpl file
-        name = self.lumprem_model_name
-        if tpl!=False:
-            import copy
-            tmp = copy.deepcopy(self)
-            
-            for p in params:
-                predux = p[:2]
-                nameredux = name[:6]
-                tmp.__dict__[p] = ("$"+predux+"_"+nameredux).ljust(13)+'$'
-                if p =='vegfile':
-                    tmp.__dict__[p] = (("$cf_"+nameredux).ljust(13)+'$', ("$gm_"+nameredux).ljust(13)+'$')
-                if p =='irrigfile':
-                        tmp.__dict__[p] = (1, ("$if_"+nameredux).ljust(13)+'$')
-            write_file(tpl, tmp, template=True)     
+        with profiling.stage('write_model', self.lumprem_model_name) as stage:
+            # write the LUMPREM input file
+            with open(file, 'w+') as f:
+                f.write(render_model(model.__dict__, shared))
+            stage.wrote(file)
             if print_output==True:
-                print('PEST template file written to: \n'+tpl+'\n')
+                print('LUMPREM model input file written to: \n'+file)
+
+            # write the corresponding .tpl file
+            if tpl!=False:
+                with open(tpl, 'w+') as f:
+                    f.write(render_model(template_values(model, params), shared, template=True))
+                stage.wrote(tpl)
+                if print_output==True:
+                    print('PEST template file written to: \n'+tpl+'\n')
                 
     
-    def run_model(self, print_output=True, version=1):
+    def run_model(self, print_output=True, version=1, engine='lumprem', cache=None):
         """Runs the LUMPREM on model.
         
         Parameters
@@ -365,21 +246,41 @@ class Model():
             optionaly print LUMPREM output to screen
         version : int, optional
             determines whether LUMPREM or LUMPREM2 is called. Note that if LUMPREM2 parameters are used in the input files an error will be returned
+        engine : str, optional
+            'lumprem' calls the LUMPREM executable (default). 'numpy' runs the in-process engine from lumpyrem.engine instead.
+        cache : cache.RunCache, optional
+            if provided, outputs are restored from the cache when the model inputs are unchanged, and stored after a new run.
         """
         model_name = self.lumprem_model_name
         path = self.workspace
 
-        if version==1:
-            exe = 'lumprem'
-        if version==2:
-            exe = 'lumprem2'
+        with profiling.stage('run_model', model_name):
+            if engine=='numpy':
+                from lumpyrem import engine as lrengine
+                lrengine.run_files(['lr_'+model_name+'.in'], workspace=path, version=version)
+                if print_output==True:
+                    print('LUMPREM output written to: \n'+os.path.join(path,'lr_'+model_name+'.out'))
+                return
+
+            if version==1:
+                exe = 'lumprem'
+            if version==2:
+                exe = 'lumprem2'
             
-        run.run_process(exe, commands=['lr_'+model_name+'.in','lr_'+model_name+'.out','lr_'+model_name+'.csv'],path=path, print_output=print_output)
+            commands = ['lr_'+model_name+'.in','lr_'+model_name+'.out','lr_'+model_name+'.csv']
+            if cache != None:
+                status = cache.run_jobs([{'process':exe, 'commands':commands, 'path':path, 'name':model_name,
+                                          'log_file':'lr_'+model_name+'.log'}], print_output=print_output)
+                if print_output==True and status['cached'][0]==True:
+                    print('LUMPREM output restored from cache: \n'+os.path.join(path,'lr_'+model_name+'.out'))
+                return
+            run.run_process(exe, commands=commands,path=path, print_output=print_output)
 
 
 
-    def write_irigfile(self, numdays=None, irrig_start=0, fracyear=0.3, irrigfile='irrig.in',irrig_end=None, date_start='01/01/1900', date_end = None):
+    def write_irigfile(self, numdays=None, irrig_start=0, fracyear=0.3, irrigfile='irrig.in',irrig_end=None, date_start='01/01/1900', date_end = None, print_output=True):
         """ Writes an irrigation input file to be used by LUMPREM.
+        Use write_irigfiles to write the files of many models at once.
 
         Parameters
         ----------
@@ -387,6 +288,7 @@ class Model():
             total number of days for the simulation
         irrig_start : str, int
             first date or day on which irrigation starts. Can be positive number of days or str in 'dd/mm/yyyy' format. If str, then it must be later than start_date. If date str is used then start_date must be set.
+            If irrigation starts on day 0 or 1, it is on from the start of the simulation.
         fracyear : float, optional
             fraction of the year during which irrigation occurs. Must be between 0.0 and 1.0 (default 0.3)
         
@@ -398,91 +300,739 @@ class Model():
             date on which simulation ends (default None). If provided, this supercedes numdays. This aids in accoutning for month lengths and leap years.
         irrigfile : str, optional
             name of irrigation file to write (default 'irrig.in')
+        print_output : bool, optional
+            True (default), the name of the file written is printed.
         """
+        schedule = irrigation_schedule(date_start, irrig_start, numdays=numdays, date_end=date_end,
+                                       fracyear=fracyear, irrig_end=irrig_end)[0]
 
-        def add_years(d, years):
-            """Return a date that's `years` years after the date (or datetime)
-            object `d`. Return the same calendar date (month and day) in the
-            destination year, if it exists, otherwise use the following day
-            (thus changing February 29 to March 1).
-
-            """
-            try:
-                return d.replace(year = d.year + years)
-            except ValueError:
-                return d + (date(d.year + years, 1, 1) - date(d.year, 1, 1))
-                
+        # write the file
+        irrigfile = os.path.join(self.workspace,irrigfile)
 
-        date_start = dt.datetime.strptime(date_start, '%d/%m/%Y')
+        with open(irrigfile,'w') as f:
+            f.write(render_schedule(schedule))
+        if print_output==True:
+            print('Irrigation input file written to: \n'+irrigfile)
 
-        if type(date_end) == str:
-            numdays = dt.datetime.strptime(date_end, '%d/%m/%Y')
-        else:
-            numdays = date_start+dt.timedelta(days=numdays)
+        
+    def get_results(self, columns=None, float32=False, merge=True, timeaxis=None):
+        """ Reads the results from the LUMPREM model and returns a Dataframe with parameters and results.
 
+        Parameters
+        ----------
+        columns : list of str, optional
+            output columns to read (default None, all columns). See read_out.
+        float32 : bool, optional
+            True, results are read as float32 (default False).
+        merge : bool, optional
+            True (default), parameters are merged onto every output row. False, results and parameters are returned as separate frames.
+        timeaxis : timeaxis.TimeAxis, optional
+            simulation calendar. If provided, results are indexed by date.
 
-        if type(irrig_start) == str:
-            irrig_start = dt.datetime.strptime(irrig_start, '%d/%m/%Y')
-        else:
-            irrig_start = date_start + dt.timedelta(days=int(irrig_start))
+        Returns
+        -------
+        final : DataFrame or tuple of DataFrame
+            Pandas dataframe of  model results and parameters, or (results, parameters) if merge is False.
+        """
 
-        if irrig_end == None:
-            irrig_end = irrig_start + dt.timedelta(days=int(365*fracyear))
-        else:
-            irrig_end = dt.datetime.strptime(irrig_end, '%d/%m/%Y')
+        with profiling.stage('get_results', self.lumprem_model_name):
+            return read_results([self], columns=columns, float32=float32, merge=merge, timeaxis=timeaxis)
 
-        if irrig_start == 0:
-            tsteps = [[1,1,0.5]]
-        else:
-            tsteps = [[1,0,0.0]]
+    def get_state(self):
+        """Returns the state at the end of the model's output file (vol, vol_br, rbuf and mbuf), to start another run
+        from it. See warmstart.end_state.
 
-        
+        Returns
+        -------
+        state : dict
+            'day', 'vol', 'vol_br', 'rbuf' and 'mbuf'.
+        """
+        from lumpyrem import warmstart
+        return warmstart.end_state(os.path.join(self.workspace, 'lr_'+self.lumprem_model_name+'.out'),
+                                   rdelay=self.rdelay, mdelay=self.mdelay)
 
-        while irrig_start < numdays:
-            tsteps.append([(irrig_start-date_start).days, 1,0.5])
-            tsteps.append([(irrig_end-date_start).days, 0,0.0])
-            irrig_start = add_years(irrig_start,years=1)
-            irrig_end = add_years(irrig_end,years=1)
+    def extend(self, numdays, print_output=True, version=1, engine='lumprem', **kwargs):
+        """Simulates numdays more days from the end of the model's output file and appends them to it, without
+        re-running the history. Data files must cover the new days. See warmstart.extend for the other arguments.
 
-        
-        # write the file
-        irrigfile = os.path.join(self.workspace,irrigfile)
+        Parameters
+        ----------
+        numdays : int
+            number of new days to simulate.
+        print_output : bool, optional
+            True (default), the extended file is printed.
+        version : int, optional
+            determines whether LUMPREM or LUMPREM2 is called (default 1).
+        engine : str, optional
+            'lumprem' (default) calls the executable, 'numpy' runs the in-process engine.
 
-        with open(irrigfile,'w') as f:
-            for row in tsteps:
-                f.write("{0} {1} {2}{3}".format(row[0],row[1],row[2],'\n'))
-        print('Irrigation input file written to: \n'+irrigfile)
+        Returns
+        -------
+        state : dict
+            state the new days started from, see get_state.
+        """
+        from lumpyrem import warmstart
+        return warmstart.extend(self, numdays, version=version, engine=engine, print_output=print_output, **kwargs)
 
-        
-    def get_results(self):
-        """ Reads the results from the LUMPREM model and returns a Dataframe with parameters and results.
+    def spinup(self, numdays=365, tol=1.0e-5, maxiter=100, version=1, engine='lumprem', print_output=True):
+        """Runs the first numdays days repeatedly from the previous end state until vol and the delay buffers change
+        by less than tol, and returns the converged state. Write the production run with write_model(state=state).
+        See warmstart.spinup to spin up many models in parallel.
 
         Returns
         -------
-        final : DataFrame
-            Pandas dataframe of  model results and parameters.
+        state : dict
+            'vol', 'vol_br', 'rbuf' and 'mbuf'.
         """
+        from lumpyrem import warmstart
+        states, status = warmstart.spinup([self], numdays=numdays, tol=tol, maxiter=maxiter, version=version,
+                                          engine=engine, print_output=print_output)
+        return states[self.lumprem_model_name]
+
+
+def get_outdays(numdays=100, noutdays=None, outdays=[], start_date=None, end_date=None):
+    """ Returns the simulation length and the days on which LUMPREM records outputs.
+    Arguments follow the same conventions as Model.write_model.
 
-        filename = 'lr_'+str(self.lumprem_model_name)+'.out'
-        filename = os.path.join(self.workspace, filename)
-        df=pd.read_csv(filename,delim_whitespace=True,skipfooter=1,engine='python')
+    Parameters
+    ----------
+    numdays : int, optional
+        number of days of the model run (default 100)
+    noutdays : int or str, optional
+        number of days for which output is desired, 'monthly' or 'annual' (default None, results in all days being recoreded)
+    outdays : list, optional
+        list of days on which outputs are to be recorded. If provided, noutdays is its length.
+    start_date : str, optional
+        date on which simualtion starts in 'dd/mm/yyyy' format. Required if noutdays is 'monthly' or 'annual'.
+    end_date : str, optional
+        date str in 'dd/mm/yyyy' format. If provided, numdays is calculated as difference between start_date and end_date.
+
+    Returns
+    -------
+    numdays : int
+        number of days of the model run
+    noutdays : int
+        number of output days
+    outdays : list or array of int
+        days on which outputs are recorded
+    """
+    if noutdays == None:
+        noutdays = numdays
+    
+    if start_date != None:
+        start_date = dt.datetime.strptime(start_date, '%d/%m/%Y')
+
+        if end_date == None:
+            end_date = start_date + dt.timedelta(days=numdays)
+        else:
+            end_date = dt.datetime.strptime(end_date, '%d/%m/%Y')
+            numdays = (end_date-start_date).days
+
+        if noutdays in ('monthly', 'annual'):
+            axis = get_timeaxis(start_date.strftime('%d/%m/%Y'), end_date=end_date.strftime('%d/%m/%Y'), noutdays=noutdays)
+            outdays = axis.outdays
+            noutdays = axis.noutdays
+
+        elif len(outdays)==0:
+            outdays =  np.linspace(0,numdays,noutdays+1, dtype=int)[1:]
+        else:
+            noutdays = len(outdays)
         
-        # textlist = []
-        # with open(filename) as f:
-        #     for line in f:
-        #         textlist.append([i for i in line.split()])
-
-        # floatlist=[]
-        # for i in textlist[1:-2]:
-        #     floatlist.append([float(x) for x in i])
-        # df = pd.DataFrame(floatlist, columns=textlist[0])
-        df['lumprem_model_name'] = str(self.lumprem_model_name)
-
-        columns = self.__dict__.keys()
-        param = pd.DataFrame(columns=columns)
-        for k in columns:
-            param.at[0,k] = self.__dict__[k]
-            param[k] = pd.to_numeric(param[k],errors='ignore')
-
-        final = df.merge(param,how='outer', left_on='lumprem_model_name', right_on='lumprem_model_name')
-        return final
+    elif len(outdays)==0:
+        outdays =  np.linspace(0,numdays,noutdays+1, dtype=int)[1:]
+    else:
+        noutdays = len(outdays)
+
+    return numdays, noutdays, outdays
+
+
+def anniversaries(dates, years):
+    """Returns the month and day of each of dates in years.
+    29 February falls on 1 March in years that are not leap years.
+
+    Parameters
+    ----------
+    dates : array of datetime64[D]
+        one date per row, shape (n,).
+    years : array of int
+        years of each row, shape (n, k).
+
+    Returns
+    -------
+    dates : array of datetime64[D]
+        shape (n, k).
+    """
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    months = dates.astype('datetime64[M]')
+    day = (dates-months.astype('datetime64[D]')).astype(int)
+    month = months.astype(int) % 12
+    first = ((np.asarray(years)-1970)*12+month[:, None]).astype('datetime64[M]')
+    return first.astype('datetime64[D]')+day[:, None]
+
+
+def irrigation_schedule(date_start, irrig_start, numdays=None, date_end=None, fracyear=0.3, irrig_end=None):
+    """ Returns the days on which irrigation switches on and off for many zones at once.
+    Irrigation seasons repeat each year on the same dates as the first season. Arguments follow Model.write_irigfile;
+    irrig_start, irrig_end and fracyear may be lists with one value per zone.
+
+    Parameters
+    ----------
+    date_start : str
+        date on which simulation starts in 'dd/mm/yyyy' format.
+    irrig_start : int, str or list
+        first day (int) or date ('dd/mm/yyyy') on which irrigation starts, for each zone.
+    numdays : int, optional
+        total number of days for the simulation. Ignored if date_end is provided.
+    date_end : str, optional
+        date on which simulation ends in 'dd/mm/yyyy' format (default None).
+    fracyear : float or list, optional
+        fraction of the year during which irrigation occurs (default 0.3). Ignored if irrig_end is provided.
+    irrig_end : str or list, optional
+        first date on which irrigation ends in 'dd/mm/yyyy' format, for each zone (default None).
+
+    Returns
+    -------
+    schedules : list of arrays
+        for each zone, an array of int with one row per switch: the day and 1 (irrigation on) or 0 (off).
+        The first row is day 1.
+    """
+    def to_date(value):
+        if type(value) == str:
+            return np.datetime64(dt.datetime.strptime(value, '%d/%m/%Y'), 'D')
+        return start+int(value)
+
+    start = np.datetime64(dt.datetime.strptime(date_start, '%d/%m/%Y'), 'D')
+    if type(date_end) == str:
+        end = np.datetime64(dt.datetime.strptime(date_end, '%d/%m/%Y'), 'D')
+    else:
+        end = start+int(numdays)
+
+    if type(irrig_start) not in (list, tuple, np.ndarray):
+        irrig_start = [irrig_start]
+    on = np.array([to_date(i) for i in irrig_start], dtype='datetime64[D]')
+    if irrig_end == None:
+        off = on+(365*np.asarray(fracyear, dtype=float)).astype(int)
+    else:
+        if type(irrig_end) == str:
+            irrig_end = [irrig_end]
+        off = np.array([to_date(i) for i in irrig_end], dtype='datetime64[D]')
+    off = np.broadcast_to(off, on.shape)
+
+    # one column per year, until the last season starting before the end of the simulation
+    year_on = on.astype('datetime64[Y]').astype(int)+1970
+    year_off = off.astype('datetime64[Y]').astype(int)+1970
+    years = np.arange(max(end.astype('datetime64[Y]').astype(int)+1971-year_on.min(), 1))
+    on = anniversaries(on, year_on[:, None]+years)
+    off = anniversaries(off, year_off[:, None]+years)
+    valid = on < end
+
+    days = np.stack([(on-start).astype(int), (off-start).astype(int)], axis=2)
+    codes = np.broadcast_to(np.array([1, 0]), days.shape)
+    schedules = []
+    for i in range(len(on)):
+        d = days[i][valid[i]].ravel()
+        c = codes[i][valid[i]].ravel()
+        # switches on or before day 1 set the state at the start of the simulation
+        first = d <= 1
+        state = c[first][-1] if first.any() else 0
+        schedules.append(np.column_stack([np.r_[1, d[~first]], np.r_[state, c[~first]]]))
+    return schedules
+
+
+def render_schedule(schedule, gwfrac=0.5):
+    """Returns the text of a LUMPREM irrigation file from a schedule returned by irrigation_schedule.
+    gwfrac is the fraction of irrigation water extracted from groundwater while irrigation is on (default 0.5)."""
+    frac = [0.0, gwfrac]
+    return ''.join("{0} {1} {2}{3}".format(day, code, frac[code], '\n') for day, code in schedule.tolist())
+
+
+def write_irigfiles(model_list, date_start, irrig_start, numdays=None, date_end=None, fracyear=0.3, irrig_end=None,
+                    irrigfile='irrig.in', gwfrac=0.5, print_output=True):
+    """ Writes the irrigation files of many models in one pass and sets the irrigfile attribute of each model.
+    Models with identical schedules in the same workspace share a file. Arguments follow Model.write_irigfile;
+    irrig_start, irrig_end and fracyear may be lists with one value per model.
+
+    Parameters
+    ----------
+    model_list : list
+        list of lumprem Model objects
+    irrigfile : str, optional
+        name of the irrigation file (default 'irrig.in'). If models have different schedules, files are
+        numbered, e.g. irrig_1.in, irrig_2.in.
+    gwfrac : float, optional
+        fraction of irrigation water extracted from groundwater (default 0.5).
+    print_output : bool, optional
+        True (default), a summary is printed.
+
+    Returns
+    -------
+    files : list of str
+        paths of the files written.
+    """
+    n = len(model_list)
+    if type(irrig_start) not in (list, tuple, np.ndarray):
+        irrig_start = n*[irrig_start]
+    if type(irrig_end) == str:
+        irrig_end = n*[irrig_end]
+    schedules = irrigation_schedule(date_start, irrig_start, numdays=numdays, date_end=date_end,
+                                    fracyear=fracyear, irrig_end=irrig_end)
+    texts = [render_schedule(s, gwfrac) for s in schedules]
+
+    distinct = {}
+    for text in texts:
+        distinct.setdefault(text, len(distinct)+1)
+    stem, ext = os.path.splitext(irrigfile)
+
+    files = []
+    for model, text in zip(model_list, texts):
+        name = irrigfile if len(distinct) == 1 else stem+'_'+str(distinct[text])+ext
+        file = os.path.join(model.workspace, name)
+        if file not in files:
+            with open(file, 'w') as f:
+                f.write(text)
+            files.append(file)
+        model.irrigfile = name
+
+    if print_output==True:
+        print(str(len(files))+' irrigation input files written for '+str(n)+' models.')
+    return files
+
+
+def run_models(model_list, workers=1, version=1, timeout=None, print_output=False, cache=None, store=None):
+    """Runs LUMPREM on a list of Model objects, optionally several at a time.
+    The LUMPREM input files must already have been written with Model.write_model. A model that fails does not stop the others.
+
+    Parameters
+    ----------
+    model_list : list
+        list of lumprem Model objects
+    workers : int, optional
+        number of LUMPREM processes to run at the same time (default 1). None uses the number of CPUs.
+    version : int, optional
+        determines whether LUMPREM or LUMPREM2 is called (default 1)
+    timeout : float, optional
+        seconds after which a LUMPREM run is killed and recorded as failed (default None, no limit)
+    print_output : bool, optional
+        optionaly print failed runs to screen as they finish (default False). LUMPREM output is written to lr_<model_name>.log
+    cache : cache.RunCache, optional
+        if provided, models whose inputs are unchanged are restored from the cache instead of being run.
+    store : resultstore.ResultStore, optional
+        if provided, the outputs of the models that succeeded are added to the store (opened in 'r+' mode).
+
+    Returns
+    -------
+    status : DataFrame
+        exit status and wall time of each model run.
+    """
+    if version==1:
+        exe = 'lumprem'
+    if version==2:
+        exe = 'lumprem2'
+
+    jobs = []
+    for model in model_list:
+        model_name = model.lumprem_model_name
+        jobs.append({'process':exe, 'commands':['lr_'+model_name+'.in','lr_'+model_name+'.out','lr_'+model_name+'.csv'],
+                     'path':model.workspace, 'name':model_name, 'log_file':'lr_'+model_name+'.log'})
+    if cache != None:
+        status = cache.run_jobs(jobs, workers=workers, timeout=timeout, print_output=print_output)
+    else:
+        status = run.run_jobs(jobs, workers=workers, timeout=timeout, print_output=print_output)
+    if store != None:
+        store.add_models([m for m, ok in zip(model_list, status['success']) if ok == True])
+    return status
+
+
+def read_out(filename, columns=None, float32=False, timeaxis=None):
+    """Reads a LUMPREM or LUMPREM2 output (.out) file.
+    The table is parsed in bulk with the pandas C parser; the " total" footer is skipped.
+
+    Parameters
+    ----------
+    filename : str
+        path to the .out file.
+    columns : list of str, optional
+        names of the columns to read, e.g. ['total_rech', 'elevation']. The days column is always included (default None, all columns).
+    float32 : bool, optional
+        True, results are returned as float32 to halve memory (default False, float64).
+    timeaxis : timeaxis.TimeAxis, optional
+        simulation calendar. If provided, the frame is indexed by the date of each output day.
+
+    Returns
+    -------
+    df : DataFrame
+        one row per output day. days is returned as int.
+    """
+    with profiling.stage('read_out', os.path.basename(filename)) as stage:
+        df = parse_out(filename, columns, float32, stage)
+    if timeaxis != None:
+        df.index = timeaxis.to_dates(df['days'].values)
+    return df
+
+
+def parse_out(filename, columns, float32, stage):
+    """Parses a LUMPREM output file for read_out."""
+    with open(filename) as f:
+        text = f.read()
+    stage.read(filename)
+
+    # the table ends at the first blank line; the totals follow it
+    end = re.search(r'\n[ \t]*\r?\n', text)
+    if end != None:
+        text = text[:end.start()+1]
+
+    usecols = None
+    if columns != None:
+        usecols = ['days']+[c for c in columns if c != 'days']
+    dtype = np.float32 if float32==True else np.float64
+
+    df = pd.read_csv(io.StringIO(text), sep=r'\s+', engine='c', usecols=usecols, dtype=dtype)
+    if usecols != None:
+        df = df[usecols]
+    df['days'] = df['days'].astype(int)
+    return df
+
+
+def get_parameters(model_list):
+    """Returns a table of the attributes of a list of Model objects, one row per model.
+
+    Parameters
+    ----------
+    model_list : list
+        list of lumprem Model objects
+
+    Returns
+    -------
+    params : DataFrame
+        one row per model. Numeric attributes are converted to numbers; lumprem_model_name is categorical.
+    """
+    params = pd.DataFrame([m.__dict__ for m in model_list])
+    for k in params.columns:
+        try:
+            params[k] = pd.to_numeric(params[k])
+        except (ValueError, TypeError):
+            pass
+    params['lumprem_model_name'] = pd.Categorical(params['lumprem_model_name'].astype(str))
+    return params
+
+
+def read_results(model_list, workspace=None, columns=None, float32=False, merge=False, timeaxis=None, store=None):
+    """Reads the results of a list of Model objects.
+    Output data and parameters are returned as separate frames keyed by a categorical model name, so parameters are not repeated on every output row.
+    Use merge_results to build the combined view when it is needed.
+
+    Parameters
+    ----------
+    model_list : list
+        list of lumprem Model objects
+    workspace : str, optional
+        folder holding the .out files (default None, each model's own workspace).
+    columns : list of str, optional
+        output columns to read (default None, all columns). See read_out.
+    float32 : bool, optional
+        True, results are read as float32 (default False).
+    merge : bool, optional
+        True, the merged view is returned instead (default False).
+    timeaxis : timeaxis.TimeAxis, optional
+        simulation calendar. If provided, results are indexed by date.
+    store : resultstore.ResultStore, optional
+        if provided, outputs are read from the store instead of the .out files.
+
+    Returns
+    -------
+    results : DataFrame
+        output of all models, with a categorical model_name column.
+    params : DataFrame
+        one row per model, see get_parameters.
+    """
+    names = [str(m.lumprem_model_name) for m in model_list]
+    frames = []
+    for m, name in zip(model_list, names):
+        if store != None:
+            frames.append(store.read_out(name, columns=columns, float32=float32))
+            continue
+        path = m.workspace if workspace == None else workspace
+        frames.append(read_out(os.path.join(path, 'lr_'+name+'.out'), columns=columns, float32=float32))
+
+    results = pd.concat(frames, ignore_index=True)
+    codes = np.repeat(np.arange(len(names)), [len(f) for f in frames])
+    results['model_name'] = pd.Categorical.from_codes(codes, categories=names)
+    if timeaxis != None:
+        results.index = timeaxis.to_dates(results['days'].values)
+    params = get_parameters(model_list)
+
+    if merge==True:
+        return merge_results(results, params)
+    return results, params
+
+
+def merge_results(results, params):
+    """Merges the parameter table onto the results, as returned by read_results.
+
+    Parameters
+    ----------
+    results : DataFrame
+        output of all models, with a model_name column.
+    params : DataFrame
+        parameter table with a lumprem_model_name column.
+
+    Returns
+    -------
+    final : DataFrame
+        Pandas dataframe of model results with the parameters of each model on every row.
+    """
+    with profiling.stage('merge_results'):
+        final = results.merge(params, how='left', left_on='model_name', right_on='lumprem_model_name')
+        final.index = results.index
+    return final
+
+
+def with_state(model, state):
+    """Returns a copy of a Model with vol (and vol_br, if the state has one) taken from a state, as returned by
+    Model.get_state or warmstart.spinup. model is not modified."""
+    model = copy.copy(model)
+    model.vol = state['vol']
+    if state.get('vol_br') != None:
+        model.vol_br = state['vol_br']
+    return model
+
+
+def render_shared(numdays, noutdays, outdays, nstep=1, mxiter=100, tol=1.0e-5, rbuf=[0.0], mbuf=[0.0],
+                  ssf_outfile=None, ssf_start_date=None, ssf_start_time='00:00:00', ssf_var=[]):
+    """Renders the blocks of a LUMPREM input file that are the same for every model of a run.
+    Arguments follow Model.write_model; numdays, noutdays and outdays as returned by get_outdays.
+
+    Returns
+    -------
+    shared : dict
+        text of the 'buffers' (initial delay buffers), 'solution' (solution parameters and timing information) and 'ssf' blocks.
+    """
+    shared = {}
+    shared['buffers'] = ("{0: <4} {1:}{2:}".format(len(rbuf), len(mbuf),'\n')
+                         +''.join("{0:}{1:}".format(i,' ') for i in rbuf)+'\n'
+                         +''.join("{0:}{1:}".format(i,' ') for i in mbuf)+'\n')
+
+    lines = []
+    nlines = 0
+    for i in outdays:
+        lines.append("{0:}{1:}".format(i,' '))
+        nlines+=1
+        if (nlines==10) & (i!=outdays[-1]):
+            lines.append('\n')
+            nlines=0
+    shared['solution'] = ('* solution parameters\n'
+                          +"{0: <4} {1:<4} {2:<4}{3:}".format(nstep,mxiter,tol,'\n')
+                          +'* timing information\n'
+                          +"{0: <4} {1:<4}{2:}".format(numdays,noutdays,'\n')
+                          +''.join(lines)+'\n')
+
+    shared['ssf'] = ''
+    if ssf_outfile!=None:
+        shared['ssf'] = ('* ssf file\n'
+                         +ssf_outfile+'\n'
+                         +f'dd/mm/yyyy\t{ssf_start_date}\t{ssf_start_time}\n'
+                         +f'{len(ssf_var)}\n'
+                         +''.join(''.join(f'{j}\t' for j in i)+'\n' for i in ssf_var))
+    return shared
+
+
+def render_model(values, shared, template=False):
+    """Renders a LUMPREM input or PEST template file into a string.
+    values is read only, so models are neither copied nor modified.
+
+    Parameters
+    ----------
+    values : dict
+        model attributes, e.g. Model.__dict__ or the result of template_values.
+    shared : dict
+        blocks shared by all models, as returned by render_shared.
+    template : bool, optional
+        True, a PEST template file is rendered (default False).
+
+    Returns
+    -------
+    text : str
+        contents of the file.
+    """
+    obj = dict(values)
+    for k in ['maxvol_br','extravol_br','gamma_br','ks_br','m_br','l_br','vol_br','epotfile_br','epot_br_all']:
+        if obj.get(k) == None:
+            obj[k] = ''
+
+    text = []
+    if template==True:
+        text.append('ptf $\n')
+    text.append('* earth properties \n')
+    text.append("{0: <4} {1:<4} {2:<4} {3:<4} {4:<4}{5:}".format(obj['maxvol'],obj['irrigvolfrac'],
+                                        obj['maxvol_br'],obj['extravol_br'],obj['gamma_br'],'\n'))
+    text.append("{0: <4} {1:<4}{2:}".format(obj['rdelay'],obj['mdelay'],'\n'))
+    text.append("{0: <4} {1:<4} {2:<4} {3:<4} {4:<4} {5:<4} {6:<4}{7:}".format(obj['ks'],obj['M'],obj['L'],obj['mflowmax'],
+                                        obj['ks_br'],obj['m_br'],obj['l_br'],'\n'))
+    text.append('* volume to elevation\n')
+    text.append("{0: <4} {1:<4} {2:<4} {3:<4} {4} {5}\n".format(obj['offset'],obj['factor1'],obj['factor2'],
+                                        obj['power'],obj['elevmin'],obj['elevmax']))
+    text.append('* topographic surface\n')
+    text.append("{0:}{1:}".format(obj['surface'],'\n'))
+    text.append('* initial conditions\n')
+    text.append("{0: <4} {1: <4} {2:}".format(obj['vol'],obj['vol_br'],'\n'))
+    text.append(shared['buffers'])
+    text.append(shared['solution'])
+
+    text.append('* data filenames\n')
+    if type(obj['vegfile']) == tuple:
+        text.append("{0: <4} {1:}{2:}".format(obj['vegfile'][0],obj['vegfile'][1],'\n'))
+    else:
+        text.append("{0:}{1:}".format(obj['vegfile'],'\n'))
+    text.append("{0:}{1:}".format(obj['rainfile'],'\n'))
+    text.append("{0:}{1:}".format(obj['epotfile'],'\n'))
+    if type(obj['irrigfile']) == tuple:
+        text.append("{0: <4} {1:}{2:}".format(obj['irrigfile'][0],obj['irrigfile'][1],'\n'))
+    else:
+        text.append("{0:}{1:}".format(obj['irrigfile'],'\n'))
+    if obj['epotfile_br']!='':
+        text.append("{0:}{1:}".format(obj['epotfile_br'],'\n'))
+    elif obj['epot_br_all']!='':
+        text.append("{0:}{1:}".format(obj['epot_br_all'],'\n'))
+    text.append(shared['ssf'])
+    return ''.join(text)
+
+
+def template_values(model, params):
+    """Returns the attributes of a Model with PEST parameter markers in place of the parameters listed in params.
+    The model itself is not modified.
+
+    Parameters
+    ----------
+    model : Model
+        lumprem Model object
+    params : list of str
+        names of Model attributes to parameterise
+
+    Returns
+    -------
+    values : dict
+        model attributes for render_model.
+    """
+    values = dict(model.__dict__)
+    for p in params:
+        names = [("$"+n).ljust(13)+'$' for n in par_names(p, model.lumprem_model_name)]
+        values[p] = names[0]
+        if p =='vegfile':
+            values[p] = tuple(names)
+        if p =='irrigfile':
+            values[p] = (1, names[0])
+    return values
+
+
+# parameter name prefixes that differ from the first two letters of the Model attribute
+PAR_PREFIX = {'factor1':'f1', 'factor2':'f2', 'elevmin':'en', 'elevmax':'ex', 'vegfile':['cf','gm'], 'irrigfile':'if',
+              'maxvol_br':'mxb', 'extravol_br':'evb', 'gamma_br':'gmb', 'ks_br':'ksb', 'm_br':'mb', 'l_br':'lb',
+              'vol_br':'vb'}
+
+def par_names(p, model_name):
+    """Returns the PEST parameter names used for a Model attribute in template and control files.
+
+    Parameters
+    ----------
+    p : str
+        name of the Model attribute, e.g. 'maxvol'. 'vegfile' gives two parameters (crop factor and gamma).
+    model_name : str
+        LUMPREM model name. The first 6 characters are used.
+
+    Returns
+    -------
+    names : list of str
+        parameter names, e.g. ['ma_abc'].
+    """
+    prefix = PAR_PREFIX.get(p, p[:2])
+    if type(prefix) != list:
+        prefix = [prefix]
+    return [i+"_"+model_name[:6] for i in prefix]
+
+
+def write_models(model_list, numdays=100, noutdays=None, nstep=1, outdays=[],
+                 mxiter=100, tol=1.0e-5, rbuf=[0.0], mbuf=[0.0],
+                 start_date=None, end_date=None, tpl=True, params=[], workers=1, print_output=True,
+                 ssf_outfile=None, ssf_start_date=None, ssf_start_time='00:00:00', ssf_var=[], timeaxis=None, states=None):
+    """Writes the LUMPREM input files (and optionally PEST template files) of many models with the same timing settings.
+    The blocks shared by all models are rendered once and each file is written from a single buffer.
+    Arguments follow Model.write_model. Files are named lr_<model_name>.in and .tpl in each model's workspace.
+
+    Parameters
+    ----------
+    model_list : list
+        list of lumprem Model objects
+    tpl : bool, optional
+        True (default), PEST template files are written as well.
+    params : list of str, optional
+        names of Model attributes to parameterise in the template files.
+    workers : int, optional
+        number of threads used to write files (default 1). None uses the number of CPUs.
+    print_output : bool, optional
+        True (default), a summary is printed.
+    timeaxis : timeaxis.TimeAxis, optional
+        simulation calendar. If provided, it supersedes numdays, noutdays, outdays, start_date and end_date.
+    states : dict, optional
+        model name to initial state, e.g. from warmstart.spinup. Models in states start from their own vol, vol_br,
+        rbuf and mbuf instead of the shared rbuf and mbuf.
+
+    Returns
+    -------
+    files : list of str
+        paths of the files written.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if timeaxis != None:
+        numdays, noutdays, outdays, start_date = timeaxis.numdays, timeaxis.noutdays, timeaxis.outdays, timeaxis.start_date
+        end_date = None
+    numdays, noutdays, outdays = get_outdays(numdays=numdays, noutdays=noutdays, outdays=outdays,
+                                             start_date=start_date, end_date=end_date)
+    if start_date != None:
+        start_date = dt.datetime.strptime(start_date, '%d/%m/%Y')
+    if ssf_start_date==None:
+        ssf_start_date=start_date
+    if any(isinstance(el, list) for el in ssf_var)==False:
+        ssf_var=[ssf_var]
+
+    shared = render_shared(numdays=numdays, noutdays=noutdays, outdays=outdays, nstep=nstep, mxiter=mxiter, tol=tol,
+                           rbuf=rbuf, mbuf=mbuf, ssf_outfile=ssf_outfile, ssf_start_date=ssf_start_date,
+                           ssf_start_time=ssf_start_time, ssf_var=ssf_var)
+
+    for workspace in set(m.workspace for m in model_list):
+        if not os.path.exists(workspace):
+            os.makedirs(workspace)
+
+    def write_one(model):
+        file = os.path.join(model.workspace, 'lr_'+model.lumprem_model_name+'.in')
+        blocks = shared
+        if states != None and model.lumprem_model_name in states:
+            state = states[model.lumprem_model_name]
+            model = with_state(model, state)
+            blocks = dict(shared, buffers=render_shared(0, 0, [], rbuf=state['rbuf'], mbuf=state['mbuf'])['buffers'])
+        with open(file, 'w') as f:
+            f.write(render_model(model.__dict__, blocks))
+        if tpl==False:
+            return [file]
+        tplfile = os.path.splitext(file)[0]+'.tpl'
+        with open(tplfile, 'w') as f:
+            f.write(render_model(template_values(model, params), blocks, template=True))
+        return [file, tplfile]
+
+    if workers == None:
+        workers = os.cpu_count()
+    workers = max(1, int(workers))
+
+    with profiling.stage('write_models') as stage:
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                written = list(pool.map(write_one, model_list))
+        else:
+            written = [write_one(m) for m in model_list]
+        files = [f for w in written for f in w]
+        for f in files:
+            stage.wrote(f)
+
+    if print_output==True:
+        print(str(len(files))+' LUMPREM input and template files written.')
+    return files
@@ -1,7 +1,12 @@
 import pandas as pd
 import numpy as np
 import os
+import copy
 from lumpyrem import run
+from lumpyrem import lumprem
+from lumpyrem import lr2series
+from lumpyrem import profiling
+from lumpyrem.timeaxis import TimeAxis, get_timeaxis
 
 class Simulation():
 	"""
@@ -25,13 +30,21 @@ class Simulation():
 		name of the batch file to be generated.(default 'run.bat')
 	pest_control_file: str, optional
 		name of the pest control file to be generated.(default 'temp.pst')
+	timeaxis : timeaxis.TimeAxis, optional
+		simulation calendar. If provided, start_date and end_date are taken from it, and nday_out if it is monthly or annual.
 
 	"""
 
-	def __init__(self, model_list, silofile, start_date, end_date, steps_per_day = 1,nday_out ='monthly',batch_file = 'run.bat',pest_control_file = 'temp.pst', workspace=False):
+	def __init__(self, model_list, silofile, start_date, end_date, steps_per_day = 1,nday_out ='monthly',batch_file = 'run.bat',pest_control_file = 'temp.pst', workspace=False, timeaxis=None):
+		if timeaxis != None:
+			start_date = timeaxis.start_date
+			end_date = timeaxis.end_date
+			if timeaxis.freq in ('monthly', 'annual'):
+				nday_out = timeaxis.freq
 		self.start_date = start_date
 		self.end_date = end_date
 		self.nday_out = nday_out
+		self.timeaxis = timeaxis
 		self.steps_per_day = steps_per_day
 		self.model_list = model_list
 
@@ -103,55 +116,259 @@ class Simulation():
 		f.close()
 
 		lumprepin = os.path.basename(infile)
-		run.run_process('lumprep', commands=[lumprepin], path=self.workspace)
+		with profiling.stage('write_simulation', lumprepin) as stage:
+			stage.wrote(infile)
+			run.run_process('lumprep', commands=[lumprepin], path=self.workspace)
 
-	def run_simulation(self):
+	def write_climate(self, nodata=0.0, print_output=True):
+		"""Writes the LUMPREM rain and evaporation files from SILO data without calling LUMPREP.
+		Each climate source (SILO file and evaporation column) is read and written once; models that share a source reference the same files.
+		The rainfile and epotfile attributes of the models are set accordingly.
+		A model uses its own silofile attribute if it is a (file name, column) tuple, otherwise the silofile of the Simulation.
+
+		Parameters
+		----------
+		nodata : float, optional
+			value used for NULL and missing days, in mm (default 0.0).
+		print_output : bool, optional
+			True (default), the names of the files written are printed.
+
+		Returns
+		-------
+		files : dict
+			climate source (silo file, column) to (rain file, evaporation file).
+		"""
+		sources = []
+		for model in self.model_list:
+			source = getattr(model, 'silofile', None)
+			if type(source) != tuple or type(source[0]) != str:
+				source = self.silofile
+			sources.append((source[0], source[1].lower()))
+
+		unique = list(dict.fromkeys(sources))
+		files = {}
+		for i, source in enumerate(unique):
+			if len(unique) == 1:
+				names = ('rain.dat', 'epot.dat')
+			else:
+				stem = os.path.splitext(os.path.basename(source[0]))[0]+'_'+source[1]
+				names = ('rain_'+stem+'.dat', 'epot_'+stem+'.dat')
+			with profiling.stage('write_climate', source[0]) as stage:
+				write_climate(os.path.join(self.workspace, source[0]), self.start_date, self.end_date, evap=source[1],
+							  rainfile=names[0], epotfile=names[1], workspace=self.workspace, nodata=nodata,
+							  print_output=print_output)
+				stage.read(os.path.join(self.workspace, source[0]))
+				stage.wrote(os.path.join(self.workspace, names[0]))
+				stage.wrote(os.path.join(self.workspace, names[1]))
+			files[source] = names
+
+		for model, source in zip(self.model_list, sources):
+			model.rainfile, model.epotfile = files[source]
+		return files
+
+	def run_simulation(self, workers=1, timeout=None, print_output=False, cache=None):
 		"""Runs LUMPREM on models created using LUMPREP in the Simulation object.
+		Models are run concurrently when workers > 1. A model that fails does not stop the others.
+
+		Parameters
+		----------
+		workers : int, optional
+			number of LUMPREM processes to run at the same time (default 1). None uses the number of CPUs.
+		timeout : float, optional
+			seconds after which a LUMPREM run is killed and recorded as failed (default None, no limit)
+		print_output : bool, optional
+			optionaly print failed runs to screen as they finish (default False). LUMPREM output is written to lr_<model_name>.log
+		cache : cache.RunCache, optional
+			if provided, models whose inputs are unchanged are restored from the cache instead of being run.
+
+		Returns
+		-------
+		status : DataFrame
+			exit status and wall time of each model run.
 		"""
+		jobs = []
 		for model in self.model_list:
 			model_name = model.lumprem_model_name
-			run.run_process('lumprem', commands=['lr_'+model_name+'.in','lr_'+model_name+'.out'], path=self.workspace)
+			jobs.append({'process':'lumprem', 'commands':['lr_'+model_name+'.in','lr_'+model_name+'.out'], 'path':self.workspace, 'name':model_name, 'log_file':'lr_'+model_name+'.log'})
+		with profiling.stage('run_simulation'):
+			if cache != None:
+				return cache.run_jobs(jobs, workers=workers, timeout=timeout, print_output=print_output)
+			return run.run_jobs(jobs, workers=workers, timeout=timeout, print_output=print_output)
 
-	def get_results(self):
+	def get_timeaxis(self):
+		"""Returns the simulation calendar, built from start_date, end_date and nday_out on first use.
+		An integer nday_out records outputs every nday_out days.
+
+		Returns
+		-------
+		timeaxis : timeaxis.TimeAxis
+		"""
+		if self.timeaxis == None:
+			if self.nday_out in ('monthly', 'annual'):
+				self.timeaxis = get_timeaxis(self.start_date, self.end_date, noutdays=self.nday_out)
+			else:
+				axis = get_timeaxis(self.start_date, self.end_date)
+				outdays = np.arange(int(self.nday_out), axis.numdays+1, int(self.nday_out))
+				self.timeaxis = TimeAxis(self.start_date, self.end_date, outdays=outdays)
+		return self.timeaxis
+
+	def get_results(self, columns=None, float32=False, merge=True, timeaxis=None, store=None):
 		""" Reads the results from all LUMPREM models in the Simulation object and returns a Dataframe with parameters and results.
 
+		Parameters
+		----------
+		columns : list of str, optional
+			output columns to read (default None, all columns). See lumprem.read_out.
+		float32 : bool, optional
+			True, results are read as float32 (default False).
+		merge : bool, optional
+			True (default), parameters are merged onto every output row. False, results and parameters are returned as separate frames keyed by model_name.
+		timeaxis : timeaxis.TimeAxis, optional
+			simulation calendar. If provided, or if the Simulation was created with one, results are indexed by date.
+		store : resultstore.ResultStore, optional
+			if provided, outputs are read from the store instead of the .out files.
+
 		Returns
 		-------
-		final : DataFrame
-			Pandas dataframe of all model results and parameters from the Simulation object.
+		final : DataFrame or tuple of DataFrame
+			Pandas dataframe of all model results and parameters from the Simulation object, or (results, parameters) if merge is False.
 		"""
+		if timeaxis == None:
+			timeaxis = self.timeaxis
+		with profiling.stage('get_results'):
+			return lumprem.read_results(self.model_list, workspace=self.workspace, columns=columns, float32=float32, merge=merge, timeaxis=timeaxis, store=store)
 
-		results = pd.DataFrame()
-		for m in self.model_names:
-			abc = []
-			filename = os.path.join(self.workspace,'lr_'+str(m)+'.out')
-			textlist = []
+	def spinup(self, numdays=365, tol=1.0e-5, maxiter=100, workers=1, engine='lumprem', print_output=True):
+		"""Spins up all models of the Simulation in parallel from the climate files in its workspace, see warmstart.spinup.
+		The converged states are written into the initial conditions of the lr_<model_name>.in files already in the workspace,
+		so call it after write_simulation.
 
-			with open(filename) as f:
-				for line in f:
-					textlist.append([i for i in line.split()])
+		Parameters
+		----------
+		numdays : int, optional
+			length of the spin-up window in days (default 365).
+		tol : float, optional
+			largest change of vol, vol_br or a buffer volume between two runs at convergence (default 1.0e-5).
+		maxiter : int, optional
+			largest number of runs of a model (default 100).
+		workers : int, optional
+			number of LUMPREM processes to run at the same time (default 1). None uses the number of CPUs.
+		engine : str, optional
+			'lumprem' (default) calls the executable, 'numpy' runs the in-process engine.
+		print_output : bool, optional
+			True (default), a summary is printed.
+
+		Returns
+		-------
+		states : dict
+			model name to converged state.
+		status : DataFrame
+			iterations, last change and convergence of each model.
+		"""
+		from lumpyrem import warmstart
+		models = []
+		for m in self.model_list:
+			m = copy.copy(m)
+			m.workspace = self.workspace
+			models.append(m)
+		states, status = warmstart.spinup(models, numdays=numdays, tol=tol, maxiter=maxiter, workers=workers,
+										  nstep=self.steps_per_day, engine=engine, print_output=print_output)
+		for name, state in states.items():
+			infile = os.path.join(self.workspace, 'lr_'+name+'.in')
+			if os.path.exists(infile):
+				warmstart.write_state(infile, state)
+		return states, status
 
-			floatlist=[]
-			for i in textlist[1:-2]:
-				floatlist.append([float(x) for x in i])
-			df = pd.DataFrame(floatlist, columns=textlist[0])
-			df['model_name'] = str(m)
-			results = pd.concat([results,df])
 
-		param2 = pd.DataFrame()
-		for model in self.model_list:
-			columns = model.__dict__.keys()
-			param = pd.DataFrame(columns=columns)
-			for k in columns:
-				param.at[0,k] = model.__dict__[k]
-				param[k] = pd.to_numeric(param[k],errors='ignore')
-			param2 = pd.concat([param2,param])
 
-		final = results.merge(param2,how='outer', left_on='model_name', right_on='lumprem_model_name')
-		return final
 
 
+		
+
+
+def read_silo(filename, columns=None):
+	"""Reads a SILO climate data file.
+	The two header lines give the column names and units; dates are in yyyymmdd format and missing values are NULL.
+
+	Parameters
+	----------
+	filename : str
+		SILO file to read.
+	columns : list of str, optional
+		columns to read, e.g. ['Rain', 'Evap'] (default None, all columns). Matching is case insensitive.
+
+	Returns
+	-------
+	df : DataFrame
+		one row per day, indexed by date. NULL values are NaN.
+	"""
+	with open(filename) as f:
+		header = f.readline().split()
+	lookup = {h.lower():h for h in header}
 
+	usecols = None
+	if columns != None:
+		usecols = [header[0]]+[lookup[c.lower()] for c in columns]
+	df = pd.read_csv(filename, sep=r'\s+', skiprows=2, header=None, names=header, usecols=usecols,
+					 na_values='NULL', engine='c', dtype={header[0]:str})
+	df.index = pd.to_datetime(df.pop(header[0]), format='%Y%m%d')
+	df.index.name = 'date'
+	return df
 
 
-		
\ No newline at end of file
+def write_climate(silofile, start_date, end_date, evap='evap', rainfile='rain.dat', epotfile='epot.dat', workspace=False, nodata=0.0, print_output=True):
+	"""Writes LUMPREM rain and evaporation files from a SILO file, in the same format as LUMPREP.
+	Day 1 is start_date and the last day is end_date. Values are converted from mm to m.
+
+	Parameters
+	----------
+	silofile : str
+		SILO file to read.
+	start_date : str
+		first day of the simulation in 'dd/mm/yyyy' format.
+	end_date : str
+		last day of the simulation in 'dd/mm/yyyy' format.
+	evap : str, optional
+		SILO column used for evaporation, e.g. 'evap' (default) or 'fao56'.
+	rainfile : str, optional
+		name of the rain file to write (default 'rain.dat').
+	epotfile : str, optional
+		name of the evaporation file to write (default 'epot.dat').
+	workspace : path
+		Path to workspace folder. Default is current working directory.
+	nodata : float, optional
+		value used for NULL and missing days, in mm (default 0.0).
+	print_output : bool, optional
+		True (default), the names of the files written are printed.
+	"""
+	if workspace==False:
+		workspace = os.getcwd()
+	start = pd.to_datetime(start_date, format='%d/%m/%Y')
+	end = pd.to_datetime(end_date, format='%d/%m/%Y')
+
+	df = read_silo(silofile, columns=['rain', evap])
+	dates = pd.date_range(start, end, freq='D')
+	df = df.reindex(dates).fillna(nodata)
+
+	for filename, column in [(rainfile, df.columns[0]), (epotfile, df.columns[1])]:
+		# single precision, as LUMPREP
+		values = df[column].values.astype(np.float32)/np.float32(1000.0)
+		filename = os.path.join(workspace, filename)
+		write_daily(filename, values)
+		if print_output==True:
+			print('LUMPREM climate file written to: \n'+filename)
+
+
+def write_daily(filename, values):
+	"""Writes a LUMPREM daily data file (day number and value per line), in the same format as LUMPREP.
+
+	Parameters
+	----------
+	filename : str
+		file to write.
+	values : array-like
+		one value per day, starting on day 1.
+	"""
+	values = np.asarray(values, dtype=np.float64)
+	with open(filename, 'w') as f:
+		f.write(''.join("{0:>11d}   ".format(d)+lr2series.format_g(v)+'\n' for d, v in enumerate(values.tolist(), 1)))
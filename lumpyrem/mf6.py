@@ -0,0 +1,417 @@
+"""Array-based MODFLOW 6 inputs from LUMPREM outputs.
+
+A ZoneMap assigns each cell of a MODFLOW 6 grid to a LUMPREM model (zone). LUMPREM outputs of all models are read once
+into small (period, model) tables, and each stress period is broadcast to the grid with a single indexing step and
+written to its own array file, so only one grid array is held in memory at a time however long the run.
+Each LUMPREM output interval becomes one stress period.
+"""
+import os
+import numpy as np
+from lumpyrem import lumprem
+from lumpyrem import lr2series
+from lumpyrem import profiling
+
+
+class ZoneMap():
+    """
+    Assignment of MODFLOW 6 cells to LUMPREM models.
+
+    Attributes
+    ----------
+    model_names : list of str
+        LUMPREM model names, in the order of the columns of value tables.
+    shape : tuple
+        shape of the grid arrays, e.g. (nrow, ncol) for DIS or (ncpl,) for DISV.
+    index : numpy array
+        flat index of the model of each cell in model_names; cells without a model point to the fill value.
+    fill : float
+        value of cells without a model.
+    """
+
+    def __init__(self, zones, model_names, fill=0.0):
+        """Parameters
+        ----------
+        zones : array
+            model of each cell, with the shape of the grid arrays. Either model names, or indices into model_names
+            with negative values for cells without a model.
+        model_names : list of str or list of Model
+            LUMPREM model names (or Model objects).
+        fill : float, optional
+            value of cells without a model (default 0.0).
+        """
+        self.model_names = [m if type(m) == str else m.lumprem_model_name for m in model_names]
+        zones = np.asarray(zones)
+        self.shape = zones.shape
+        self.fill = fill
+        nmodel = len(self.model_names)
+
+        if zones.dtype.kind in 'iu':
+            index = zones.ravel().astype(np.int64)
+            if index.max(initial=-1) >= nmodel:
+                raise ValueError('Zone index larger than the number of models: '+str(index.max()))
+        else:
+            lookup = {n:i for i, n in enumerate(self.model_names)}
+            names, inverse = np.unique(zones, return_inverse=True)
+            index = np.array([lookup.get(str(n), -1) for n in names], dtype=np.int64)[inverse.ravel()]
+        # cells without a model take the extra value appended to each row of values
+        self.index = np.where(index < 0, nmodel, index)
+
+    def to_grid(self, values, out=None):
+        """Broadcasts one value per model to the grid.
+
+        Parameters
+        ----------
+        values : array-like
+            one value per model, in the order of model_names.
+        out : numpy array, optional
+            array with the grid shape to write into, reused between periods (default None, a new array).
+
+        Returns
+        -------
+        grid : numpy array
+            values of the cells, with the grid shape.
+        """
+        values = np.append(np.asarray(values, dtype=np.float64), self.fill)
+        if out is None:
+            out = np.empty(self.shape)
+        np.take(values, self.index, out=out.reshape(-1))
+        return out
+
+
+def read_columns(models, columns, workspace=None, store=None):
+    """Reads LUMPREM output columns of many models into arrays.
+
+    Parameters
+    ----------
+    models : list
+        lumprem Model objects.
+    columns : list of str
+        LUMPREM output columns, e.g. ['total_rech', 'gw_pot_evap'].
+    workspace : path, optional
+        folder holding the .out files (default None, each model's own workspace).
+    store : resultstore.ResultStore, optional
+        if provided, columns are sliced from the store instead of read from the .out files.
+
+    Returns
+    -------
+    days : numpy array
+        output days.
+    values : dict
+        column name to an array of shape (ndays, nmodels).
+    """
+    if store != None:
+        return store.get_columns([m.lumprem_model_name for m in models], columns)
+    days = None
+    blocks = {c:[] for c in columns}
+    for m in models:
+        path = m.workspace if workspace == None else workspace
+        filename = os.path.join(path, 'lr_'+m.lumprem_model_name+'.out')
+        df = lumprem.read_out(filename, columns=columns)
+        if days is None:
+            days = df['days'].values
+        elif not np.array_equal(days, df['days'].values):
+            raise ValueError('All LUMPREM models must have the same output days: '+filename)
+        for c in columns:
+            blocks[c].append(df[c].values)
+    return days, {c:np.column_stack(blocks[c]) for c in columns}
+
+
+def period_values(days, values, div_delta_t=True, scale=1.0, offset=0.0):
+    """Converts LUMPREM outputs to one value per stress period. Each output interval is a stress period:
+    period k runs from output day k-1 to output day k.
+
+    Parameters
+    ----------
+    days : numpy array
+        output days, as returned by read_columns.
+    values : numpy array
+        outputs, shape (ndays, nmodels).
+    div_delta_t : bool, optional
+        True (default), values are divided by the period length, to turn volumes (e.g. total_rech) into rates.
+        False for states such as elevation, which take the value at the end of the period.
+    scale : float, optional
+        factor applied to the values (default 1.0).
+    offset : float, optional
+        added to the values after scaling (default 0.0).
+
+    Returns
+    -------
+    perlen : numpy array
+        length of each stress period in days.
+    values : numpy array
+        value of each model in each stress period, shape (nperiods, nmodels).
+    """
+    perlen = np.diff(np.asarray(days, dtype=np.float64))
+    values = np.asarray(values, dtype=np.float64)[1:]
+    if div_delta_t == True:
+        values = values/perlen[:, None]
+    return perlen, values*scale+offset
+
+
+def write_array(filename, array, fmt='%.7G', ncolumns=10):
+    """Writes an array file readable with OPEN/CLOSE by MODFLOW 6. Two-dimensional arrays are written one row per line,
+    others ncolumns values per line."""
+    if array.ndim != 2:
+        flat = array.ravel()
+        full = len(flat)//ncolumns*ncolumns
+        with open(filename, 'w') as f:
+            np.savetxt(f, flat[:full].reshape(-1, ncolumns), fmt=fmt)
+            if full < len(flat):
+                np.savetxt(f, flat[full:][None, :], fmt=fmt)
+        return
+    np.savetxt(filename, array, fmt=fmt)
+
+
+def write_arrays(zonemap, values, prefix, workspace=False, fmt='%.7G'):
+    """Writes one grid array file per stress period, holding a single grid array in memory.
+
+    Parameters
+    ----------
+    zonemap : ZoneMap
+        cells to models.
+    values : numpy array
+        value of each model in each stress period, shape (nperiods, nmodels), see period_values.
+    prefix : str
+        start of the file names; files are named prefix_0001.dat, prefix_0002.dat, ...
+    workspace : path
+        Path to workspace folder. Default is current working directory.
+    fmt : str, optional
+        number format (default '%.7G').
+
+    Returns
+    -------
+    files : list of str
+        names of the files written, relative to workspace.
+    """
+    if workspace==False:
+        workspace = os.getcwd()
+    if not os.path.exists(workspace):
+        os.makedirs(workspace)
+    grid = np.empty(zonemap.shape)
+    files = []
+    with profiling.stage('write_arrays', prefix) as stage:
+        for k in range(len(values)):
+            name = prefix+'_{0:04d}.dat'.format(k+1)
+            write_array(os.path.join(workspace, name), zonemap.to_grid(values[k], out=grid), fmt=fmt)
+            stage.wrote(os.path.join(workspace, name))
+            files.append(name)
+    return files
+
+
+def write_column_arrays(zonemap, models, column, prefix, div_delta_t=True, scale=1.0, offset=0.0, workspace=False, fmt='%.7G'):
+    """Writes one grid array file per stress period of a LUMPREM output column, e.g. total_rech for recharge,
+    gw_pot_evap for residual ET or elevation for boundary heads.
+
+    Parameters
+    ----------
+    zonemap : ZoneMap
+        cells to models.
+    models : list
+        lumprem Model objects, in the order of zonemap.model_names.
+    column : str
+        LUMPREM output column.
+    prefix : str
+        start of the file names, see write_arrays.
+    div_delta_t : bool, optional
+        True (default), volumes are divided by the period length. Use False for elevation.
+    scale : float, optional
+        factor applied to the values (default 1.0).
+    offset : float, optional
+        added to the values after scaling (default 0.0).
+    workspace : path
+        Path to workspace folder. Default is current working directory.
+    fmt : str, optional
+        number format (default '%.7G').
+
+    Returns
+    -------
+    perlen : numpy array
+        length of each stress period in days.
+    files : list of str
+        names of the files written, relative to workspace.
+    """
+    days, values = read_columns(models, [column])
+    perlen, values = period_values(days, values[column], div_delta_t=div_delta_t, scale=scale, offset=offset)
+    return perlen, write_arrays(zonemap, values, prefix, workspace=workspace, fmt=fmt)
+
+
+def write_period_blocks(f, files, variables):
+    """Writes the PERIOD blocks of an array-based package. files holds one list of file names per variable, or a
+    control record used in every period such as 'CONSTANT 1.0'. The number of periods is taken from the first list."""
+    nper = [len(names) for names in files if type(names) != str][0]
+    for k in range(nper):
+        f.write('BEGIN PERIOD '+str(k+1)+'\n')
+        for var, names in zip(variables, files):
+            f.write('  '+var+'\n')
+            if type(names) == str:
+                f.write('    '+names+'\n')
+            else:
+                f.write('    OPEN/CLOSE '+names[k]+'\n')
+        f.write('END PERIOD\n\n')
+
+
+def write_rcha(filename, zonemap, models, column='total_rech', scale=1.0, workspace=False, prefix='rch', fmt='%.7G'):
+    """Writes a MODFLOW 6 recharge package with READASARRAYS and one recharge array file per stress period.
+
+    Parameters
+    ----------
+    filename : str
+        name of the package file, e.g. 'gwf.rcha'.
+    zonemap : ZoneMap
+        cells to models.
+    models : list
+        lumprem Model objects, in the order of zonemap.model_names.
+    column : str, optional
+        LUMPREM output column holding recharge volumes (default 'total_rech'). Divided by the period length.
+    scale : float, optional
+        factor applied to the rates, e.g. for unit conversion (default 1.0).
+    workspace : path
+        Path to workspace folder. Default is current working directory.
+    prefix : str, optional
+        start of the array file names (default 'rch').
+    fmt : str, optional
+        number format of the array files (default '%.7G').
+
+    Returns
+    -------
+    perlen : numpy array
+        length of each stress period in days, for the TDIS package.
+    """
+    if workspace==False:
+        workspace = os.getcwd()
+    perlen, files = write_column_arrays(zonemap, models, column, prefix, scale=scale, workspace=workspace, fmt=fmt)
+
+    filename = os.path.join(workspace, filename)
+    with open(filename, 'w') as f:
+        f.write('# File created using lumpyrem.\n')
+        f.write('BEGIN OPTIONS\n  READASARRAYS\nEND OPTIONS\n\n')
+        write_period_blocks(f, [files], ['RECHARGE'])
+    print('MF6 recharge package written to: \n'+filename)
+    return perlen
+
+
+def evt_values(models, surface_column='elevation', rate_column='gw_pot_evap', scale=1.0, surface_offset=0.0, workspace=None):
+    """Computes EVT surfaces and rates of many models from LUMPREM outputs. Both columns are read in one pass over the
+    output files, and each is converted for all models and stress periods at once.
+
+    Parameters
+    ----------
+    models : list
+        lumprem Model objects.
+    surface_column : str, optional
+        LUMPREM output column used as the ET surface (default 'elevation'), taken at the end of each period.
+    rate_column : str, optional
+        LUMPREM output column holding residual ET volumes (default 'gw_pot_evap'). Divided by the period length.
+    scale : float, optional
+        factor applied to the rates, e.g. for unit conversion (default 1.0).
+    surface_offset : float, optional
+        added to the surfaces, e.g. to move them from the LUMPREM datum to the model datum (default 0.0).
+    workspace : path, optional
+        folder holding the .out files (default None, each model's own workspace).
+
+    Returns
+    -------
+    perlen : numpy array
+        length of each stress period in days.
+    surface : numpy array
+        ET surface of each model in each stress period, shape (nperiods, nmodels).
+    rate : numpy array
+        maximum ET rate of each model in each stress period, shape (nperiods, nmodels).
+    """
+    days, values = read_columns(models, [surface_column, rate_column], workspace=workspace)
+    perlen, surface = period_values(days, values[surface_column], div_delta_t=False, offset=surface_offset)
+    perlen, rate = period_values(days, values[rate_column], div_delta_t=True, scale=scale)
+    return perlen, surface, rate
+
+
+def write_evta(filename, zonemap, models, depth, surface_column='elevation', rate_column='gw_pot_evap', scale=1.0,
+               surface_offset=0.0, workspace=False, prefix='evt', fmt='%.7G'):
+    """Writes a MODFLOW 6 evapotranspiration package with READASARRAYS, with one surface and one rate array file per
+    stress period. LUMPREM's residual ET (gw_pot_evap) is the ET demand left after soil moisture, so it is passed to
+    MODFLOW as the maximum rate.
+
+    Parameters
+    ----------
+    filename : str
+        name of the package file, e.g. 'gwf.evta'.
+    zonemap : ZoneMap
+        cells to models.
+    models : list
+        lumprem Model objects, in the order of zonemap.model_names.
+    depth : float or array
+        extinction depth, constant or one value per cell with the grid shape. Arrays are written once to
+        prefix_depth.dat and used in every period.
+    surface_column : str, optional
+        LUMPREM output column used as the ET surface (default 'elevation').
+    rate_column : str, optional
+        LUMPREM output column holding residual ET volumes (default 'gw_pot_evap').
+    scale : float, optional
+        factor applied to the rates, e.g. for unit conversion (default 1.0).
+    surface_offset : float, optional
+        added to the surfaces (default 0.0).
+    workspace : path
+        Path to workspace folder. Default is current working directory.
+    prefix : str, optional
+        start of the array file names (default 'evt'); surfaces are written to prefix_surf_0001.dat, ... and rates to
+        prefix_rate_0001.dat, ...
+    fmt : str, optional
+        number format of the array files (default '%.7G').
+
+    Returns
+    -------
+    perlen : numpy array
+        length of each stress period in days, for the TDIS package.
+    """
+    if workspace==False:
+        workspace = os.getcwd()
+    perlen, surface, rate = evt_values(models, surface_column, rate_column, scale=scale, surface_offset=surface_offset)
+    surface_files = write_arrays(zonemap, surface, prefix+'_surf', workspace=workspace, fmt=fmt)
+    rate_files = write_arrays(zonemap, rate, prefix+'_rate', workspace=workspace, fmt=fmt)
+
+    if np.ndim(depth) == 0:
+        depth_record = 'CONSTANT '+str(fmt % depth).strip()
+    else:
+        depth = np.asarray(depth, dtype=np.float64)
+        if depth.shape != zonemap.shape:
+            raise ValueError('Extinction depth must be a constant or have the grid shape '+str(zonemap.shape))
+        write_array(os.path.join(workspace, prefix+'_depth.dat'), depth, fmt=fmt)
+        depth_record = 'OPEN/CLOSE '+prefix+'_depth.dat'
+
+    filename = os.path.join(workspace, filename)
+    with open(filename, 'w') as f:
+        f.write('# File created using lumpyrem.\n')
+        f.write('BEGIN OPTIONS\n  READASARRAYS\nEND OPTIONS\n\n')
+        write_period_blocks(f, [surface_files, rate_files, depth_record], ['SURFACE', 'RATE', 'DEPTH'])
+    print('MF6 evapotranspiration package written to: \n'+filename)
+    return perlen
+
+
+def evt_timeseries(ts_file, models, surface_column='elevation', rate_column='gw_pot_evap', scale=1.0, workspace=False,
+                   timeaxis=None):
+    """Returns a TimeSeries with the EVT surface (evts_<model>) and rate (evtr_<model>) of each model, for list-based
+    EVT packages. Write it with write_ts(backend='python') to process all models at once without LR2SERIES.
+
+    Parameters
+    ----------
+    ts_file : str
+        name of the MODFLOW 6 timeseries file.
+    models : list
+        lumprem Model objects.
+    surface_column : str, optional
+        LUMPREM output column used as the ET surface (default 'elevation').
+    rate_column : str, optional
+        LUMPREM output column holding residual ET volumes (default 'gw_pot_evap'). Divided by the period length.
+    scale : float, optional
+        factor applied to the rates (default 1.0).
+    workspace : path
+        Path to workspace folder. Default is current working directory.
+    timeaxis : timeaxis.TimeAxis, optional
+        simulation calendar of the LUMPREM models.
+
+    Returns
+    -------
+    ts : lr2series.TimeSeries
+    """
+    return lr2series.TimeSeries(ts_file, models, ['evts', 'evtr'], [surface_column, rate_column], ['linear', 'linearend'],
+                                div_delta_t=['no_div_delta_t', 'div_delta_t'], workspace=workspace, scales=[1.0, scale],
+                                timeaxis=timeaxis)
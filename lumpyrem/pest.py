@@ -1,82 +1,396 @@
 from lumpyrem import lumprem, run
 import os
+import re
+import numpy as np
 import pandas as pd
 
+# LUMPREM parameters in lumpyrem/data/lumprem_par_data.csv, by Model attribute
+PAR_KEYS = {'maxvol':['maxvol'], 'irrigvolfrac':['irigvf'], 'rdelay':['rdelay'], 'mdelay':['mdelay'],
+            'ks':['ks'], 'M':['m'], 'L':['l'], 'mflowmax':['mfmax'], 'offset':['offset'],
+            'factor1':['f1'], 'factor2':['f2'], 'power':['power'], 'elevmin':['elevmin'], 'elevmax':['elevmax'],
+            'vegfile':['crfac', 'gamma'], 'irrigfile':['gwirfr']}
+
+PAR_COLUMNS = ['parnme','partrans','parchglim','parval1','parlbnd','parubnd','pargp','scale','offset','dercom']
+GRP_COLUMNS = ['pargpnme','inctyp','derinc','derinclb','forcen','derincmul','dermthd']
+OBS_COLUMNS = ['obsnme','obsval','weight','obgnme']
+
+
+def read_par_data():
+    """Reads the default LUMPREM parameter and parameter group data shipped with lumpyrem.
+
+    Returns
+    -------
+    par_data : DataFrame
+        parameter defaults, indexed by parameter key (e.g. 'maxvol', 'crfac').
+    grp_data : DataFrame
+        parameter group data, indexed by group name.
+    """
+    path = os.path.join(os.path.dirname(__file__), 'data')
+    par_data = pd.read_csv(os.path.join(path, 'lumprem_par_data.csv'), index_col='parnme')
+    par_data = par_data.rename(columns={'parchlim':'parchglim'})
+    grp_data = pd.read_csv(os.path.join(path, 'lumprem_par_grp.csv'), index_col='pagrnme')
+    grp_data.index.name = 'pargpnme'
+    return par_data, grp_data
+
+
+def parameter_data(models, params='all'):
+    """Builds the PEST parameter data table for a list of LUMPREM models.
+    Bounds, transforms and groups come from lumpyrem/data/lumprem_par_data.csv; initial values from the models.
+    Parameter names match the markers in the template files written by Model.write_model and lumprem.write_models.
+
+    Parameters
+    ----------
+    models : list
+        list of lumprem Model objects
+    params : list of str or 'all', optional
+        Model attributes to include, e.g. ['maxvol', 'ks', 'vegfile']. 'all' (default) includes the soil, delay,
+        elevation and power parameters, plus vegfile and irrigfile for models where these are tuples.
+
+    Returns
+    -------
+    par : DataFrame
+        one row per parameter with the PEST parameter data columns, indexed by parnme.
+    """
+    par_data, grp_data = read_par_data()
+    if params == 'all':
+        params = ['maxvol','irrigvolfrac','rdelay','mdelay','ks','M','L','mflowmax','offset','factor1','factor2','power','vegfile','irrigfile']
+
+    blocks = []
+    for p in params:
+        if p not in PAR_KEYS:
+            raise ValueError('No PEST parameter data for Model attribute '+str(p))
+        values = [m.__dict__[p] for m in models]
+        # file-based vegfile and irrigfile are not parameters
+        if p == 'vegfile':
+            keep = [type(v) == tuple for v in values]
+            cols = [[v[0] for v in values], [v[1] for v in values]]
+        elif p == 'irrigfile':
+            keep = [type(v) == tuple for v in values]
+            cols = [[v[1] if type(v) == tuple else 0.0 for v in values]]
+        else:
+            keep = len(values)*[True]
+            cols = [values]
+        names = [lumprem.par_names(p, m.lumprem_model_name) for m in models]
+        for i, key in enumerate(PAR_KEYS[p]):
+            block = pd.DataFrame({'parnme':[n[i] for n in names], 'key':key, 'parval1':cols[i]})
+            blocks.append(block[keep])
+
+    par = pd.concat(blocks, ignore_index=True)
+    # PEST names are case insensitive; models whose names share the first 6 characters give the same names
+    duplicated = par['parnme'].str.lower().duplicated(keep=False)
+    if duplicated.any():
+        raise ValueError('Duplicate PEST parameter names: '+', '.join(pd.unique(par.loc[duplicated, 'parnme'])))
+    par['parval1'] = pd.to_numeric(par['parval1'])
+    defaults = par_data.drop(columns='parval1').loc[par['key']].reset_index(drop=True)
+    par = pd.concat([par[['parnme','parval1']], defaults], axis=1)
+    # log transformed parameters must be positive
+    par.loc[(par['partrans']=='log') & (par['parval1']<=0), 'partrans'] = 'fixed'
+    # PEST requires parlbnd <= parval1 <= parubnd, also for fixed parameters (e.g. gwirfr 0.0 without irrigation)
+    fixed = par['partrans']=='fixed'
+    par.loc[fixed, 'parlbnd'] = np.minimum(par.loc[fixed, 'parlbnd'], par.loc[fixed, 'parval1'])
+    par.loc[fixed, 'parubnd'] = np.maximum(par.loc[fixed, 'parubnd'], par.loc[fixed, 'parval1'])
+    return par[PAR_COLUMNS].set_index('parnme', drop=False)
+
+
+def group_data(par):
+    """Returns the PEST parameter group table for the groups used in a parameter data table.
+
+    Parameters
+    ----------
+    par : DataFrame
+        parameter data, as returned by parameter_data.
+
+    Returns
+    -------
+    grp : DataFrame
+        one row per parameter group with the PEST parameter group columns.
+    """
+    par_data, grp_data = read_par_data()
+    groups = pd.unique(par['pargp'])
+    grp = grp_data.loc[groups].reset_index()
+    return grp[GRP_COLUMNS]
+
+
+def format_table(df):
+    """Formats a table as whitespace separated lines, one string per row."""
+    cols = [np.array(df[c].astype(str).tolist(), dtype=str) for c in df.columns]
+    width = [max(10, c.dtype.itemsize//4) for c in cols]
+    cols = [np.char.ljust(c, w) for c, w in zip(cols, width)]
+    return [' '.join(r).rstrip()+'\n' for r in zip(*cols)]
+
+
 class Pst():
     """ A Pest setup class. Facilities generating PEST control, template and instruction files from an ennsemble of LUMPREM models.
+
+    Attributes
+    ----------
+    controlfile : str
+        name of the PEST control file.
+    models : list
+        list of lumprem Model objects.
+    params : list of str or 'all'
+        Model attributes to parameterise, see parameter_data.
+    parameter_data : DataFrame
+        PEST parameter data table.
+    parameter_groups : DataFrame
+        PEST parameter group table.
+    observations : Observations
+        observations written to the control file, or None.
     """
-    def __init__(self, controlfile='temp.pst', models=None):
+    def __init__(self, controlfile='temp.pst', models=None, params='all', observations=None):
         self.controlfile = controlfile
         self.models = models
+        self.params = params
+        self.observations = observations
+        if models != None:
+            self.parameter_data = parameter_data(models, params)
+            self.parameter_groups = group_data(self.parameter_data)
+        else:
+            self.parameter_data = pd.DataFrame(columns=PAR_COLUMNS)
+            self.parameter_groups = pd.DataFrame(columns=GRP_COLUMNS)
+
+    def write_pst(self, controlfile=None, command='run.bat'):
+        """Writes the PEST control file. Each section is formatted as a whole table and written in one call.
 
+        Parameters
+        ----------
+        controlfile : str, optional
+            name of the control file (default the controlfile attribute).
+        command : str, optional
+            model command line (default 'run.bat').
+        """
+        if controlfile == None:
+            controlfile = self.controlfile
+        par = self.parameter_data
+        grp = self.parameter_groups
+        names = [m.lumprem_model_name for m in self.models]
+        if self.observations != None:
+            obs = self.observations.observation_data
+        else:
+            obs = pd.DataFrame(columns=OBS_COLUMNS)
+        obsgrp = pd.unique(obs['obgnme'])
+        ninsfle = 0 if self.observations == None else 1
 
-def write_pst(controlfile, models, params='all'):
-    # get number of parameters
-    param_grp = 12
-    num_param = 12*len(models)
-    for m in models:
-        if type(m.irrigfile) == tuple:
-            num_param += 1
-            if param_grp < 13:
-                param_grp += 1
-        if type(m.vegfile) == tuple:
-            num_param += 2
-            if param_grp < 14:
-                param_grp += 2
-
-    with open(controlfile, 'w+') as f:
-        f.write('pcf $\n')
-        f.write("* control data\n")
-        f.write("restart estimation\n")
-        f.write("{0}\t{1}\t{2}\t{3}\t{4}{5}".format(num_param, 0, param_grp,0,0,'\n'))
-        f.write("{0}\t{1}{2}".format(len(models), "0  single  point  1   0   0",'\n'))
-        f.write("10.0  -3.0  0.3  0.03  10  999\n")
-        f.write("10.0   10.0    0.001\n")
-        f.write("0.1   boundscale\n")
-        f.write("50  0.005  4  4  0.005  4\n")
-        f.write("1  1  1\n")
-        f.write("* singular value decomposition\n")
-        f.write("1\n")
-        f.write("10000  5.0e-7\n")
-        f.write("0\n")
-        f.write("* parameter groups\n")
-        f.write("maxvol     relative  0.015   0.00005    switch   2.0  parabolic\n")
-        f.write("irigvf     relative  0.015   0.0001     switch   2.0  parabolic\n")
-        f.write("rdelay     relative  0.015   0.0001     switch   2.0  parabolic\n")
-        f.write("mdelay     relative  0.015   0.0001     switch   2.0  parabolic\n")
-        f.write("ks         relative  0.015   0.0        switch   2.0  parabolic\n")
-        f.write("m          relative  0.015   0.0        switch   2.0  parabolic\n")
-        f.write("l          relative  0.015   0.0        switch   2.0  parabolic\n")
-        f.write("mfmax      relative  0.015   0.0001     switch   2.0  parabolic\n")
-        f.write("offset     absolute  0.1     0.0        switch   2.0  parabolic\n")
-        f.write("f1         relative  0.015   0.0        switch   2.0  parabolic\n")
-        f.write("f2         relative  0.015   0.0        switch   2.0  parabolic\n")
-        f.write("power      absolute  0.015   0.0        switch   2.0  parabolic\n")
-        if param_grp >= 13:
-            f.write("gwirfr     relative  0.015   0.0001     switch   2.0  parabolic\n")
-        if param_grp >= 14:
-            f.write("crfac      relative  0.015   0.0001     switch   2.0  parabolic\n")
-            f.write("gamma      relative  0.015   0.0        switch   2.0  parabolic\n")
-        f.write("* parameter data\n")
-        for m in models:
-            name = m.lumprem_model_name
-            f.write("{0:<10}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}{10}".format("maxvol_"+name, 'log', 'factor', m.maxvol ,0.001,10.0,'maxvol',1.0,0.0,1,'\n'))
-            f.write("{0:<10}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}{10}".format("irigvf_"+name, 'log', 'factor', m.irrigvolfrac ,0.001,1.0,'irigvf',1.0,0.0,1,'\n'))
-            f.write("{0:<10}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}{10}".format("rdelay_"+name, 'log', 'factor', m.rdelay ,0.001,50.0,'rdelay',1.0,0.0,1,'\n'))
-            f.write("{0:<10}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}{10}".format("mdelay_"+name, 'log', 'factor', m.mdelay ,0.001,10.0,'mdelay',1.0,0.0,1,'\n'))
-            f.write("{0:<10}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}{10}".format("ks_"+name, 'log', 'factor', m.mdelay ,1e-5,100.0,'ks',1.0,0.0,1,'\n'))
-            f.write("{0:<10}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}{10}".format("m_"+name, 'log', 'factor', m.M ,1e-2,10.0,'m',1.0,0.0,1,'\n'))
-            f.write("{0:<10}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}{10}".format("l_"+name, 'log', 'factor', m.L ,0.1,1.0,'l',1.0,0.0,1,'\n'))
-            f.write("{0:<10}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}{10}".format("mfmax_"+name, 'log', 'factor', m.mflowmax ,0.1,1.0,'mfmax',1.0,0.0,1,'\n'))
-            f.write("{0:<10}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}{10}".format("offset_"+name, 'none', 'relative', m.offset ,-1000.0,10000.0,'offset',1.0,0.0,1,'\n'))
-            f.write("{0:<10}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}{10}".format("f1_"+name, 'log', 'factor', m.mflowmax ,1e-5,1e4,'fac1',1.0,0.0,1,'\n'))
-            f.write("{0:<10}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}{10}".format("f2_"+name, 'log', 'factor', m.mflowmax ,1e-5,1e4,'fac2',1.0,0.0,1,'\n'))
-            f.write("{0:<10}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}{10}".format("power_"+name, 'none', 'relative', m.power ,-3.0,3.0,'power',1.0,0.0,1,'\n'))
-            if param_grp >= 13:
-                f.write("{0:<10}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}{10}".format("gwirfr_"+name, 'log', 'factor', m.irrigvolfrac ,0.001,1.0,'gwirfr',1.0,0.0,1,'\n'))
-            if param_grp >= 14:
-                f.write("{0:<10}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}{10}".format("crfac_"+name, 'log', 'factor', m.vegfile[0] ,0.001,3.0,'crfac',1.0,0.0,1,'\n'))
-                f.write("{0:<10}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}{10}".format("gamma_"+name, 'log', 'factor', m.vegfile[1] ,0.001,100.0,'gamma',1.0,0.0,1,'\n'))
-        f.write("* model input/output\n")
-        for m in models:
-            f.write("lr_"+m.lumprem_model_name+".tpl  lr_"+m.lumprem_model_name+".in\n")
\ No newline at end of file
+        with open(controlfile, 'w+') as f:
+            f.write('pcf $\n')
+            f.write("* control data\n")
+            f.write("restart estimation\n")
+            f.write("{0}\t{1}\t{2}\t{3}\t{4}{5}".format(len(par), len(obs), len(grp),0,len(obsgrp),'\n'))
+            f.write("{0}\t{1}\t{2}{3}".format(len(names), ninsfle, "single  point  1   0   0",'\n'))
+            f.write("10.0  -3.0  0.3  0.03  10  999\n")
+            f.write("10.0   10.0    0.001\n")
+            f.write("0.1   boundscale\n")
+            f.write("50  0.005  4  4  0.005  4\n")
+            f.write("1  1  1\n")
+            f.write("* singular value decomposition\n")
+            f.write("1\n")
+            f.write("10000  5.0e-7\n")
+            f.write("0\n")
+            f.write("* parameter groups\n")
+            f.write(''.join(format_table(grp)))
+            f.write("* parameter data\n")
+            f.write(''.join(format_table(par[PAR_COLUMNS])))
+            if len(obs) > 0:
+                f.write("* observation groups\n")
+                f.write(''.join(g+'\n' for g in obsgrp))
+                f.write("* observation data\n")
+                f.write(''.join(format_table(obs[OBS_COLUMNS])))
+            f.write("* model command line\n")
+            f.write(command+'\n')
+            f.write("* model input/output\n")
+            f.write(''.join("lr_"+n+".tpl  lr_"+n+".in\n" for n in names))
+            if self.observations != None:
+                f.write(self.observations.insfile+'  '+self.observations.obsfile+'\n')
+        print('PEST control file written to: \n'+controlfile)
+
+
+class Observations():
+    """
+    Reduces LUMPREM outputs to the observed dates, so PEST reads only the simulated equivalents of the observations.
+    Observation dates are converted to model days once. Each call to extract interpolates the output column to those days
+    and writes one observation file, read by PEST through the instruction file written by write_ins.
+
+    Attributes
+    ----------
+    observation_data : DataFrame
+        one row per observation with obsnme, obsval, weight, obgnme, model_name and day, grouped by model.
+    column : str
+        LUMPREM output column compared with the observations.
+    obsfile : str
+        name of the observation file written by extract.
+    insfile : str
+        name of the PEST instruction file.
+    workspace : path
+        folder holding the LUMPREM output files and the observation files.
+    """
+
+    def __init__(self, obs, start_date, sites=None, column='elevation', obsfile='lr_obs.dat', insfile=None,
+                 end_date=None, weight=1.0, workspace=False):
+        """Parameters
+        ----------
+        obs : DataFrame or str
+            observations, or the name of a csv file with them. The first column holds dates (dd/mm/yyyy, optionally with a time),
+            the other columns hold one site each. Empty cells are ignored. See examples/lmprem_pyemu/head_obs.csv.
+        start_date : str or timeaxis.TimeAxis
+            date on which the LUMPREM simulation starts (day 0), in 'dd/mm/yyyy' format, or the simulation calendar.
+            With a calendar, end_date defaults to its end date.
+        sites : dict, optional
+            observation column to LUMPREM model name. Default None uses the column names as model names.
+            Columns not in sites are ignored.
+        column : str, optional
+            LUMPREM output column to compare with the observations (default 'elevation').
+        obsfile : str, optional
+            name of the observation file written on each forward run (default 'lr_obs.dat').
+        insfile : str, optional
+            name of the instruction file (default obsfile with the extension .ins).
+        end_date : str, optional
+            date on which the simulation ends, in 'dd/mm/yyyy' format. Later observations are dropped.
+        weight : float, optional
+            observation weight (default 1.0).
+        workspace : path
+            Path to workspace folder. Default is current working directory.
+        """
+        if workspace==False:
+            self.workspace = os.getcwd()
+        else:
+            self.workspace = workspace
+        if type(obs) == str:
+            obs = pd.read_csv(os.path.join(self.workspace, obs))
+        if sites == None:
+            sites = {c:c for c in obs.columns[1:]}
+        if insfile == None:
+            insfile = os.path.splitext(obsfile)[0]+'.ins'
+        self.column = column
+        self.obsfile = obsfile
+        self.insfile = insfile
+
+        if type(start_date) != str:
+            if end_date == None:
+                end_date = start_date.end_date
+            start_date = start_date.start_date
+        start = pd.to_datetime(start_date, format='%d/%m/%Y')
+        dates = pd.to_datetime(obs.iloc[:, 0], dayfirst=True)
+        data = obs[list(sites.keys())].copy()
+        data['day'] = ((dates-start)/pd.Timedelta(days=1)).values
+        data = data.melt(id_vars='day', var_name='site', value_name='obsval').dropna(subset=['obsval'])
+        data = data[data['day'] >= 0]
+        if end_date != None:
+            data = data[data['day'] <= (pd.to_datetime(end_date, format='%d/%m/%Y')-start)/pd.Timedelta(days=1)]
+
+        data['model_name'] = data['site'].map(sites)
+        data['obgnme'] = data['site'].map(lambda x: re.sub(r'[^0-9a-zA-Z]+', '_', str(x)).lower())
+        stamp = (start+pd.to_timedelta(data['day'], unit='D')).dt.strftime('%Y%m%d')
+        data['obsnme'] = data['obgnme']+'_'+stamp
+        data['weight'] = weight
+        data = data.sort_values(['model_name', 'day'], kind='stable').reset_index(drop=True)
+        # several readings on one day are numbered to keep names unique
+        dup = data.groupby('obsnme').cumcount()
+        data.loc[dup > 0, 'obsnme'] = data['obsnme']+'_'+dup.astype(str)
+
+        self.observation_data = data[OBS_COLUMNS+['model_name', 'day']].set_index('obsnme', drop=False)
+        self.slices = {}
+        for name, rows in data.groupby('model_name', sort=False).indices.items():
+            self.slices[name] = (rows[0], rows[-1]+1)
+        self.index = {}
+
+    def get_index(self, model_name, days):
+        """Returns the interpolation index of a model's observations in its output days.
+        The index is computed on first use and reused while the output days do not change.
+
+        Parameters
+        ----------
+        model_name : str
+            LUMPREM model name.
+        days : numpy array
+            output days of the model, as read from its .out file.
+
+        Returns
+        -------
+        i0 : numpy array
+            row of the last output at or before each observation.
+        w : numpy array
+            interpolation weight of the following output row.
+        """
+        cached = self.index.get(model_name)
+        if cached != None and np.array_equal(cached[0], days):
+            return cached[1], cached[2]
+
+        start, stop = self.slices[model_name]
+        obsdays = self.observation_data['day'].values[start:stop]
+        days = np.asarray(days, dtype=np.float64)
+        if len(days) < 2:
+            i0 = np.zeros(len(obsdays), dtype=int)
+            w = np.zeros(len(obsdays))
+        else:
+            i0 = np.clip(np.searchsorted(days, obsdays, side='right')-1, 0, len(days)-2)
+            w = np.clip((obsdays-days[i0])/(days[i0+1]-days[i0]), 0.0, 1.0)
+        self.index[model_name] = (days.copy(), i0, w)
+        return i0, w
+
+    def extract(self, write=True, store=None):
+        """Interpolates the LUMPREM outputs of each model to its observation days and writes the observation file.
+        Observations before the first or after the last output day take the nearest output value.
+
+        Parameters
+        ----------
+        write : bool, optional
+            True (default), the observation file is written.
+        store : resultstore.ResultStore, optional
+            if provided, outputs are read from the store instead of the .out files, one column of all models at once.
+
+        Returns
+        -------
+        sim : Series
+            simulated equivalent of each observation, indexed by obsnme.
+        """
+        sim = np.empty(len(self.observation_data))
+        if store != None:
+            block = store.get(list(self.slices), [self.column])[:, :, 0]
+        for k, (name, (start, stop)) in enumerate(self.slices.items()):
+            if store != None:
+                days, values = store.days, block[k]
+            else:
+                df = lumprem.read_out(os.path.join(self.workspace, 'lr_'+name+'.out'), columns=[self.column])
+                days, values = df['days'].values, df[self.column].values
+            i0, w = self.get_index(name, days)
+            i1 = np.minimum(i0+1, len(values)-1)
+            sim[start:stop] = (1.0-w)*values[i0]+w*values[i1]
+
+        names = self.observation_data['obsnme'].values
+        if write==True:
+            with open(os.path.join(self.workspace, self.obsfile), 'w') as f:
+                f.write(''.join("{0:<24} {1: .10E}\n".format(n, v) for n, v in zip(names, sim.tolist())))
+        return pd.Series(sim, index=names)
+
+    def write_ins(self):
+        """Writes the PEST instruction file that reads the observation file written by extract.
+        """
+        insfile = os.path.join(self.workspace, self.insfile)
+        with open(insfile, 'w') as f:
+            f.write('pif ~\n')
+            f.write(''.join('l1 w !'+n+'!\n' for n in self.observation_data['obsnme']))
+        print('PEST instruction file written to: \n'+insfile)
+
+
+def write_pst(controlfile, models, params='all', observations=None):
+    """Writes a PEST control file for a list of LUMPREM models.
+
+    Parameters
+    ----------
+    controlfile : str
+        name of the control file to write.
+    models : list
+        list of lumprem Model objects
+    params : list of str or 'all', optional
+        Model attributes to parameterise (default 'all'), see parameter_data.
+    observations : Observations, optional
+        observations to include in the control file (default None).
+
+    Returns
+    -------
+    pst : Pst
+        the Pst object used to write the file.
+    """
+    pst = Pst(controlfile=controlfile, models=models, params=params, observations=observations)
+    pst.write_pst()
+    return pst
@@ -0,0 +1,175 @@
+"""Optional timing instrumentation of the lumpyrem run pipeline.
+
+Writing inputs, running LUMPREM and LUMPREP, reading outputs, merging parameters and writing timeseries are recorded
+as events in the active Profiler: the stage, the model or file, wall time, bytes read and written and the number of
+processes started. No profiler is active by default, and the hooks then return immediately.
+
+    with profiling.Profiler() as prof:
+        model.write_model()
+        model.run_model()
+        model.get_results()
+    print(prof.summary())
+"""
+import os
+import time
+import threading
+
+ACTIVE = None
+
+
+class NullStage():
+    """Stage returned when no profiler is active. Does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def read(self, filename):
+        pass
+
+    def wrote(self, filename):
+        pass
+
+    def spawned(self, count=1):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+class Stage():
+    """A timed stage of the pipeline, recorded in a Profiler when it exits.
+
+    Attributes
+    ----------
+    event : dict
+        the event recorded, see Profiler.record.
+    """
+
+    def __init__(self, profiler, stage, name):
+        self.profiler = profiler
+        self.event = {'stage':stage, 'name':name, 'start':0.0, 'wall_time':0.0, 'bytes_read':0, 'bytes_written':0,
+                      'processes':0, 'thread':threading.get_ident(), 'error':''}
+
+    def __enter__(self):
+        self.event['start'] = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.event['wall_time'] = time.perf_counter()-self.event['start']
+        self.event['start'] -= self.profiler.t0
+        if exc_type != None:
+            self.event['error'] = exc_type.__name__
+        self.profiler.record(self.event)
+        return False
+
+    def read(self, filename):
+        """Adds the size of a file read in the stage."""
+        if os.path.exists(filename):
+            self.event['bytes_read'] += os.path.getsize(filename)
+
+    def wrote(self, filename):
+        """Adds the size of a file written in the stage."""
+        if os.path.exists(filename):
+            self.event['bytes_written'] += os.path.getsize(filename)
+
+    def spawned(self, count=1):
+        """Adds processes started in the stage."""
+        self.event['processes'] += count
+
+
+class Profiler():
+    """
+    Collects the events of instrumented lumpyrem functions while it is active. Use as a context manager, or call
+    start and stop. Events from all threads are collected, so concurrent runs are recorded as well.
+
+    Attributes
+    ----------
+    events : list of dict
+        recorded events, in the order in which the stages finished.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+        self.previous = None
+        self.t0 = time.perf_counter()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def start(self):
+        """Makes this profiler the active one."""
+        global ACTIVE
+        self.previous = ACTIVE
+        ACTIVE = self
+
+    def stop(self):
+        """Restores the profiler that was active before start."""
+        global ACTIVE
+        ACTIVE = self.previous
+
+    def record(self, event):
+        """Adds an event.
+
+        Parameters
+        ----------
+        event : dict
+            with keys 'stage', 'name', 'start' (seconds since the profiler was created), 'wall_time', 'bytes_read',
+            'bytes_written', 'processes', 'thread' and 'error'.
+        """
+        with self.lock:
+            self.events.append(event)
+
+    def clear(self):
+        """Removes all events."""
+        with self.lock:
+            self.events = []
+
+    def event_log(self):
+        """Returns the recorded events as a DataFrame, one row per event."""
+        import pandas as pd
+        columns = ['stage', 'name', 'start', 'wall_time', 'bytes_read', 'bytes_written', 'processes', 'thread', 'error']
+        return pd.DataFrame(list(self.events), columns=columns)
+
+    def summary(self, by='stage'):
+        """Returns the events aggregated per stage (or per name).
+        Stages can be nested, e.g. run_process events fall within run_model, so wall times of different stages overlap.
+
+        Parameters
+        ----------
+        by : str or list of str, optional
+            column(s) of the event log to group by (default 'stage'). 'name' gives a table per model or file.
+
+        Returns
+        -------
+        summary : DataFrame
+            count, total, mean and max wall time, bytes read and written and processes started.
+        """
+        log = self.event_log()
+        return log.groupby(by, sort=False).agg(count=('wall_time', 'size'), wall_time=('wall_time', 'sum'),
+                                              mean_time=('wall_time', 'mean'), max_time=('wall_time', 'max'),
+                                              bytes_read=('bytes_read', 'sum'), bytes_written=('bytes_written', 'sum'),
+                                              processes=('processes', 'sum'))
+
+
+def stage(name, label=None):
+    """Returns a context manager that times a stage in the active profiler, or a no-op stage if none is active.
+
+    Parameters
+    ----------
+    name : str
+        name of the stage, e.g. 'write_model'.
+    label : str, optional
+        model name or file the stage works on.
+    """
+    if ACTIVE is None:
+        return NULL_STAGE
+    return Stage(ACTIVE, name, label)
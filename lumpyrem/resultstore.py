@@ -0,0 +1,266 @@
+"""Chunked on-disk store of LUMPREM outputs.
+
+Outputs of many models are consolidated into memory-mapped .npy chunks of shape (model, day, column), with the
+model names, output days and column names in results.json. Models are appended one at a time as their runs finish,
+so the lr_*.out text files can be removed, and readers slice the models, days and columns they need without
+loading the whole store.
+
+    store = ResultStore.create('lr_results')
+    store.add_models(models, remove=True)
+    rech = store.get(['abc', 'def'], columns=['total_rech'])   # (model, day, column)
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+from lumpyrem import lumprem
+
+
+class ResultStore():
+    """
+    A folder holding the outputs of many LUMPREM models as memory-mapped arrays.
+
+    Attributes
+    ----------
+    path : path
+        folder of the store.
+    models : list of str
+        model names, in the order in which they were added.
+    days : numpy array
+        output days, the same for all models.
+    columns : list of str
+        LUMPREM output columns held (days excluded).
+    chunksize : int
+        number of models per chunk file.
+    dtype : str
+        'float64' or 'float32'.
+    """
+
+    def __init__(self, path, mode='r'):
+        """Opens an existing store. Chunks are not read until they are used.
+
+        Parameters
+        ----------
+        path : path
+            folder of the store, as created with ResultStore.create.
+        mode : str, optional
+            'r' (default) read only, 'r+' read and append.
+        """
+        self.path = path
+        self.mode = mode
+        with open(os.path.join(path, 'results.json')) as f:
+            meta = json.load(f)
+        self.models = meta['models']
+        self.days = None if meta['days'] == None else np.asarray(meta['days'], dtype=int)
+        self.columns = meta['columns']
+        self.chunksize = meta['chunksize']
+        self.dtype = meta['dtype']
+        self.index = {n:i for i, n in enumerate(self.models)}
+        self.chunks = {}
+
+    def __getstate__(self):
+        # memory-mapped chunks are reopened after unpickling
+        state = dict(self.__dict__)
+        state['chunks'] = {}
+        return state
+
+    @classmethod
+    def create(cls, path, days=None, columns=None, chunksize=256, dtype='float64'):
+        """Creates an empty store and returns it opened for appending.
+
+        Parameters
+        ----------
+        path : path
+            folder of the store. Created if it does not exist; an existing store in it is replaced.
+        days : array-like, optional
+            output days (default None, those of the first model added).
+        columns : list of str, optional
+            LUMPREM output columns to hold (default None, those of the first model added).
+        chunksize : int, optional
+            number of models per chunk file (default 256).
+        dtype : str, optional
+            'float64' (default) or 'float32' to halve the size of the store.
+
+        Returns
+        -------
+        store : ResultStore
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        for f in os.listdir(path):
+            if f.startswith('chunk_') and f.endswith('.npy'):
+                os.remove(os.path.join(path, f))
+        if days is not None:
+            days = [int(d) for d in days]
+        if columns != None:
+            columns = [c for c in columns if c != 'days']
+        write_meta(path, {'models':[], 'days':days, 'columns':columns, 'chunksize':int(chunksize), 'dtype':dtype})
+        return cls(path, mode='r+')
+
+    def chunk(self, k):
+        """Returns the memory-mapped array of chunk k, opening (or in 'r+' mode creating) it on first use."""
+        if k not in self.chunks:
+            filename = os.path.join(self.path, 'chunk_{0:05d}.npy'.format(k))
+            if os.path.exists(filename):
+                self.chunks[k] = np.load(filename, mmap_mode=self.mode)
+            else:
+                self.chunks[k] = np.lib.format.open_memmap(filename, mode='w+', dtype=self.dtype,
+                                                           shape=(self.chunksize, len(self.days), len(self.columns)))
+        return self.chunks[k]
+
+    def append(self, name, values):
+        """Adds the outputs of a model, or replaces them if the model is already held. The store must be open in 'r+'
+        mode. The model is listed in results.json on the next flush.
+
+        Parameters
+        ----------
+        name : str
+            LUMPREM model name.
+        values : DataFrame
+            LUMPREM outputs as returned by lumprem.read_out, with a days column.
+        """
+        if self.days is None:
+            self.days = values['days'].values.astype(int)
+        elif not np.array_equal(self.days, values['days'].values):
+            raise ValueError('All models in a ResultStore must have the same output days: '+str(name))
+        if self.columns == None:
+            self.columns = [c for c in values.columns if c != 'days']
+
+        if name not in self.index:
+            self.index[name] = len(self.models)
+            self.models.append(name)
+        k, row = divmod(self.index[name], self.chunksize)
+        self.chunk(k)[row] = values[self.columns].values
+
+    def add_out(self, filename, name=None, remove=False):
+        """Adds a LUMPREM output file.
+
+        Parameters
+        ----------
+        filename : str
+            .out file to read.
+        name : str, optional
+            model name (default taken from the file name lr_<name>.out).
+        remove : bool, optional
+            True, the .out file is deleted once it is in the store (default False).
+        """
+        if name == None:
+            name = os.path.splitext(os.path.basename(filename))[0]
+            if name.startswith('lr_'):
+                name = name[3:]
+        self.append(name, lumprem.read_out(filename, columns=self.columns))
+        if remove == True:
+            os.remove(filename)
+
+    def add_models(self, model_list, workspace=None, remove=False):
+        """Adds the output files of a list of Model objects and writes the index.
+
+        Parameters
+        ----------
+        model_list : list
+            lumprem Model objects.
+        workspace : path, optional
+            folder holding the .out files (default None, each model's own workspace).
+        remove : bool, optional
+            True, the .out files are deleted once they are in the store (default False).
+        """
+        for m in model_list:
+            path = m.workspace if workspace == None else workspace
+            self.add_out(os.path.join(path, 'lr_'+m.lumprem_model_name+'.out'), name=m.lumprem_model_name, remove=remove)
+        self.flush()
+
+    def flush(self):
+        """Writes changes of the chunks to disk and updates results.json, so new readers see the models added."""
+        for a in self.chunks.values():
+            if hasattr(a, 'flush'):
+                a.flush()
+        days = None if self.days is None else [int(d) for d in self.days]
+        write_meta(self.path, {'models':self.models, 'days':days, 'columns':self.columns, 'chunksize':self.chunksize,
+                               'dtype':self.dtype})
+
+    def window(self, start_day=None, end_day=None):
+        """Returns the slice of the output days from start_day to end_day, both included (None, first or last day)."""
+        first = 0 if start_day == None else int(np.searchsorted(self.days, start_day, side='left'))
+        last = len(self.days) if end_day == None else int(np.searchsorted(self.days, end_day, side='right'))
+        return slice(first, last)
+
+    def get(self, names=None, columns=None, start_day=None, end_day=None):
+        """Reads the outputs of some models, columns and days. Only the chunks of the models asked for are read.
+
+        Parameters
+        ----------
+        names : list of str, optional
+            model names (default None, all models).
+        columns : list of str, optional
+            LUMPREM output columns (default None, all columns).
+        start_day : int, optional
+            first output day (default first day held).
+        end_day : int, optional
+            last output day (default last day held).
+
+        Returns
+        -------
+        values : numpy array
+            shape (nmodels, ndays, ncolumns).
+        """
+        if names == None:
+            names = self.models
+        if columns == None:
+            columns = self.columns
+        missing = [n for n in names if n not in self.index]
+        if len(missing) > 0:
+            raise KeyError('Models not in the ResultStore: '+', '.join(missing))
+        cols = [self.columns.index(c) for c in columns]
+        days = self.window(start_day, end_day)
+
+        slots = np.array([self.index[n] for n in names], dtype=np.int64)
+        out = np.empty((len(names), days.stop-days.start, len(cols)), dtype=self.dtype)
+        for k in np.unique(slots//self.chunksize):
+            select = np.flatnonzero(slots//self.chunksize == k)
+            out[select] = self.chunk(k)[slots[select] % self.chunksize, days][:, :, cols]
+        return out
+
+    def get_columns(self, names, columns):
+        """Reads columns of many models, as mf6.read_columns does from .out files.
+
+        Returns
+        -------
+        days : numpy array
+            output days.
+        values : dict
+            column name to an array of shape (ndays, nmodels).
+        """
+        values = self.get(names, columns)
+        return self.days.copy(), {c:values[:, :, i].T for i, c in enumerate(columns)}
+
+    def read_out(self, name, columns=None, float32=False, timeaxis=None):
+        """Returns the outputs of a model as a DataFrame, as lumprem.read_out does from its .out file.
+
+        Parameters
+        ----------
+        name : str
+            model name.
+        columns : list of str, optional
+            output columns (default None, all columns). The days column is always included.
+        float32 : bool, optional
+            True, results are returned as float32 (default False, float64).
+        timeaxis : timeaxis.TimeAxis, optional
+            simulation calendar. If provided, the frame is indexed by the date of each output day.
+        """
+        if columns == None:
+            columns = self.columns
+        columns = [c for c in columns if c != 'days']
+        dtype = np.float32 if float32==True else np.float64
+        df = pd.DataFrame(self.get([name], columns)[0].astype(dtype), columns=columns)
+        df.insert(0, 'days', self.days)
+        if timeaxis != None:
+            df.index = timeaxis.to_dates(df['days'].values)
+        return df
+
+
+def write_meta(path, meta):
+    """Writes results.json through a temporary file, so readers never see a partly written index."""
+    filename = os.path.join(path, 'results.json')
+    with open(filename+'.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(filename+'.tmp', filename)
@@ -1,9 +1,14 @@
 import os
 import subprocess
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from lumpyrem import profiling
 
-def run_process(process, path=False, commands=[], print_output=True):
+def run_process(process, path=False, commands=[], print_output=True, log_file=None, timeout=None, check=False):
         """This calls a process and then executes a list of commands.
-        
+        The process is started in path without changing the working directory of python, so it is safe to call from several threads at once.
+
         Parameters
         ----------
         process : str
@@ -13,29 +18,205 @@ def run_process(process, path=False, commands=[], print_output=True):
         commands : list of str
             sequence of commands to pass to the process.
         print_output : bool, optional
-                True, process output is printed. False, it is not.
+                True, process output is printed. False, it is not. Ignored if log_file is given.
+        log_file : str, optional
+            file to which the process output is streamed instead of being held in memory. Relative paths are relative to path (default None).
+        timeout : float, optional
+            seconds after which the process is killed and subprocess.TimeoutExpired is raised (default None, no limit).
+        check : bool, optional
+            True, subprocess.CalledProcessError is raised if the process returns a non-zero exit code (default False).
+
+        Returns
+        -------
+        returncode : int
+            exit code of the process.
             """
 
         if path == False:
             path = os.getcwd()
-        
-        owd = os.getcwd()
-        os.chdir(path)
 
-        p = subprocess.run([process], stdout=subprocess.PIPE,
-                input='\n'.join(map(str, commands))+'\n', encoding='ascii')
+        stdin = '\n'.join(map(str, commands))+'\n'
+        with profiling.stage('run_process', process+' '+str(commands[0]) if len(commands) > 0 else process) as stage:
+            stage.spawned()
+            if log_file != None:
+                log_file = os.path.join(path, log_file)
+                with open(log_file, 'w') as log:
+                    p = subprocess.run([process], stdout=log, stderr=subprocess.STDOUT, cwd=path,
+                            input=stdin, encoding='ascii', errors='replace', timeout=timeout)
+            else:
+                p = subprocess.run([process], stdout=subprocess.PIPE, cwd=path,
+                        input=stdin, encoding='ascii', errors='replace', timeout=timeout)
+                if print_output==True:
+                        print(p.stdout)
+
+        if check==True and p.returncode != 0:
+            raise subprocess.CalledProcessError(p.returncode, process)
+        return p.returncode
+
+
+def new_status(name):
+        """Returns an empty job record, as returned by run_job and run_job_async."""
+        return {'model_name':name, 'returncode':None, 'wall_time':0.0, 'success':False, 'error':'', 'log_file':None}
+
+
+def run_job(process, path=False, commands=[], name=None, log_file=None, timeout=None):
+        """Runs a single process in its own working directory and records its exit status and wall time.
+        Errors are recorded rather than raised, so one failed job does not affect others running alongside it.
+
+        Parameters
+        ----------
+        process : str
+            The name of the process to execute.
+        path : str, optional
+            path in which to execute commands. False (default) results in commands being executed in current working directory.
+        commands : list of str
+            sequence of commands to pass to the process.
+        name : str, optional
+            label used for the job in the returned record (default is the process name).
+        log_file : str, optional
+            file to which the process output is streamed. Relative paths are relative to path.
+            Default None writes to name+'.log' in path.
+        timeout : float, optional
+            seconds after which the process is killed and the job is recorded as failed (default None, no limit).
 
-        if print_output==True:
-                print(p.stdout)
-        os.chdir(owd)
+        Returns
+        -------
+        status : dict
+            dictionary with keys 'model_name', 'returncode', 'wall_time', 'success', 'error' and 'log_file'.
+        """
 
+        if path == False:
+            path = os.getcwd()
+        if name == None:
+            name = process
+        if log_file == None:
+            log_file = str(name)+'.log'
 
+        status = new_status(name)
+        status['log_file'] = os.path.join(path, log_file)
+        t0 = time.perf_counter()
+        try:
+            status['returncode'] = run_process(process, path=path, commands=commands, log_file=log_file, timeout=timeout)
+            status['success'] = status['returncode'] == 0
+            if status['returncode'] != 0:
+                status['error'] = process+' exited with return code '+str(status['returncode'])
+        except subprocess.TimeoutExpired:
+            status['error'] = process+' timed out after '+str(timeout)+' s'
+        except Exception as e:
+            status['error'] = str(e)
+        status['wall_time'] = time.perf_counter()-t0
+        return status
 
 
+def job_table(records):
+        """Returns the job records from run_jobs or run_jobs_async as a DataFrame."""
+        import pandas as pd
+        status = pd.DataFrame(records, columns=list(new_status(None).keys()))
+        status['returncode'] = status['returncode'].astype('Int64')
+        return status
 
 
+def run_jobs(jobs, workers=1, timeout=None, print_output=False):
+        """Runs a list of jobs concurrently using concurrent.futures. Each job is a separate process, so a pool of threads is used to launch and wait on them.
+        A job that fails does not stop the others.
 
+        Parameters
+        ----------
+        jobs : list of dict
+            each dict holds the keyword arguments for run_job ('process', 'path', 'commands', 'name', 'log_file', 'timeout').
+        workers : int, optional
+            maximum number of processes running at the same time (default 1). None uses the number of CPUs.
+        timeout : float, optional
+            per-job timeout in seconds, used for jobs that do not set their own (default None, no limit).
+        print_output : bool, optional
+            True, failed jobs are reported as they finish (default False).
+
+        Returns
+        -------
+        status : DataFrame
+            one row per job with model_name, returncode, wall_time, success, error and log_file columns, in the order of jobs.
+        """
+
+        if workers == None:
+            workers = os.cpu_count()
+        workers = max(1, int(workers))
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_job, **dict({'timeout':timeout}, **job)) for job in jobs]
+            records = []
+            for f in futures:
+                r = f.result()
+                if print_output==True and r['success']==False:
+                    print(str(r['model_name'])+' failed: '+r['error'])
+                records.append(r)
+
+        return job_table(records)
+
+
+async def run_job_async(process, path=False, commands=[], name=None, log_file=None, timeout=None):
+        """Coroutine version of run_job. Takes the same arguments and returns the same record.
+        """
+
+        if path == False:
+            path = os.getcwd()
+        if name == None:
+            name = process
+        if log_file == None:
+            log_file = str(name)+'.log'
+
+        status = new_status(name)
+        status['log_file'] = os.path.join(path, log_file)
+        stdin = ('\n'.join(map(str, commands))+'\n').encode('ascii')
+        t0 = time.perf_counter()
+        try:
+            with profiling.stage('run_process', process+' '+str(commands[0]) if len(commands) > 0 else process) as stage, \
+                 open(status['log_file'], 'w') as log:
+                stage.spawned()
+                p = await asyncio.create_subprocess_exec(process, cwd=path, stdin=asyncio.subprocess.PIPE,
+                        stdout=log, stderr=asyncio.subprocess.STDOUT)
+                try:
+                    await asyncio.wait_for(p.communicate(stdin), timeout)
+                except asyncio.TimeoutError:
+                    p.kill()
+                    await p.wait()
+                    raise
+            status['returncode'] = p.returncode
+            status['success'] = p.returncode == 0
+            if p.returncode != 0:
+                status['error'] = process+' exited with return code '+str(p.returncode)
+        except asyncio.TimeoutError:
+            status['error'] = process+' timed out after '+str(timeout)+' s'
+        except Exception as e:
+            status['error'] = str(e)
+        status['wall_time'] = time.perf_counter()-t0
+        return status
+
+
+async def run_jobs_async(jobs, workers=1, timeout=None):
+        """Coroutine version of run_jobs. At most workers processes run at the same time.
+
+        Parameters
+        ----------
+        jobs : list of dict
+            each dict holds the keyword arguments for run_job_async ('process', 'path', 'commands', 'name', 'log_file', 'timeout').
+        workers : int, optional
+            maximum number of processes running at the same time (default 1). None uses the number of CPUs.
+        timeout : float, optional
+            per-job timeout in seconds, used for jobs that do not set their own (default None, no limit).
 
+        Returns
+        -------
+        status : DataFrame
+            one row per job with model_name, returncode, wall_time, success, error and log_file columns, in the order of jobs.
+        """
 
+        if workers == None:
+            workers = os.cpu_count()
+        limit = asyncio.Semaphore(max(1, int(workers)))
 
+        async def limited(job):
+            async with limit:
+                return await run_job_async(**dict({'timeout':timeout}, **job))
 
+        records = await asyncio.gather(*[limited(job) for job in jobs])
+        return job_table(records)
@@ -0,0 +1,128 @@
+"""Simulation calendar shared by the writers and readers of LUMPREM models.
+
+LUMPREM counts time in days from the start of the simulation (day 0). A TimeAxis holds the simulation length
+and output days for a start date, end date and output frequency, and converts day numbers to dates.
+It is computed once, with numpy datetime64 arithmetic, and can be passed to Model.write_model, lumprem.write_models,
+lumprep.Simulation, lr2series.TimeSeries and the results readers.
+"""
+import datetime as dt
+import functools
+import numpy as np
+import pandas as pd
+
+
+class TimeAxis():
+    """
+    Simulation length, output days and dates of a LUMPREM run.
+
+    Attributes
+    ----------
+    start_date : str
+        date on which the simulation starts (day 0), in 'dd/mm/yyyy' format.
+    end_date : str
+        date on which the simulation ends (day numdays), in 'dd/mm/yyyy' format.
+    numdays : int
+        number of days of the model run.
+    noutdays : int
+        number of output days.
+    outdays : numpy array of int
+        days on which LUMPREM records outputs.
+    freq : int or str
+        output frequency the axis was built from: a number of output days, 'monthly', 'annual' or None.
+    """
+
+    def __init__(self, start_date, end_date=None, numdays=100, noutdays=None, outdays=[]):
+        """Parameters
+        ----------
+        start_date : str
+            date on which the simulation starts in 'dd/mm/yyyy' format.
+        end_date : str, optional
+            date on which the simulation ends in 'dd/mm/yyyy' format. If provided, numdays is calculated from it.
+        numdays : int, optional
+            number of days of the model run (default 100). Ignored if end_date is provided.
+        noutdays : int or str, optional
+            number of output days, 'monthly' or 'annual' (default None, results in all days being recorded).
+            Monthly and annual outputs are recorded on the first day of each month or year.
+        outdays : list, optional
+            days on which outputs are to be recorded. Used if noutdays is not 'monthly' or 'annual'.
+        """
+        start = np.datetime64(dt.datetime.strptime(start_date, '%d/%m/%Y'), 'D')
+        if end_date == None:
+            end = start+int(numdays)
+        else:
+            end = np.datetime64(dt.datetime.strptime(end_date, '%d/%m/%Y'), 'D')
+        self.start = start
+        self.end = end
+        self.start_date = pd.Timestamp(start).strftime('%d/%m/%Y')
+        self.end_date = pd.Timestamp(end).strftime('%d/%m/%Y')
+        self.numdays = int((end-start).astype(int))
+        self.freq = noutdays
+
+        if noutdays in ('monthly', 'annual'):
+            unit = 'M' if noutdays == 'monthly' else 'Y'
+            # first day of each month (year) after the start, up to and including the end
+            first = np.arange(start.astype('datetime64['+unit+']')+1, end.astype('datetime64['+unit+']')+1)
+            outdays = (first.astype('datetime64[D]')-start).astype(int)
+        elif len(outdays) == 0:
+            if noutdays == None:
+                noutdays = self.numdays
+            outdays = np.linspace(0, self.numdays, noutdays+1, dtype=int)[1:]
+        self.outdays = np.asarray(outdays, dtype=int)
+        self.noutdays = len(self.outdays)
+        self.dates_ = None
+
+    def __repr__(self):
+        return 'TimeAxis('+self.start_date+' - '+self.end_date+', '+str(self.noutdays)+' output days)'
+
+    @property
+    def dates(self):
+        """DatetimeIndex of the output days, named 'date'. Computed on first use."""
+        if self.dates_ is None:
+            self.dates_ = self.to_dates(self.outdays)
+        return self.dates_
+
+    def to_dates(self, days):
+        """Converts day numbers (int or float) counted from the start date to a DatetimeIndex named 'date'.
+
+        Parameters
+        ----------
+        days : array-like
+            day numbers, e.g. the days column of a LUMPREM output file.
+
+        Returns
+        -------
+        dates : DatetimeIndex
+        """
+        days = np.asarray(days)
+        if days.dtype.kind in 'iu':
+            dates = self.start+days.astype('timedelta64[D]')
+        else:
+            dates = self.start.astype('datetime64[ns]')+np.round(days*86400e9).astype('timedelta64[ns]')
+        return pd.DatetimeIndex(dates.astype('datetime64[ns]'), name='date')
+
+    def to_days(self, dates):
+        """Converts dates to day numbers counted from the start date, as floats.
+
+        Parameters
+        ----------
+        dates : array-like
+            dates, or strings in 'dd/mm/yyyy' format.
+
+        Returns
+        -------
+        days : numpy array
+        """
+        dates = pd.to_datetime(dates, dayfirst=True)
+        return np.asarray((dates-pd.Timestamp(self.start))/pd.Timedelta(days=1), dtype=np.float64)
+
+    def timing(self):
+        """Returns the timing arguments of Model.write_model (numdays, noutdays, outdays and start_date) as a dict."""
+        return {'numdays':self.numdays, 'noutdays':self.noutdays, 'outdays':self.outdays, 'start_date':self.start_date}
+
+
+@functools.lru_cache(maxsize=32)
+def get_timeaxis(start_date, end_date=None, numdays=100, noutdays=None):
+    """Returns the TimeAxis of a start date, end date and output frequency. Axes are cached, so repeated calls
+    with the same arguments return the same object. See TimeAxis for the arguments.
+    """
+    return TimeAxis(start_date, end_date=end_date, numdays=numdays, noutdays=noutdays)
@@ -0,0 +1,399 @@
+"""Warm-start and incremental extension of LUMPREM runs.
+
+The state of a model at the end of a run (soil moisture volume, second bucket volume and the recharge and macropore
+delay buffers) is recovered from its output file. A continuation run starts from that state and only simulates the
+new days; its outputs are appended to the existing output file, so a daily update costs O(new days):
+
+    model.extend(numdays=1)
+
+Daily data and schedule files (rain, evaporation, vegetation, irrigation) are read from the model's workspace with
+their original day numbering, and must cover the new days.
+
+spinup repeats a short window from its own end state until the state stops changing, which replaces a long warm-up
+period in front of the production run:
+
+    states, status = warmstart.spinup(models, numdays=365, workers=8)
+    lumprem.write_models(models, timeaxis=axis, states=states)
+"""
+import os
+import re
+import copy
+import glob
+import shutil
+import numpy as np
+from lumpyrem import lumprem
+from lumpyrem import profiling
+
+
+def end_state(filename, rdelay=5, mdelay=1):
+    """Returns the state at the last output day of a LUMPREM or LUMPREM2 output file.
+
+    Delay buffers are rebuilt from the volume that entered each buffer on the last days (del_vol_drain plus the
+    recharge that left it). They are exact when the last floor(delay)+1 days are output daily; over longer output
+    intervals the volume is spread evenly over the days of the interval.
+
+    Parameters
+    ----------
+    filename : str
+        LUMPREM output file.
+    rdelay : float, optional
+        recharge delay of the model in days (default 5).
+    mdelay : float, optional
+        macropore recharge delay of the model in days (default 1).
+
+    Returns
+    -------
+    state : dict
+        'day' (last output day), 'vol', 'vol_br' (None for LUMPREM), 'rbuf' and 'mbuf' (first element entered the
+        buffer on the last day), as taken by Model.write_model.
+    """
+    df = lumprem.read_out(filename)
+    days = df['days'].values
+    if 'vol_lower' in df.columns:
+        vol, vol_br = df['vol_upper'].values[-1], float(df['vol_lower'].values[-1])
+        recharge, macro = 'drain_upper', 'macro_upper'
+    else:
+        vol, vol_br = df['volume'].values[-1], None
+        recharge, macro = 'recharge', 'macro_rech'
+    drained = df['del_vol_drain'].values+df[recharge].values
+    macro_in = df['del_vol_macro'].values+df[macro].values
+    return {'day':int(days[-1]), 'vol':float(vol), 'vol_br':vol_br,
+            'rbuf':daily_inflow(days, drained, rdelay), 'mbuf':daily_inflow(days, macro_in, mdelay)}
+
+
+def daily_inflow(days, volumes, delay):
+    """Returns the volume entering a delay buffer on each of the last floor(delay)+1 days, last day first.
+    volumes holds the inflow of each output interval, ending on days."""
+    days = np.asarray(days)
+    back = days[-1]-np.arange(int(np.floor(delay))+1)
+    rows = np.searchsorted(days, back, side='left')
+    valid = (back >= 1) & (rows >= 1)
+    rows = np.maximum(rows, 1)
+    daily = np.where(valid, volumes[rows]/(days[rows]-days[rows-1]), 0.0)
+    # rounded to the precision of the output file
+    return [float('{0:.7G}'.format(x)) for x in daily]
+
+
+def shift_daily(filename, newfile, offset):
+    """Writes a LUMPREM daily data file starting after day offset, renumbered so that day offset+1 is day 1."""
+    with open(filename) as f:
+        lines = [line.split(None, 1) for line in f if line.strip() != '']
+    with open(newfile, 'w') as f:
+        f.write(''.join("{0:>11d}   ".format(int(d)-offset)+v.rstrip('\n')+'\n' for d, v in lines if int(d) > offset))
+
+
+def shift_schedule(filename, newfile, offset):
+    """Writes a LUMPREM schedule file (vegetation or irrigation) renumbered so that day offset+1 is day 1.
+    The entry in force on day offset+1 becomes the entry of day 1."""
+    with open(filename) as f:
+        lines = [line.split() for line in f if line.strip() != '']
+    days = np.array([int(line[0]) for line in lines])
+    first = max(int(np.searchsorted(days, offset+1, side='right'))-1, 0)
+    with open(newfile, 'w') as f:
+        for line in lines[first:]:
+            day = max(int(line[0])-offset, 1)
+            f.write(' '.join([str(day)]+line[1:])+'\n')
+
+
+def continuation(model, state, workspace):
+    """Returns a copy of a Model that starts from state, with its data files shifted into workspace.
+    model is not modified.
+
+    Parameters
+    ----------
+    model : Model
+        lumprem Model object of the existing run.
+    state : dict
+        state returned by end_state.
+    workspace : path
+        folder of the continuation run, created if needed. Must differ from the model's workspace.
+
+    Returns
+    -------
+    model : Model
+        continuation model. Pass the state to its write_model.
+    """
+    if os.path.abspath(workspace) == os.path.abspath(model.workspace):
+        raise ValueError('The continuation workspace must differ from the workspace of the model.')
+    if not os.path.exists(workspace):
+        os.makedirs(workspace)
+    new = copy.copy(model)
+    new.workspace = workspace
+    new.vol = state['vol']
+    if state['vol_br'] != None:
+        new.vol_br = state['vol_br']
+    for attr, shift in [('rainfile', shift_daily), ('epotfile', shift_daily), ('epotfile_br', shift_daily),
+                        ('vegfile', shift_schedule), ('irrigfile', shift_schedule)]:
+        name = getattr(model, attr)
+        if type(name) == str:
+            shift(os.path.join(model.workspace, name), os.path.join(workspace, os.path.basename(name)), state['day'])
+            setattr(new, attr, os.path.basename(name))
+    return new
+
+
+def splice_out(filename, newfile, offset):
+    """Appends the outputs of a continuation run to an existing output file, in place. Only the totals line at the
+    end of the existing file is rewritten, so the cost depends on the new outputs only.
+
+    Parameters
+    ----------
+    filename : str
+        existing LUMPREM output file.
+    newfile : str
+        output file of the continuation run; its day 0 row (the state it started from) is skipped.
+    offset : int
+        last day of the existing file; added to the days of the new outputs.
+
+    Returns
+    -------
+    rows : int
+        number of output rows appended.
+    """
+    new = lumprem.read_out(newfile)
+    new = new[new['days'] > 0]
+    columns = list(new.columns)
+    first = columns.index('rainfall')
+    last = columns.index('balance')
+
+    with open(filename, 'rb+') as f:
+        # the totals footer follows the last blank line of the file
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(size-16384, 0))
+        tail = f.read().decode()
+        blank = [m for m in re.finditer(r'\n[ \t]*\r?\n', tail)]
+        totals = np.zeros(last-first+1)
+        end = size
+        if len(blank) > 0:
+            footer = tail[blank[-1].end():].split()
+            if len(footer) > 0 and footer[0] == 'total':
+                totals = np.array([float(x) for x in footer[1:]])
+            end = size-len(tail.encode())+len(tail[:blank[-1].start()+1].encode())
+        f.seek(end)
+        f.truncate()
+
+        text = []
+        for row in new.itertuples(index=False):
+            text.append("{0:>6d}".format(int(row[0])+offset)+''.join("{0:>15.7G}".format(x) for x in row[1:])+'\n')
+        totals = totals+new[columns[first:last+1]].sum().values
+        text.append(' \n')
+        text.append(' total'+15*(first-1)*' '+''.join("{0:>15.7G}".format(x) for x in totals)+'\n')
+        f.write(''.join(text).encode())
+    return len(new)
+
+
+def remove_run(model, workspace):
+    """Removes the files of a continuation or spin-up run. A default folder (workspace None) is removed entirely once
+    it is empty of runs, including the data files copied into it."""
+    for ext in ['.in', '.tpl', '.out', '.csv', '.log']:
+        if os.path.exists(os.path.join(model.workspace, 'lr_'+model.lumprem_model_name+ext)):
+            os.remove(os.path.join(model.workspace, 'lr_'+model.lumprem_model_name+ext))
+    if workspace == None and len(glob.glob(os.path.join(model.workspace, 'lr_*.in'))) == 0:
+        shutil.rmtree(model.workspace, ignore_errors=True)
+
+
+def extend(model, numdays, workspace=None, nstep=1, mxiter=100, tol=1.0e-5, noutdays=None, outdays=[],
+           version=1, engine='lumprem', keep=False, print_output=True):
+    """Extends the run of a model by numdays days, starting from the end state of its output file, and appends the
+    new outputs to lr_<model_name>.out.
+
+    Parameters
+    ----------
+    model : Model
+        lumprem Model object whose output file is extended.
+    numdays : int
+        number of new days to simulate.
+    workspace : path, optional
+        folder of the continuation run (default None, the folder 'continue' in the model's workspace).
+    nstep, mxiter, tol : optional
+        solution settings, see Model.write_model.
+    noutdays : int, optional
+        number of output days of the new days (default None, every day).
+    outdays : list, optional
+        output days of the continuation run, counted from the end of the existing run. If provided, noutdays is
+        its length.
+    version : int, optional
+        1 (default) LUMPREM, 2 LUMPREM2.
+    engine : str, optional
+        'lumprem' (default) calls the executable, 'numpy' runs the in-process engine.
+    keep : bool, optional
+        True, the continuation files are not removed (default False).
+    print_output : bool, optional
+        True (default), the extended file is printed.
+
+    Returns
+    -------
+    state : dict
+        state the continuation started from, see end_state.
+    """
+    name = model.lumprem_model_name
+    filename = os.path.join(model.workspace, 'lr_'+name+'.out')
+    folder = os.path.join(model.workspace, 'continue') if workspace == None else workspace
+
+    with profiling.stage('extend', name):
+        state = end_state(filename, rdelay=model.rdelay, mdelay=model.mdelay)
+        new = continuation(model, state, folder)
+        if len(outdays) > 0:
+            noutdays = len(outdays)
+        new.write_model(numdays=numdays, noutdays=noutdays, outdays=outdays, nstep=nstep, mxiter=mxiter, tol=tol,
+                        state=state, print_output=False)
+        new.run_model(print_output=False, version=version, engine=engine)
+        newfile = os.path.join(folder, 'lr_'+name+'.out')
+        if not os.path.exists(newfile):
+            raise RuntimeError('The continuation run of '+name+' did not write '+newfile)
+        splice_out(filename, newfile, state['day'])
+
+    if keep == False:
+        remove_run(new, workspace)
+    if print_output == True:
+        print('LUMPREM output extended by '+str(numdays)+' days: \n'+filename)
+    return state
+
+
+def write_state(infile, state):
+    """Sets the initial conditions of a LUMPREM input file (e.g. one written by LUMPREP) to a state, in place.
+
+    Parameters
+    ----------
+    infile : str
+        LUMPREM input file.
+    state : dict
+        'vol', 'vol_br', 'rbuf' and 'mbuf', as returned by end_state or spinup.
+    """
+    with open(infile) as f:
+        lines = f.read().splitlines(True)
+    i = [k for k, line in enumerate(lines) if line.startswith('* initial conditions')][0]
+    # volumes, buffer lengths, then the values of both buffers on one or more lines
+    nbuf = sum(int(x) for x in lines[i+2].split()[:2])
+    k = i+3
+    count = 0
+    while count < nbuf:
+        count += len(lines[k].split())
+        k += 1
+    old = lines[i+1].split()
+    vol_br = old[1] if len(old) > 1 and state['vol_br'] == None else state['vol_br']
+    if vol_br == None:
+        vol_br = ''
+    shared = lumprem.render_shared(0, 0, [], rbuf=state['rbuf'], mbuf=state['mbuf'])
+    block = "{0: <4} {1: <4} {2:}".format(state['vol'], vol_br, '\n')+shared['buffers']
+    with open(infile, 'w') as f:
+        f.write(''.join(lines[:i+1])+block+''.join(lines[k:]))
+
+
+def spinup(model_list, numdays=365, tol=1.0e-5, maxiter=100, workspace=None, workers=None, nstep=1, version=1,
+           engine='lumprem', keep=False, print_output=True):
+    """Runs the first numdays days of each model repeatedly, each time from the end state of the previous run, until
+    the soil moisture volumes and delay buffers change by less than tol. All models still spinning up are run
+    together; each stops as soon as it converges. The models are not modified.
+
+    Parameters
+    ----------
+    model_list : list
+        lumprem Model objects. The first run starts from their vol and vol_br with empty delay buffers.
+    numdays : int, optional
+        length of the spin-up window in days (default 365). Data files must cover it.
+    tol : float, optional
+        largest change of vol, vol_br or a buffer volume between two runs at convergence (default 1.0e-5). Values
+        are read from output files, so tolerances below their 7 significant digits are not reached.
+    maxiter : int, optional
+        largest number of runs of a model (default 100).
+    workspace : path, optional
+        folder of the spin-up runs (default None, the folder 'spinup' in each model's workspace).
+    workers : int, optional
+        number of LUMPREM processes to run at the same time (default None, the number of CPUs).
+    nstep : int, optional
+        number of steps per day (default 1).
+    version : int, optional
+        1 (default) LUMPREM, 2 LUMPREM2.
+    engine : str, optional
+        'lumprem' (default) calls the executable, 'numpy' runs each folder of models as one in-process batch.
+    keep : bool, optional
+        True, the spin-up files are not removed (default False).
+    print_output : bool, optional
+        True (default), a summary is printed.
+
+    Returns
+    -------
+    states : dict
+        model name to converged state ('day', 'vol', 'vol_br', 'rbuf', 'mbuf'). Pass it to Model.write_model
+        (state=...), lumprem.write_models (states=...) or write_state.
+    status : DataFrame
+        model_name, iterations, change of the last iteration and converged, one row per model.
+    """
+    from lumpyrem import ensemble
+    from lumpyrem import engine as lrengine
+    import pandas as pd
+
+    copies = []
+    for m in model_list:
+        folder = os.path.join(m.workspace, 'spinup') if workspace == None else workspace
+        ensemble.scratch_folder([m], folder)
+        new = copy.copy(m)
+        new.workspace = folder
+        copies.append(new)
+
+    states = {m.lumprem_model_name:{'day':0, 'vol':m.vol, 'vol_br':m.vol_br, 'rbuf':[0.0], 'mbuf':[0.0]}
+              for m in model_list}
+    status = pd.DataFrame({'model_name':[m.lumprem_model_name for m in model_list], 'iterations':0,
+                           'change':np.inf, 'converged':False})
+    active = list(range(len(copies)))
+
+    with profiling.stage('spinup', str(len(copies))+' models'):
+        for iteration in range(maxiter):
+            if len(active) == 0:
+                break
+            for i in active:
+                m = copies[i]
+                width = int(np.floor(max(m.rdelay, m.mdelay)))+1
+                outdays = list(range(max(numdays-width, 1), numdays+1))
+                m.write_model(numdays=numdays, noutdays=len(outdays), outdays=outdays, nstep=nstep,
+                              state=states[m.lumprem_model_name], print_output=False)
+            if engine == 'numpy':
+                folders = {}
+                for i in active:
+                    folders.setdefault(copies[i].workspace, []).append('lr_'+copies[i].lumprem_model_name+'.in')
+                for folder, files in folders.items():
+                    lrengine.run_files(files, workspace=folder, version=version)
+            else:
+                runs = lumprem.run_models([copies[i] for i in active], workers=workers, version=version)
+                failed = [copies[i].lumprem_model_name for i, ok in zip(active, runs['success']) if ok == False]
+                if len(failed) > 0:
+                    raise RuntimeError('Spin-up runs failed: '+', '.join(failed))
+
+            still = []
+            for i in active:
+                m = copies[i]
+                name = m.lumprem_model_name
+                new = end_state(os.path.join(m.workspace, 'lr_'+name+'.out'), rdelay=m.rdelay, mdelay=m.mdelay)
+                old = states[name]
+                change = state_change(old, new)
+                new['day'] = 0
+                states[name] = new
+                status.loc[i, 'iterations'] = iteration+1
+                status.loc[i, 'change'] = change
+                if change <= tol:
+                    status.loc[i, 'converged'] = True
+                else:
+                    still.append(i)
+            active = still
+
+    if keep == False:
+        for m in copies:
+            remove_run(m, workspace)
+    if print_output == True:
+        print(str(status['converged'].sum())+' of '+str(len(status))+' models spun up in at most '
+              +str(status['iterations'].max())+' runs of '+str(numdays)+' days.')
+    return states, status
+
+
+def state_change(old, new):
+    """Returns the largest absolute difference between the volumes and buffer volumes of two states."""
+    def values(state):
+        vol_br = 0.0 if state['vol_br'] == None else state['vol_br']
+        return np.concatenate([[state['vol'], vol_br], state['rbuf'], state['mbuf']])
+    a = values(old)
+    b = values(new)
+    if len(a) != len(b):
+        # the first run starts from buffers of another length
+        return np.inf
+    return float(np.abs(a-b).max())
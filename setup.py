@@ -13,6 +13,7 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/rhugman/lumpyrem",
     packages=setuptools.find_packages(),
+    package_data={"lumpyrem": ["data/*.csv"]},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -0,0 +1,19 @@
+import os
+import sys
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STANDIN = os.path.join(HERE, '..', 'benchmarks', 'lumprem_standin.py')
+
+
+@pytest.fixture
+def standin(tmp_path, monkeypatch):
+    """Puts a 'lumprem' launcher for the benchmark stand-in first on PATH."""
+    folder = str(tmp_path/'bin')
+    os.makedirs(folder)
+    exe = os.path.join(folder, 'lumprem')
+    with open(exe, 'w') as f:
+        f.write('#!/bin/sh\nexec "'+sys.executable+'" "'+STANDIN+'" "$@"\n')
+    os.chmod(exe, 0o755)
+    monkeypatch.setenv('PATH', folder+os.pathsep+os.environ.get('PATH', ''))
+    return exe
@@ -0,0 +1,51 @@
+import os
+import shutil
+from lumpyrem import lumprem, cache
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), '..', 'examples', 'workspace')
+
+
+def realizations(tmp_path, n):
+    """Writes model abc in folders r0 ... r<n-1>, each with a different maxvol."""
+    models = []
+    for r in range(n):
+        folder = str(tmp_path/('r'+str(r)))
+        os.makedirs(folder)
+        for f in ['rain.dat', 'epot.dat']:
+            shutil.copy(os.path.join(EXAMPLES, f), folder)
+        model = lumprem.Model('abc', workspace=folder, maxvol=0.5+0.1*r)
+        model.write_model(numdays=30, print_output=False)
+        models.append(model)
+    return models
+
+
+def test_run_jobs_order_same_names(tmp_path, standin):
+    models = realizations(tmp_path, 3)
+    runs = cache.RunCache(str(tmp_path/'cache'))
+    lumprem.run_models([models[1]], cache=runs)
+
+    status = lumprem.run_models(models, cache=runs)
+    assert list(status['model_name']) == ['abc', 'abc', 'abc']
+    assert list(status['cached']) == [False, True, False]
+    assert status['success'].all()
+
+
+def test_store_shared_cache_dir(tmp_path):
+    folder = str(tmp_path/'run')
+    os.makedirs(folder)
+    with open(os.path.join(folder, 'lr_abc.out'), 'w') as f:
+        f.write('outputs')
+    first = cache.RunCache(str(tmp_path/'cache'), max_size=10)
+    second = cache.RunCache(str(tmp_path/'cache'), max_size=10)
+    third = cache.RunCache(str(tmp_path/'cache'), max_size=10)
+
+    first.store('a', ['lr_abc.out'], folder)
+    # stored by another instance: found on disk, and storing it again is not an error
+    assert second.restore('a', ['lr_abc.out'], folder) == True
+    second.store('a', ['lr_abc.out'], folder)
+    assert sorted(os.listdir(str(tmp_path/'cache'))) == ['a']
+
+    # entries of other instances count towards max_size
+    os.utime(os.path.join(str(tmp_path/'cache'), 'a'), (0, 0))
+    third.store('b', ['lr_abc.out'], folder)
+    assert sorted(os.listdir(str(tmp_path/'cache'))) == ['b']
@@ -0,0 +1,63 @@
+import os
+import shutil
+import numpy as np
+import pytest
+from lumpyrem import lumprem, engine
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), '..', 'examples')
+MODELS = ['abc', 'def', 'ghi', 'ele', 'ghb', 'ghj']
+MODELS_BR = ['lu1', 'lu2']
+
+
+def copy_inputs(src, path):
+    for f in os.listdir(src):
+        if not f.endswith('.out'):
+            shutil.copy(os.path.join(src, f), path)
+
+
+@pytest.fixture(scope='module')
+def workspace(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('engine'))
+    copy_inputs(os.path.join(EXAMPLES, 'workspace'), path)
+    engine.run_files(['lr_'+n+'.in' for n in MODELS], workspace=path)
+    return path
+
+
+@pytest.fixture(scope='module')
+def workspace_br(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('engine_br'))
+    copy_inputs(os.path.join(EXAMPLES, 'flopy', 'lumprem'), path)
+    engine.run_files(['lr_'+n+'.in' for n in MODELS_BR], workspace=path, version=2)
+    return path
+
+
+def assert_matches(filename, expected_filename):
+    expected = lumprem.read_out(expected_filename)
+    result = lumprem.read_out(filename)
+    assert list(result.columns) == list(expected.columns)
+    # LUMPREM works in single precision: volumes agree to ~2e-6, elevations to a few 1e-5 relative
+    for c in expected.columns:
+        np.testing.assert_allclose(result[c].values, expected[c].values, rtol=2e-5, atol=1e-5, err_msg=c)
+
+
+@pytest.mark.parametrize('name', MODELS)
+def test_run_files_matches_lumprem(workspace, name):
+    assert_matches(os.path.join(workspace, 'lr_'+name+'.out'),
+                   os.path.join(EXAMPLES, 'workspace', 'lr_'+name+'.out'))
+
+
+@pytest.mark.parametrize('name', MODELS_BR)
+def test_run_files_matches_lumprem2(workspace_br, name):
+    assert_matches(os.path.join(workspace_br, 'lr_'+name+'.out'),
+                   os.path.join(EXAMPLES, 'flopy', 'lumprem', 'lr_'+name+'.out'))
+
+
+def test_unvalidated_settings_rejected(tmp_path):
+    copy_inputs(os.path.join(EXAMPLES, 'workspace'), str(tmp_path))
+    with pytest.raises(ValueError, match='gamma'):
+        engine.run_models([lumprem.Model('abc', vegfile=(0.5, 2.0), workspace=str(tmp_path))], numdays=10)
+    with pytest.raises(ValueError, match='second bucket'):
+        engine.run_models([lumprem.Model('abc', second_bucket=True, workspace=str(tmp_path))], numdays=10,
+                          version=2)
+    # the second bucket is ignored with LUMPREM outputs, as by LUMPREM
+    engine.run_models([lumprem.Model('abc', second_bucket=True, workspace=str(tmp_path))], numdays=10)
@@ -0,0 +1,31 @@
+import os
+import shutil
+import pandas as pd
+from lumpyrem import lumprem, lr2series, pest, forward
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), '..', 'examples', 'workspace')
+MODELS = ['abc', 'def', 'ghi']
+
+
+def test_forward_run_copied_folder(tmp_path):
+    setup = str(tmp_path/'setup')
+    os.makedirs(setup)
+    for f in ['rain.dat', 'epot.dat', 'irrig.in']+['lr_'+n+'.in' for n in MODELS]:
+        shutil.copy(os.path.join(EXAMPLES, f), setup)
+
+    models = [lumprem.Model(n, workspace=setup) for n in MODELS]
+    ts = lr2series.TimeSeries('rch.ts', models, ['rch'], ['total_rech'], ['linearend'], workspace=setup)
+    obs = pd.DataFrame({'date':['10/01/2000', '20/02/2000'], 'abc':[1.0, 2.0]})
+    observations = pest.Observations(obs, '01/01/2000', workspace=setup)
+    forward.write_setup(os.path.join(setup, 'forward.pkl'), timeseries=[ts], observations=observations)
+
+    # as a PEST++ agent: run a copy of the setup folder
+    agent = str(tmp_path/'agent')
+    shutil.copytree(setup, agent)
+    exit_status = forward.main(['--workspace', agent, '--engine', 'numpy', '--setup', os.path.join(agent, 'forward.pkl'),
+                                '--quiet'])
+
+    assert exit_status == 0
+    for f in ['rch.ts', 'lr_obs.dat']+['lr_'+n+'.out' for n in MODELS]:
+        assert os.path.exists(os.path.join(agent, f))
+        assert not os.path.exists(os.path.join(setup, f))
@@ -0,0 +1,39 @@
+import pytest
+from lumpyrem import lumprem, pest, ensemble
+
+
+def test_par_names_unique():
+    model = lumprem.Model('abc', second_bucket=True, vol_br=0.2)
+    names = []
+    for p, value in model.__dict__.items():
+        if type(value) in [int, float, tuple] and p != 'second_bucket':
+            names += [n.lower() for n in lumprem.par_names(p, model.lumprem_model_name)]
+    assert len(names) == len(set(names))
+    assert lumprem.par_names('elevmax', 'abc') != lumprem.par_names('extravol_br', 'abc')
+    assert lumprem.par_names('ks', 'abc') != lumprem.par_names('ks_br', 'abc')
+    assert lumprem.par_names('maxvol', 'abc') != lumprem.par_names('maxvol_br', 'abc')
+
+
+def test_parameter_map_second_bucket():
+    model = lumprem.Model('abc', second_bucket=True)
+    names = lumprem.par_names('elevmax', 'abc')+lumprem.par_names('extravol_br', 'abc')+lumprem.par_names('ks_br', 'abc')
+    targets = ensemble.parameter_map([model], names)
+    assert [t[1] for t in targets[0]] == ['elevmax', 'extravol_br', 'ks_br']
+
+
+def test_parameter_data_fixed_within_bounds():
+    models = [lumprem.Model('abc'), lumprem.Model('def', irrigfile=(1, 0.3))]
+    par = pest.parameter_data(models)
+    # irrigation off: gwirfr is 0.0, fixed and inside its bounds
+    assert par.loc['if_abc', 'partrans'] == 'fixed'
+    assert par.loc['if_abc', 'parval1'] == 0.0
+    assert (par['parlbnd'] <= par['parval1']).all()
+    assert (par['parval1'] <= par['parubnd']).all()
+    # adjustable parameters keep the default bounds
+    assert par.loc['if_def', 'partrans'] == 'log'
+    assert par.loc['if_def', 'parlbnd'] == 0.001
+
+
+def test_parameter_data_duplicate_names():
+    with pytest.raises(ValueError):
+        pest.parameter_data([lumprem.Model('catchment1'), lumprem.Model('catchment2')])
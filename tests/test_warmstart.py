@@ -0,0 +1,37 @@
+import os
+import shutil
+from lumpyrem import lumprem, warmstart
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), '..', 'examples', 'workspace')
+
+
+def test_spinup_lumprem_timing_block(tmp_path, standin):
+    workspace = str(tmp_path/'model')
+    os.makedirs(workspace)
+    for f in ['rain.dat', 'epot.dat']:
+        shutil.copy(os.path.join(EXAMPLES, f), workspace)
+    model = lumprem.Model('abc', workspace=workspace)
+
+    states, status = warmstart.spinup([model], numdays=30, maxiter=3, engine='lumprem', keep=True,
+                                      print_output=False)
+
+    assert status['iterations'].iloc[0] >= 1
+    assert 'abc' in states
+    with open(os.path.join(workspace, 'spinup', 'lr_abc.in')) as f:
+        lines = f.read().splitlines()
+    i = [k for k, line in enumerate(lines) if line.startswith('* timing')][0]
+    numdays, noutdays = [int(x) for x in lines[i+1].split()[:2]]
+    days = []
+    for line in lines[i+2:]:
+        if line.startswith('*'):
+            break
+        days += [int(x) for x in line.split()]
+    assert numdays == 30
+    assert noutdays == len(days)
+    assert days[-1] == 30
+
+
+def test_get_outdays_explicit():
+    numdays, noutdays, outdays = lumprem.get_outdays(numdays=365, outdays=[360, 365])
+    assert noutdays == 2
+    assert list(outdays) == [360, 365]